@@ -1,56 +1,195 @@
-from django.contrib import admin
+from cacheops import invalidate_model
+from django.conf import settings
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
 
-from .models import Item, Image, Comment, MyUser, Vote, Favourite
+from . import tags, usercache
+from .counting import EstimatedCountPaginator
+from .models import Item, Image, Comment, MyUser, Vote, Favourite, ReportImage
 
 
-class VotesInline(admin.TabularInline):
-    model = Image.votes.through
-    verbose_name = "Vote"
-    verbose_name_plural = "Votes"
-    extra = 1
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Shows one page of the related rows, chosen by the <prefix>-page parameter of the change page.
+    """
+    page_number = 1
 
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            paginator = Paginator(super().get_queryset(), settings.ADMIN_INLINE_PER_PAGE)
+            self.page = paginator.get_page(self.page_number)
+        return self.page.object_list
 
-class CommentsInline(admin.TabularInline):
-    model = Image.comments.through
-    verbose_name = "Comment"
-    verbose_name_plural = "Comments"
-    extra = 1
+    def changelist_url(self) -> str:
+        opts = self.model._meta
+        return '{}?{}__id__exact={}'.format(reverse('admin:{}_{}_changelist'.format(opts.app_label, opts.model_name)),
+                                            self.fk.name, self.instance.pk)
 
 
-class FavouritesInline(admin.TabularInline):
-    model = Image.favourites.through
-    verbose_name = "Favourite"
-    verbose_name_plural = "Favourite"
-    extra = 1
+class ReadOnlyPaginatedInline(admin.TabularInline):
+    """
+    Read-only page of rows related to the edited object, all of them are in the changelist of the model.
+    """
+    formset = PaginatedInlineFormSet
+    template = 'admin/restapi/paginated_tabular.html'
+    extra = 0
+    can_delete = False
+    show_change_link = True
+    related = ()
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.related)
 
-class ReportsInline(admin.TabularInline):
-    model = Image.reports.through
-    verbose_name = "Report"
-    verbose_name_plural = "Report"
-    extra = 1
+    def get_readonly_fields(self, request, obj=None):
+        return self.fields
 
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_number = request.GET.get('{}-page'.format(formset.get_default_prefix()), 1)
+        return formset
 
-class ImageInline(admin.ModelAdmin):
-    model = Image
-    exclude = ("votes", "comments")
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ImageVotesInline(ReadOnlyPaginatedInline):
+    model = Vote
+    fields = ('user', 'upvote', 'created_at')
+    related = ('user',)
+
+
+class ImageCommentsInline(ReadOnlyPaginatedInline):
+    model = Comment
+    fields = ('user', 'comment_text', 'created_at')
+    related = ('user',)
+
+
+class ImageFavouritesInline(ReadOnlyPaginatedInline):
+    model = Favourite
+    fields = ('user',)
+    related = ('user',)
+
+
+class ImageReportsInline(ReadOnlyPaginatedInline):
+    model = ReportImage
+    fields = ('user', 'comment', 'created_at')
+    related = ('user',)
+
+
+class UserVotesInline(ImageVotesInline):
+    fields = ('image', 'upvote', 'created_at')
+    related = ('image__user',)
+
+
+class UserCommentsInline(ImageCommentsInline):
+    fields = ('image', 'comment_text', 'created_at')
+    related = ('image__user',)
+
+
+class UserFavouritesInline(ImageFavouritesInline):
+    fields = ('image',)
+    related = ('image__user',)
+
+
+class UserReportsInline(ImageReportsInline):
+    fields = ('image', 'comment', 'created_at')
+    related = ('image__user',)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    Changelists of big tables: estimated counts and no second count of the unfiltered table.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ImageAdmin(ScalableAdmin):
+    list_display = ('id', 'title', 'user', 'public', 'possible_duplicate', 'created_at')
+    list_filter = ('public', 'possible_duplicate')
+    list_select_related = ('user',)
+    search_fields = ('=id', 'title')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('blob',)
+    exclude = ("votes", "comments", "favourites", "reports", "tags")
     inlines = (
-        VotesInline, CommentsInline, FavouritesInline, ReportsInline
+        ImageVotesInline, ImageCommentsInline, ImageFavouritesInline, ImageReportsInline
     )
+    actions = ('make_public', 'make_private', 'clear_possible_duplicate')
+
+    def set_visibility(self, request, queryset, public: bool):
+        image_ids = list(queryset.values_list('pk', flat=True))
+        updated = queryset.update(public=public)
+        invalidate_model(Image)
+        tags.sync_images(image_ids)  # postings follow the visibility
+        usercache.bump_images(image_ids)
+        self.message_user(request, '{} images updated'.format(updated), messages.SUCCESS)
+
+    def make_public(self, request, queryset):
+        self.set_visibility(request, queryset, True)
+    make_public.short_description = 'Make selected images public'
+
+    def make_private(self, request, queryset):
+        self.set_visibility(request, queryset, False)
+    make_private.short_description = 'Make selected images private'
+
+    def clear_possible_duplicate(self, request, queryset):
+        image_ids = list(queryset.values_list('pk', flat=True))
+        updated = queryset.update(possible_duplicate=False)
+        invalidate_model(Image)
+        usercache.bump_images(image_ids)
+        self.message_user(request, '{} images updated'.format(updated), messages.SUCCESS)
+    clear_possible_duplicate.short_description = 'Mark selected images as not duplicate'
 
 
 class UserAdmin(BaseUserAdmin):
-    exclude = ("votes", "comments")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = (
-        VotesInline, CommentsInline, FavouritesInline, ReportsInline
+        UserVotesInline, UserCommentsInline, UserFavouritesInline, UserReportsInline
     )
+    actions = ('deactivate',)
+
+    def deactivate(self, request, queryset):
+        updated = queryset.update(is_active=False)
+        invalidate_model(MyUser)
+        self.message_user(request, '{} users deactivated'.format(updated), messages.SUCCESS)
+    deactivate.short_description = 'Deactivate selected users'
+
+
+class ImageRelationAdmin(ScalableAdmin):
+    list_select_related = ('image__user', 'user')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('image',)
+
+
+class VoteAdmin(ImageRelationAdmin):
+    list_display = ('id', 'image', 'user', 'upvote', 'created_at')
+    list_filter = ('upvote',)
+
+
+class CommentAdmin(ImageRelationAdmin):
+    list_display = ('id', 'image', 'user', 'created_at')
+    search_fields = ('=id',)
+
+
+class FavouriteAdmin(ImageRelationAdmin):
+    list_display = ('id', 'image', 'user')
 
 
 admin.site.register(MyUser, UserAdmin)
 
 admin.site.register(Item)
-admin.site.register(Image, ImageInline)
-admin.site.register(Favourite)
-admin.site.register(Comment)
-admin.site.register(Vote)
+admin.site.register(Image, ImageAdmin)
+admin.site.register(Favourite, FavouriteAdmin)
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(Vote, VoteAdmin)
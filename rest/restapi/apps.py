@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class RestapiConfig(AppConfig):
     name = 'restapi'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from django.conf import settings
+        if settings.TRACING_ENABLED:
+            from . import tracing
+            tracing.install()
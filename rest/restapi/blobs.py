@@ -0,0 +1,156 @@
+"""
+Content addressed image storage.
+
+Image bytes are stored once under blobs/<sha256[:2]>/<sha256>.<ext>, every Image points to its Blob
+and the blob counts its references. The object is enqueued for deletion when the last reference is released.
+Keys never change content, so objects are served with far-future Cache-Control.
+"""
+import hashlib
+import os
+from typing import Callable, Tuple
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from minio import error as merr
+from minio.copy_conditions import CopyConditions
+
+from .models import Blob, StorageTombstone
+from .tombstones import enqueue_deletion
+
+BLOB_PREFIX = 'blobs/'
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class BlobError(Exception):
+    pass
+
+
+class ObjectChanged(BlobError):
+    """
+    The object was replaced after it was verified.
+    """
+
+
+def blob_key(sha256: str, extension: str) -> str:
+    return '{}{}/{}{}'.format(BLOB_PREFIX, sha256[:2], sha256, extension)
+
+
+def blob_metadata(content_type: str) -> dict:
+    return {
+        'Content-Type': content_type,
+        'Cache-Control': settings.BLOB_CACHE_CONTROL,
+    }
+
+
+def hash_file(file) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in file.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def hash_object(object_name: str, etag: str) -> Tuple[str, int]:
+    """
+    Hash and size of the object if its etag is still etag, ObjectChanged otherwise.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        response = default_storage.client.get_object(default_storage.bucket_name, object_name,
+                                                     request_headers={'If-Match': etag})
+    except merr.PreconditionFailed:
+        raise ObjectChanged('{} was replaced'.format(object_name))
+    try:
+        for chunk in response.stream(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        response.close()
+        response.release_conn()
+    return digest.hexdigest(), size
+
+
+def _acquire(sha256: str, size: int, key: str, upload: Callable[[str], None]) -> Blob:
+    """
+    Adds a reference to the blob with the given hash, the object is uploaded only when the blob does not exist.
+    A blob released concurrently disappears between the lookup and the increment, then it is uploaded again.
+    """
+    for _ in range(3):
+        blob = Blob.objects.nocache().filter(sha256=sha256).first()
+        if blob is None:
+            with transaction.atomic():
+                # waits for a garbage collector deleting the object of a released blob with the same content
+                StorageTombstone.objects.filter(key=key).delete()
+                upload(key)
+                blob, _ = Blob.objects.get_or_create(sha256=sha256, defaults={'key': key, 'size': size})
+        if Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+            blob.ref_count += 1
+            return blob
+    raise BlobError('blob {} keeps disappearing'.format(sha256))
+
+
+def store_blob(file, content_type: str, extension: str, sha256: str = None) -> Blob:
+    """
+    Stores an uploaded file, sha256 is computed here unless the upload handler hashed the file already.
+    """
+    if sha256 is None:
+        sha256, size = hash_file(file)
+    else:
+        size = file.size
+
+    def upload(key):
+        file.seek(0)
+        default_storage.client.put_object(default_storage.bucket_name, key, file, size,
+                                          content_type=content_type, metadata=blob_metadata(content_type))
+
+    return _acquire(sha256, size, blob_key(sha256, extension), upload)
+
+
+def adopt_object(object_name: str, content_type: str, size: int = None, etag: str = None) -> Blob:
+    """
+    Turns an object uploaded directly to the storage into a blob. The object is hashed by reading it
+    from the storage and new content is copied to its blob key inside the storage.
+    Reading and copying are pinned to the etag (by default the current one), an object replaced in between
+    raises ObjectChanged. The caller enqueues deletion of the original object.
+    """
+    if etag is None:
+        stat = default_storage.client.stat_object(default_storage.bucket_name, object_name)
+        size, etag = stat.size, stat.etag
+    sha256, hashed_size = hash_object(object_name, etag)
+    if hashed_size != size:
+        raise ObjectChanged('{} has {} bytes instead of {}'.format(object_name, hashed_size, size))
+    extension = os.path.splitext(object_name)[1]
+
+    def upload(key):
+        conditions = CopyConditions()
+        conditions.set_match_etag(etag)
+        try:
+            default_storage.client.copy_object(default_storage.bucket_name, key,
+                                               '/{}/{}'.format(default_storage.bucket_name, object_name),
+                                               conditions=conditions, metadata=blob_metadata(content_type))
+        except merr.PreconditionFailed:
+            raise ObjectChanged('{} was replaced'.format(object_name))
+
+    return _acquire(sha256, size, blob_key(sha256, extension), upload)
+
+
+def release_blob(blob_id: int):
+    """
+    Drops a reference, the last one deletes the blob and enqueues deletion of its object.
+    The row is locked, so a concurrent upload of the same content waits and uploads it again.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.nocache().select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+            return
+        blob.delete()
+        enqueue_deletion([blob.key])
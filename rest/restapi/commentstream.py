@@ -0,0 +1,154 @@
+"""
+Live comments of an image as Server-Sent Events.
+
+Comment views publish every created, updated and deleted comment: a script appends it to a capped redis stream
+of the image (the backlog for resuming, kept COMMENT_STREAM_TIMEOUT seconds after the last comment) and publishes
+it on the channel of the image with its stream id. CommentStream serves images/:id/comment/stream, one pattern
+subscription of each process fans events out to listeners of the image.
+
+A listener resumes after the last event it got with ?since=<id> or the Last-Event-ID header sent by EventSource.
+"""
+import json
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+from cacheops.redis import redis_client
+from django.conf import settings
+from rest_framework.exceptions import APIException
+
+from . import sse
+from .models import Image
+from .permissions import CommentListViewPermission
+
+CHANNEL_PREFIX = 'comments:events:'
+EVENT_ID_RE = r'^\d+(-\d+)?$'
+
+# KEYS: stream, channel; ARGV: backlog length, timeout, event, data
+PUBLISH_EVENT = """
+local id = redis.call('xadd', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'event', ARGV[3], 'data', ARGV[4])
+redis.call('expire', KEYS[1], ARGV[2])
+redis.call('publish', KEYS[2], cjson.encode({id = id, event = ARGV[3], data = ARGV[4]}))
+return id
+"""
+
+
+@lru_cache(maxsize=None)
+def _publish_script():
+    return redis_client.register_script(PUBLISH_EVENT)
+
+
+def stream_key(image_id: int) -> str:
+    return 'comments:stream:{}'.format(image_id)
+
+
+def channel(image_id: int) -> str:
+    return '{}{}'.format(CHANNEL_PREFIX, image_id)
+
+
+def publish(image_id: int, event: str, data: dict) -> str:
+    """
+    Sends event (created, updated or deleted) with comment data to listeners of the image, returns its id.
+    """
+    event_id = _publish_script()(keys=[stream_key(image_id), channel(image_id)],
+                                 args=[settings.COMMENT_STREAM_BACKLOG, settings.COMMENT_STREAM_TIMEOUT, event,
+                                       json.dumps(data)],
+                                 client=redis_client)
+    return event_id.decode() if isinstance(event_id, bytes) else event_id
+
+
+def parse_event_id(event_id: str) -> Tuple[int, int]:
+    milliseconds, _, sequence = event_id.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+@sse.database_sync_to_async
+def authorize(scope: dict, image_id: int) -> int:
+    """
+    Status of the stream request: 200 when the user may read comments of the image, like GET images/:id/comment.
+    """
+    request = sse.request_for(scope)
+    try:
+        image = Image.objects.get(pk=image_id)
+    except Image.DoesNotExist:
+        return 404
+    try:
+        permitted = CommentListViewPermission().has_permission_on_image(request, image)
+    except APIException:
+        return 401
+    return 200 if permitted else 403
+
+
+class CommentHub(sse.Hub):
+    pattern = CHANNEL_PREFIX + '*'
+
+    async def handle(self, message: dict):
+        self.deliver(int(message['channel'][len(CHANNEL_PREFIX):]), json.loads(message['data']))
+
+
+class CommentStream(sse.Stream):
+    path = r'^/images/(?P<pk>\d+)/comment/stream$'
+
+    def __init__(self):
+        self.hub = CommentHub()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = sse.async_redis_client()
+        return self._client
+
+    async def close(self):
+        await self.hub.close()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def serve(self, scope, receive, send, pk: str):
+        image_id = int(pk)
+        since = _since(scope)
+        if since is not None and not re.match(EVENT_ID_RE, since):
+            return await sse.send_error(send, 400, 'since has to be an event id')
+        status = await authorize(scope, image_id)
+        if status != 200:
+            return await sse.send_error(send, status, sse.ERRORS[status])
+
+        queue = await self.hub.join([image_id])
+        try:
+            # events published after subscribing may also be in the backlog, ids up to last were sent
+            if since is None:
+                newest = await self.client.xrevrange(stream_key(image_id), '+', '-', count=1)
+                last = parse_event_id(newest[0][0]) if newest else (0, 0)
+                backlog = []
+            else:
+                last = parse_event_id(since)
+                backlog = await self.client.xrange(stream_key(image_id), since, '+',
+                                                   count=settings.COMMENT_STREAM_BACKLOG)
+            await sse.start(send)
+            for event_id, fields in backlog:
+                if parse_event_id(event_id) > last:
+                    last = parse_event_id(event_id)
+                    await sse.send_body(send, sse.format_event(fields['event'], fields['data'], event_id))
+
+            def render(event: dict) -> Optional[bytes]:
+                nonlocal last
+                if parse_event_id(event['id']) <= last:
+                    return None
+                last = parse_event_id(event['id'])
+                return sse.format_event(event['event'], event['data'], event['id'])
+            await sse.relay(receive, send, queue, render)
+        finally:
+            self.hub.leave(queue)
+        await sse.finish(send)
+
+
+def _since(scope: dict) -> Optional[str]:
+    since = parse_qs(scope.get('query_string', b'').decode()).get('since')
+    if since:
+        return since[-1]
+    for name, value in scope.get('headers', []):
+        if name == b'last-event-id':
+            return value.decode()
+    return None
@@ -0,0 +1,97 @@
+"""
+Response compression with brotli (when the brotli package is installed) or gzip, chosen by Accept-Encoding.
+
+Bodies of at least COMPRESSION_MIN_SIZE bytes are compressed, streamed bodies chunk by chunk. Compressed bodies of
+cacheable responses are kept in redis under the digest of the identity body for COMPRESSION_CACHE_TIMEOUT seconds,
+so a hot response is compressed once and not on every request: the same body gives the same key whatever user or
+url produced it, and the key can only be computed from the body itself.
+"""
+import gzip
+import hashlib
+import zlib
+from typing import Iterable, Iterator, List, Optional
+
+from cacheops.redis import redis_client
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+BROTLI, GZIP = 'br', 'gzip'
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/openapi', 'application/problem+json')
+
+
+def available_encodings() -> List[str]:
+    return [BROTLI, GZIP] if brotli is not None else [GZIP]
+
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Preferred encoding of available_encodings() accepted by the Accept-Encoding header, None for identity.
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and content_type != 'text/event-stream'
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    # no mtime, the same body always gives the same bytes
+    return gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def cache_key(body: bytes, encoding: str) -> str:
+    return 'compressed:{}:{}'.format(encoding, hashlib.sha1(body).hexdigest())
+
+
+def cached_compress(body: bytes, encoding: str) -> bytes:
+    """
+    compress() of body read from redis, compressed and stored when missing.
+    """
+    key = cache_key(body, encoding)
+    compressed = redis_client.get(key)
+    if compressed is None:
+        compressed = compress(body, encoding)
+        redis_client.set(key, compressed, ex=settings.COMPRESSION_CACHE_TIMEOUT)
+    return compressed
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """
+    Compressed chunks, every chunk is flushed to the client as soon as it is produced.
+    """
+    if encoding == BROTLI:
+        compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -0,0 +1,122 @@
+"""
+Row counts of big tables without scanning them.
+
+COUNT(*) in PostgreSQL reads the whole table or an index of it. An unfiltered queryset of a table the planner
+estimates at ESTIMATED_COUNT_THRESHOLD rows or more is counted from pg_class.reltuples instead, which autovacuum
+and ANALYZE keep close to the truth. Smaller tables, filtered querysets and other databases are counted exactly.
+
+Paginated API lists count in one of the modes: EXACT, CAPPED (rows up to PAGINATION_COUNT_CAP, more are reported
+as the cap) or ESTIMATED (the estimate of the table or of the query plan from ESTIMATED_COUNT_THRESHOLD rows).
+Counts which are not exact are cached for PAGINATION_COUNT_TIMEOUT seconds.
+"""
+import hashlib
+import json
+from typing import Optional, Tuple, Type
+
+from cacheops import CacheMiss, cache
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Model, QuerySet
+from django.utils.functional import cached_property
+
+EXACT, CAPPED, ESTIMATED = 'exact', 'capped', 'estimated'
+
+
+def estimated_count(model: Type[Model], using: str = 'default') -> Optional[int]:
+    """
+    Planner estimate of the rows of the table of model, None when there is none.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 until the table is analyzed for the first time
+    return row[0] if row is not None and row[0] >= 0 else None
+
+
+def is_whole_table(queryset: QuerySet) -> bool:
+    query = queryset.query
+    return not query.where and not query.distinct and not query.combinator and \
+        query.low_mark == 0 and query.high_mark is None
+
+
+def fast_count(queryset: QuerySet) -> int:
+    """
+    Number of rows of queryset, estimated for an unfiltered queryset of a big table.
+    """
+    if is_whole_table(queryset):
+        estimate = estimated_count(queryset.model, queryset.db)
+        if estimate is not None and estimate >= settings.ESTIMATED_COUNT_THRESHOLD:
+            return estimate
+    return queryset.count()
+
+
+def planner_estimate(queryset: QuerySet) -> Optional[int]:
+    """
+    Rows of queryset the PostgreSQL planner expects, None with other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def capped_count(queryset: QuerySet, cap: int) -> Tuple[int, bool]:
+    count = queryset.order_by()[:cap + 1].count()
+    return (cap, False) if count > cap else (count, True)
+
+
+def estimated_or_exact_count(queryset: QuerySet) -> Tuple[int, bool]:
+    estimate = estimated_count(queryset.model, queryset.db) if is_whole_table(queryset) else \
+        planner_estimate(queryset)
+    if estimate is None or estimate < settings.ESTIMATED_COUNT_THRESHOLD:
+        return queryset.count(), True
+    return estimate, False
+
+
+def paginated_count(queryset: QuerySet, mode: str) -> Tuple[int, bool]:
+    """
+    Count of queryset in mode and whether it is exact.
+    """
+    if mode == EXACT:
+        return queryset.count(), True
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, True
+    digest = hashlib.md5('{}\n{!r}'.format(sql, params).encode()).hexdigest()
+    key = 'pagination:count:{}:{}'.format(mode, digest)
+    try:
+        return cache.get(key)
+    except CacheMiss:
+        pass
+    if mode == CAPPED:
+        counted = capped_count(queryset, settings.PAGINATION_COUNT_CAP)
+    else:
+        counted = estimated_or_exact_count(queryset)
+    # exact counts are cheap (at most PAGINATION_COUNT_CAP or ESTIMATED_COUNT_THRESHOLD rows) and must be current
+    if not counted[1]:
+        cache.set(key, counted, settings.PAGINATION_COUNT_TIMEOUT)
+    return counted
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator of the admin changelists, pages of big tables are numbered from the estimate.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        if isinstance(self.object_list, QuerySet):
+            return fast_count(self.object_list)
+        return super().count
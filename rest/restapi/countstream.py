@@ -0,0 +1,131 @@
+"""
+Live vote and favourite counts of images as Server-Sent Events.
+
+ImageVoteView and ImageFavouriteView publish the id of the image on one channel for every change. Each process
+collects the changed images and every COUNT_STREAM_INTERVAL seconds loads counts of those someone listens to,
+with two grouped queries for all of them, and sends the counts which differ from the last sent ones. However
+many votes an image gets, a listener gets at most one message per image and interval.
+
+images/counts/stream?ids=1,2,3 starts with the current counts of the images.
+"""
+import asyncio
+import json
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from cacheops.redis import redis_client
+from django.conf import settings
+from django.db.models import Count, Q
+from rest_framework.exceptions import APIException
+
+from . import sse
+from .models import Favourite, Image, Vote
+
+CHANNEL = 'counts:changed'
+
+
+def changed(image_id: int):
+    redis_client.publish(CHANNEL, image_id)
+
+
+def load_counts(image_ids: List[int]) -> Dict[int, dict]:
+    counts = {image_id: {'id': image_id, 'upvote_count': 0, 'downvote_count': 0, 'favourite_count': 0}
+              for image_id in image_ids}
+    for image_id, upvote, count in Vote.objects.nocache().filter(image_id__in=image_ids).order_by() \
+            .values('image_id', 'upvote').annotate(count=Count('pk')).values_list('image_id', 'upvote', 'count'):
+        counts[image_id]['upvote_count' if upvote else 'downvote_count'] = count
+    for image_id, count in Favourite.objects.nocache().filter(image_id__in=image_ids).order_by() \
+            .values('image_id').annotate(count=Count('pk')).values_list('image_id', 'count'):
+        counts[image_id]['favourite_count'] = count
+    return counts
+
+
+@sse.database_sync_to_async
+def visible_images(scope: dict, image_ids: List[int]) -> Optional[List[int]]:
+    """
+    Ids of the images the user can see, like in GET images/. None when authentication failed.
+    """
+    try:
+        user = sse.request_for(scope).user
+    except APIException:
+        return None
+    images = Image.objects.nocache().filter(pk__in=image_ids)
+    if not user.is_superuser:
+        images = images.filter(Q(public=True) | Q(user_id=user.pk)) if user.is_authenticated \
+            else images.filter(public=True)
+    return sorted(images.values_list('pk', flat=True))
+
+
+class CountHub(sse.Hub):
+    pattern = CHANNEL
+
+    def __init__(self):
+        super().__init__()
+        self._changed = set()
+        self._sent = {}
+
+    async def handle(self, message: dict):
+        self._changed.add(int(message['data']))
+
+    def background(self) -> List:
+        return [self._flush_periodically()]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(settings.COUNT_STREAM_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        watched = self.watched()
+        image_ids = [image_id for image_id in self._changed if image_id in watched]
+        self._changed.clear()
+        self._sent = {image_id: counts for image_id, counts in self._sent.items() if image_id in watched}
+        if not image_ids:
+            return
+        counts = await sse.database_sync_to_async(load_counts)(image_ids)
+        for image_id, image_counts in counts.items():
+            if self._sent.get(image_id) != image_counts:
+                self._sent[image_id] = image_counts
+                self.deliver(image_id, image_counts)
+
+
+class CountStream(sse.Stream):
+    path = r'^/images/counts/stream$'
+
+    def __init__(self):
+        self.hub = CountHub()
+
+    async def close(self):
+        await self.hub.close()
+
+    async def serve(self, scope, receive, send):
+        try:
+            ids = parse_qs(scope.get('query_string', b'').decode()).get('ids', [''])[-1]
+            image_ids = sorted({int(image_id) for image_id in ids.split(',')})
+        except ValueError:
+            image_ids = []
+        if not 0 < len(image_ids) <= settings.COUNT_STREAM_MAX_IDS:
+            return await sse.send_error(send, 400, 'ids has to be 1 - {} image ids separated by comma'.format(
+                settings.COUNT_STREAM_MAX_IDS))
+
+        image_ids = await visible_images(scope, image_ids)
+        if image_ids is None:
+            return await sse.send_error(send, 401, sse.ERRORS[401])
+        if not image_ids:
+            return await sse.send_error(send, 404, sse.ERRORS[404])
+
+        # changes after joining are sent, the first counts may include some of them already
+        queue = await self.hub.join(image_ids)
+        try:
+            counts = await sse.database_sync_to_async(load_counts)(image_ids)
+            await sse.start(send)
+            for image_counts in counts.values():
+                await sse.send_body(send, _format(image_counts))
+            await sse.relay(receive, send, queue, _format)
+        finally:
+            self.hub.leave(queue)
+        await sse.finish(send)
+
+
+def _format(counts: dict) -> bytes:
+    return sse.format_event('counts', json.dumps(counts))
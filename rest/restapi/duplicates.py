@@ -0,0 +1,108 @@
+"""
+Near duplicate detection with perceptual hashes.
+
+Every image gets a 64 bit difference hash (dHash) of its downscaled grayscale copy, re-encoded or resized
+copies of an image differ in a few bits. Each process keeps all hashes in a numpy array and finds hashes
+within a Hamming distance by XOR and popcount over the whole array, a million hashes take a few milliseconds.
+ImageHash rows are only inserted, so the index loads new rows by id and reloads completely now and then
+to drop hashes of deleted images.
+"""
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PilImage
+from django.conf import settings
+
+from .models import ImageHash
+
+HASH_SIZE = 8
+
+
+def dhash(image: PilImage.Image) -> int:
+    """
+    Bits tell whether a pixel is brighter than its right neighbour in a 9x8 grayscale copy.
+    Returned as signed 64 bit integer, as it is stored.
+    """
+    pixels = list(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PilImage.BILINEAR).getdata())
+    value = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            value = value << 1 | (row[x] > row[x + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & (1 << 64) - 1).count('1')
+
+
+class HashIndex:
+    """
+    Hashes of all images of one process. Arrays are replaced, never modified,
+    so searches use a consistent snapshot without holding the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._image_ids = np.empty(0, dtype=np.int64)
+        self._hashes = np.empty(0, dtype=np.int64)
+        self._last_id = 0
+        self._loaded_at = None
+        self._refreshed_at = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    @staticmethod
+    def _rows(queryset) -> Tuple[int, np.ndarray, np.ndarray]:
+        rows = list(queryset.order_by('pk').values_list('pk', 'image_id', 'phash'))
+        if not rows:
+            return 0, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        ids, image_ids, hashes = zip(*rows)
+        return ids[-1], np.array(image_ids, dtype=np.int64), np.array(hashes, dtype=np.int64)
+
+    def refresh(self, force: bool = False):
+        """
+        Loads hashes inserted since the last refresh, at most every DUPLICATE_INDEX_REFRESH seconds unless forced,
+        and all hashes every DUPLICATE_INDEX_RELOAD seconds. The reload also picks up rows which committed
+        after rows with a higher id.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded_at is None or now - self._loaded_at > settings.DUPLICATE_INDEX_RELOAD:
+                last_id, self._image_ids, self._hashes = self._rows(ImageHash.objects.nocache())
+                self._last_id = max(last_id, self._last_id)
+                self._loaded_at = self._refreshed_at = now
+            elif force or now - self._refreshed_at > settings.DUPLICATE_INDEX_REFRESH:
+                last_id, image_ids, hashes = self._rows(ImageHash.objects.nocache().filter(pk__gt=self._last_id))
+                if len(hashes):
+                    self._image_ids = np.concatenate([self._image_ids, image_ids])
+                    self._hashes = np.concatenate([self._hashes, hashes])
+                    self._last_id = last_id
+                self._refreshed_at = now
+
+    def search(self, phash: int, max_distance: int, exclude: Optional[int] = None,
+               refresh: bool = False) -> List[Tuple[int, int]]:
+        """
+        Returns (image id, distance) of hashes within max_distance bits, the closest first.
+        """
+        self.refresh(force=refresh)
+        image_ids, hashes = self._image_ids, self._hashes
+        # bitwise_count of signed integers counts bits of the absolute value
+        distances = np.bitwise_count((hashes ^ np.int64(phash)).view(np.uint64))
+        hits = np.flatnonzero(distances <= max_distance)
+        hits = hits[np.argsort(distances[hits], kind='stable')]
+        return [(int(image_ids[i]), int(distances[i])) for i in hits if image_ids[i] != exclude]
+
+
+index = HashIndex()
+
+
+def index_image(image_id: int, phash: int) -> bool:
+    """
+    Stores the hash of an image and tells whether an other image has a similar one.
+    """
+    ImageHash.objects.get_or_create(image_id=image_id, defaults={'phash': phash})
+    return bool(index.search(phash, settings.DUPLICATE_MAX_DISTANCE, exclude=image_id, refresh=True))
@@ -0,0 +1,206 @@
+"""
+Personalized feed of public images.
+
+Images liked (upvoted or favourited) by the same users are neighbours, scored by the cosine of their
+co-occurrence: users liking both / sqrt(users liking one * users liking the other). rebuild_neighbours computes
+the sparse co-occurrence from all likes with numpy and stores the best neighbours of every image in one redis hash.
+
+Candidates of a user are a redis sorted set: neighbours of the images the user liked, summed, without the liked
+images. It is built on the first feed request and every new like adds the neighbours of the liked image, so a
+feed request reads the set once and fetches one page of images.
+"""
+import heapq
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from cacheops.redis import redis_client
+from django.conf import settings
+from django.db.models import QuerySet
+
+from .models import Favourite, Image, Vote
+
+NEIGHBOURS_KEY = 'feed:neighbours'
+NEIGHBOUR = np.dtype([('image_id', '<i8'), ('score', '<f4')])
+
+# KEYS: candidates, liked images; ARGV: liked image, max candidates, neighbour, score, neighbour, score, ...
+RECORD_LIKE = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('sadd', KEYS[2], ARGV[1])
+redis.call('zrem', KEYS[1], ARGV[1])
+for i = 3, #ARGV, 2 do
+    if redis.call('sismember', KEYS[2], ARGV[i]) == 0 then
+        redis.call('zincrby', KEYS[1], ARGV[i + 1], ARGV[i])
+    end
+end
+redis.call('zremrangebyrank', KEYS[1], 0, -tonumber(ARGV[2]) - 1)
+return 1
+"""
+
+
+@lru_cache(maxsize=None)
+def _record_like_script():
+    return redis_client.register_script(RECORD_LIKE)
+
+
+def candidates_key(user_id: int) -> str:
+    return 'feed:user:{}'.format(user_id)
+
+
+def liked_key(user_id: int) -> str:
+    return 'feed:liked:{}'.format(user_id)
+
+
+def _like_pairs() -> np.ndarray:
+    """
+    Unique (user, image) pairs of upvotes and favourites of public images,
+    at most FEED_MAX_LIKES_PER_USER newest images of each user.
+    """
+    pairs = list(Vote.objects.nocache().filter(upvote=True, image__public=True).values_list('user_id', 'image_id'))
+    pairs += Favourite.objects.nocache().filter(image__public=True).values_list('user_id', 'image_id')
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.unique(np.array(pairs, dtype=np.int64), axis=0)  # sorted by user, then image
+    users, starts, counts = np.unique(pairs[:, 0], return_index=True, return_counts=True)
+    keep = np.ones(len(pairs), dtype=bool)
+    for start, count in zip(starts, counts):
+        if count > settings.FEED_MAX_LIKES_PER_USER:
+            keep[start:start + count - settings.FEED_MAX_LIKES_PER_USER] = False
+    return pairs[keep]
+
+
+def compute_neighbours(pairs: np.ndarray, count: int) -> Dict[int, np.ndarray]:
+    """
+    Best neighbours of every image as NEIGHBOUR arrays, the best first.
+    """
+    if not len(pairs):
+        return {}
+    images, columns = np.unique(pairs[:, 1], return_inverse=True)
+    popularity = np.bincount(columns).astype(np.float64)
+    size = len(images)
+
+    # co-occurring column pairs of every user, encoded as a * size + b
+    codes = []
+    users, starts = np.unique(pairs[:, 0], return_index=True)
+    for start, end in zip(starts, list(starts[1:]) + [len(pairs)]):
+        liked = columns[start:end]
+        if len(liked) < 2:
+            continue
+        a, b = np.meshgrid(liked, liked, indexing='ij')
+        mask = a != b
+        codes.append(a[mask] * size + b[mask])
+    if not codes:
+        return {}
+    codes, together = np.unique(np.concatenate(codes), return_counts=True)
+    a, b = codes // size, codes % size
+    scores = together / np.sqrt(popularity[a] * popularity[b])
+
+    order = np.lexsort((-scores, a))
+    a, b, scores = a[order], b[order], scores[order]
+    neighbours = {}
+    columns_with_neighbours, starts = np.unique(a, return_index=True)
+    for column, start, end in zip(columns_with_neighbours, starts, list(starts[1:]) + [len(a)]):
+        end = min(end, start + count)
+        neighbours[int(images[column])] = np.rec.fromarrays(
+            [images[b[start:end]], scores[start:end]], dtype=NEIGHBOUR)
+    return neighbours
+
+
+def rebuild_neighbours(batch_size: int = 1000) -> int:
+    """
+    Replaces the neighbour hash, returns the number of images with neighbours.
+    """
+    neighbours = compute_neighbours(_like_pairs(), settings.FEED_NEIGHBOURS)
+    building = NEIGHBOURS_KEY + ':building'
+    redis_client.delete(building)
+    items = list(neighbours.items())
+    for start in range(0, len(items), batch_size):
+        redis_client.hset(building, mapping={image_id: values.tobytes()
+                                             for image_id, values in items[start:start + batch_size]})
+    if items:
+        redis_client.rename(building, NEIGHBOURS_KEY)
+    else:
+        redis_client.delete(NEIGHBOURS_KEY)
+    return len(items)
+
+
+def _neighbours(image_ids: List[int]) -> List[np.ndarray]:
+    if not image_ids:
+        return []
+    return [np.frombuffer(value, dtype=NEIGHBOUR) for value in redis_client.hmget(NEIGHBOURS_KEY, image_ids)
+            if value is not None]
+
+
+def liked_images(user_id: int) -> Set[int]:
+    liked = set(Vote.objects.nocache().filter(user_id=user_id, upvote=True).order_by('-image_id')
+                .values_list('image_id', flat=True)[:settings.FEED_MAX_LIKES_PER_USER])
+    liked.update(Favourite.objects.nocache().filter(user_id=user_id).order_by('-image_id')
+                 .values_list('image_id', flat=True)[:settings.FEED_MAX_LIKES_PER_USER])
+    return liked
+
+
+def build_candidates(user_id: int) -> List[int]:
+    liked = liked_images(user_id)
+    scores = defaultdict(float)
+    for neighbours in _neighbours(list(liked)):
+        for image_id, score in zip(neighbours['image_id'].tolist(), neighbours['score'].tolist()):
+            if image_id not in liked:
+                scores[image_id] += score
+    # ties in the order of ZREVRANGE, so the first page does not differ from the cached ones
+    best = heapq.nlargest(settings.FEED_CANDIDATES, scores.items(), key=lambda item: (item[1], str(item[0])))
+    if best:
+        pipeline = redis_client.pipeline()
+        pipeline.delete(candidates_key(user_id), liked_key(user_id))
+        pipeline.zadd(candidates_key(user_id), dict(best))
+        pipeline.sadd(liked_key(user_id), *liked)
+        pipeline.expire(candidates_key(user_id), settings.FEED_USER_TIMEOUT)
+        pipeline.expire(liked_key(user_id), settings.FEED_USER_TIMEOUT)
+        pipeline.execute()
+    return [image_id for image_id, score in best]
+
+
+def user_candidates(user_id: int) -> List[int]:
+    """
+    Image ids for the feed of the user, the best first. Empty for users without likes.
+    """
+    candidates = redis_client.zrevrange(candidates_key(user_id), 0, -1)
+    if candidates:
+        return [int(image_id) for image_id in candidates]
+    return build_candidates(user_id)
+
+
+def record_like(user_id: int, image_id: int):
+    """
+    Adds neighbours of a newly liked image to the candidates of the user, if they are built.
+    """
+    args = [image_id, settings.FEED_CANDIDATES]
+    for neighbours in _neighbours([image_id]):
+        for neighbour, score in zip(neighbours['image_id'].tolist(), neighbours['score'].tolist()):
+            args += [neighbour, score]
+    _record_like_script()(keys=[candidates_key(user_id), liked_key(user_id)], args=args)
+
+
+class FeedImages:
+    """
+    Candidates as a sequence for the paginator, a slice fetches its public images of queryset in one query.
+    values() turns it into candidates of value rows, like QuerySet.values().
+    """
+
+    def __init__(self, image_ids: List[int], queryset: Optional[QuerySet] = None):
+        self.image_ids = image_ids
+        self.queryset = queryset if queryset is not None else Image.objects.all()
+
+    def values(self, *fields: str) -> 'FeedImages':
+        return FeedImages(self.image_ids, self.queryset.values(*fields))
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, item: slice) -> list:
+        image_ids = self.image_ids[item]
+        images = {image['id'] if isinstance(image, dict) else image.pk: image
+                  for image in self.queryset.filter(pk__in=image_ids, public=True)}
+        return [images[image_id] for image_id in image_ids if image_id in images]
@@ -0,0 +1,88 @@
+"""
+Sparse fieldsets of GET responses: ?fields=id,file keeps only the named fields of every row, ?exclude=tags drops the
+named ones. The views read only the columns of the kept fields and skip the counts, tags and nested relations of
+the others, so both the queries and the response shrink with the selection. Writes always use all fields.
+"""
+from typing import Iterable, List, Optional
+
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from drf_yasg import openapi
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import ListSerializer
+
+FIELDS_PARAMETERS = [
+    openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description='comma separated fields of the response, all when not given'),
+    openapi.Parameter('exclude', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description='comma separated fields left out of the response'),
+]
+
+
+def _names(request, parameter: str) -> List[str]:
+    return [name for name in request.query_params.get(parameter, '').split(',') if name]
+
+
+def requested_fields(request, available: Iterable[str]) -> Optional[List[str]]:
+    """
+    Fields of available selected by ?fields= and ?exclude= in the order of available, None when all are.
+    """
+    available = list(available)
+    fields, exclude = _names(request, 'fields'), _names(request, 'exclude')
+    if not fields and not exclude:
+        return None
+    errors = {}
+    for parameter, names in (('fields', fields), ('exclude', exclude)):
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[parameter] = 'unknown fields: {}'.format(', '.join(unknown))
+    if errors:
+        raise ValidationError(errors)
+    return [name for name in available if (not fields or name in fields) and name not in exclude]
+
+
+def only_columns(queryset: QuerySet, fields: Optional[Iterable[str]], *required: str) -> QuerySet:
+    """
+    queryset reading the concrete columns of fields and required only.
+    """
+    if fields is None:
+        return queryset
+    columns = {field.name for field in queryset.model._meta.concrete_fields}
+    return queryset.only(*[name for name in list(fields) + list(required) if name in columns])
+
+
+class SparseFieldsSerializerMixin:
+    """
+    Serializer keeping only context['fields'] when it is the serializer of the response, not a nested one.
+    """
+
+    @cached_property
+    def fields(self):
+        fields = super().fields
+        selected = self.context.get('fields')
+        root = self.root
+        if selected is None or (root is not self and not (isinstance(root, ListSerializer) and root.child is self)):
+            return fields
+        for name in [name for name in fields if name not in selected]:
+            del fields[name]
+        return fields
+
+
+class SparseFieldsMixin:
+    """
+    View passing the fields selected by GET to its serializer as context['fields'].
+    """
+
+    def get_selected_fields(self) -> Optional[List[str]]:
+        if not hasattr(self, '_selected_fields'):
+            self._selected_fields = None
+            request = getattr(self, 'request', None)
+            if request is not None and request.method in ('GET', 'HEAD'):
+                serializer = self.get_serializer_class()(context=super().get_serializer_context())
+                self._selected_fields = requested_fields(request, serializer.fields)
+        return self._selected_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_selected_fields()
+        return context
@@ -0,0 +1,205 @@
+"""
+Image metadata for laying out the gallery without downloading files.
+
+Dimensions, byte size and mime type are known from the upload. Dominant colour and the blurhash placeholder
+need decoded pixels, they are computed from a downscaled copy in a thread pool after the upload is committed,
+together with the perceptual hash of the duplicate index and the feature vector of the similarity search.
+backfill_image_metadata computes everything for existing images.
+"""
+import logging
+import math
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from PIL import Image as PilImage
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from . import usercache
+from .duplicates import dhash, index_image
+from .models import Image
+from .similarity import features, store_features
+from .uploads import describe_format
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 32
+PLACEHOLDER_COMPONENTS = (4, 3)
+DOMINANT_COLORS = 5
+METADATA_FIELDS = ['width', 'height', 'byte_size', 'mime_type', 'dominant_color', 'placeholder']
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _encode83(value: int, length: int) -> str:
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image: PilImage.Image, x_components: int, y_components: int) -> str:
+    """
+    BlurHash (https://blurha.sh) of a small RGB image. Basis sums are separable, each component
+    is a weighted sum of column sums, so the cost is O(components * pixels / min(width, height)).
+    """
+    width, height = image.size
+    linear = [[_srgb_to_linear(channel) for channel in pixel] for pixel in image.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        columns = [[0.0, 0.0, 0.0] for _ in range(width)]
+        for y in range(height):
+            weight = cos_y[j][y]
+            row = linear[y * width:(y + 1) * width]
+            for x in range(width):
+                column, pixel = columns[x], row[x]
+                column[0] += weight * pixel[0]
+                column[1] += weight * pixel[1]
+                column[2] += weight * pixel[2]
+        for i in range(x_components):
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append(tuple(scale * sum(cos_x[i][x] * columns[x][c] for x in range(width)) for c in range(3)))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(math.floor(max(abs(v) for f in ac for v in f) * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+    else:
+        quantised_max, maximum = 0, 1
+    result += _encode83(quantised_max, 1)
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (max(0, min(18, int(math.floor(_sign_pow(v / maximum, 0.5) * 9 + 9.5)))) for v in factor)
+        result += _encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def dominant_color(image: PilImage.Image) -> str:
+    quantized = image.quantize(DOMINANT_COLORS)
+    count, index = max(quantized.getcolors())
+    palette = quantized.getpalette()
+    return '#{:02x}{:02x}{:02x}'.format(*palette[index * 3:index * 3 + 3])
+
+
+def sample(file) -> Tuple[PilImage.Image, int, int, str]:
+    """
+    Opens an image and returns its downscaled RGB copy, original dimensions and format.
+    JPEG is decoded directly at a reduced scale.
+    """
+    with PilImage.open(file) as image:
+        width, height, image_format = image.width, image.height, image.format
+        image.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        image.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+        if image.mode in ('RGBA', 'LA', 'PA'):
+            # transparent pixels are shown on white
+            image = image.convert('RGBA')
+            image = PilImage.alpha_composite(PilImage.new('RGBA', image.size, (255, 255, 255, 255)), image)
+        small = image.convert('RGB')
+    return small, width, height, image_format
+
+
+def extract(file) -> dict:
+    """
+    Metadata fields, phash and features, the hash and features are stored in their own tables.
+    """
+    small, width, height, image_format = sample(file)
+    return {
+        'width': width,
+        'height': height,
+        'mime_type': describe_format(image_format)[0],
+        'dominant_color': dominant_color(small),
+        'placeholder': blurhash(small, *PLACEHOLDER_COMPONENTS),
+        'phash': dhash(small),
+        'features': features(small),
+    }
+
+
+def extract_object(key: str) -> dict:
+    """
+    Streams the object into a spooled temporary file, pillow needs a seekable file.
+    """
+    stat = default_storage.client.stat_object(default_storage.bucket_name, key)
+    response = default_storage.client.get_object(default_storage.bucket_name, key)
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as file:
+            for chunk in response.stream(64 * 1024):
+                file.write(chunk)
+            file.seek(0)
+            metadata = extract(file)
+    finally:
+        response.close()
+        response.release_conn()
+    metadata['byte_size'] = stat.size
+    return metadata
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_METADATA_WORKERS,
+                                           thread_name_prefix='imagemeta')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def save_metadata(image_id: int, metadata: dict):
+    """
+    Saves metadata of an uploaded image, the image is flagged when an other one looks the same.
+    """
+    metadata = dict(metadata)
+    phash, vector = metadata.pop('phash'), metadata.pop('features')
+    if not Image.objects.filter(pk=image_id).update(**metadata):
+        return
+    if index_image(image_id, phash):
+        Image.objects.filter(pk=image_id).update(possible_duplicate=True)
+    store_features(image_id, vector)
+    usercache.bump_images([image_id])
+
+
+def _extract_and_save(image_id: int, key: str):
+    try:
+        save_metadata(image_id, extract_object(key))
+    except Exception:
+        # backfill_image_metadata picks the image up again
+        logger.exception("metadata of image %s failed", image_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_extraction(image: Image):
+    key = image.file.name
+    transaction.on_commit(lambda: _get_executor().submit(_extract_and_save, image.pk, key))
+
+
+def pending_images():
+    return Image.objects.nocache().filter(Q(placeholder='') | Q(hash=None) | Q(features=None)).exclude(file='')
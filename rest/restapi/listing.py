@@ -0,0 +1,139 @@
+"""
+Fast path of list endpoints: rows are read with .values() and turned into the dicts ImageListSerializer and
+CommentListSerializer would give, without the field machinery of DRF. Counts and tags of a page are read with one
+grouped query each instead of queries per image. FastJSONRenderer renders them; the response is byte for byte the
+one of the serializers, which still validate writes and describe the schema.
+"""
+import operator
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import orjson
+from django.db.models import Count, QuerySet
+from django.utils import timezone
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+
+from .fieldsets import SparseFieldsMixin
+from .models import Comment, Favourite, Image, ImageTag, ReportImage, Vote
+
+IMAGE_COLUMNS = ('id', 'user', 'created_at', 'title', 'description', 'file', 'public', 'width', 'height',
+                 'byte_size', 'mime_type', 'dominant_color', 'placeholder', 'possible_duplicate')
+COMMENT_COLUMNS = ('id', 'image', 'user', 'created_at', 'comment_text')
+IMAGE_FIELDS = IMAGE_COLUMNS[:7] + ('tags',) + IMAGE_COLUMNS[7:] + \
+    ('comment_count', 'upvote_count', 'downvote_count', 'favourite_count', 'report_count')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer with orjson for compact output, indented output (e.g. of the browsable API) stays with json.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None or self.ensure_ascii \
+                or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # like JSONRenderer, to stay a strict javascript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def format_datetime(value):
+    """
+    DateTimeField.to_representation of ISO 8601 output.
+    """
+    if not value:
+        return None
+    value = timezone.localtime(value) if timezone.is_aware(value) else timezone.make_aware(value)
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def image_values(queryset: QuerySet, fields: Optional[Sequence[str]] = None) -> QuerySet:
+    return queryset.values(*_columns(IMAGE_COLUMNS, fields))
+
+
+def image_rows(rows: Iterable[dict], request=None, fields: Optional[Sequence[str]] = None) -> List[OrderedDict]:
+    """
+    Rows of ImageListSerializer, only fields when given. Tags and counts not in fields are not read.
+    """
+    rows = list(rows)
+    fields = IMAGE_FIELDS if fields is None else fields
+    ids = [row['id'] for row in rows]
+    values = {name: operator.itemgetter(name) for name in IMAGE_COLUMNS}
+    values['created_at'] = lambda row: format_datetime(row['created_at'])
+    if 'file' in fields:
+        storage = Image._meta.get_field('file').storage
+        names = [row['file'] for row in rows if row['file']]
+        urls = storage.urls(names) if hasattr(storage, 'urls') else {name: storage.url(name) for name in names}
+        if request is not None:
+            urls = {name: request.build_absolute_uri(url) for name, url in urls.items()}
+        values['file'] = lambda row: urls[row['file']] if row['file'] else None
+    if 'tags' in fields:
+        tags = {}
+        for image_id, name in ImageTag.objects.filter(image_id__in=ids).values_list('image_id', 'tag__name'):
+            tags.setdefault(image_id, []).append(name)
+        values['tags'] = lambda row: sorted(tags.get(row['id'], []))
+    for name, model in (('comment_count', Comment), ('favourite_count', Favourite), ('report_count', ReportImage)):
+        if name in fields:
+            values[name] = _count_of(_counts(model.objects.filter(image_id__in=ids)))
+    if 'upvote_count' in fields or 'downvote_count' in fields:
+        upvotes, downvotes = {}, {}
+        for image_id, upvote, count in Vote.objects.filter(image_id__in=ids).order_by() \
+                .values('image_id', 'upvote').annotate(count=Count('pk')).values_list('image_id', 'upvote', 'count'):
+            (upvotes if upvote else downvotes)[image_id] = count
+        values['upvote_count'] = _count_of(upvotes)
+        values['downvote_count'] = _count_of(downvotes)
+
+    values = [(name, values[name]) for name in fields]
+    return [OrderedDict([(name, value(row)) for name, value in values]) for row in rows]
+
+
+def comment_values(queryset: QuerySet, fields: Optional[Sequence[str]] = None) -> QuerySet:
+    return queryset.values(*_columns(COMMENT_COLUMNS, fields))
+
+
+def comment_rows(rows: Iterable[dict], request=None, fields: Optional[Sequence[str]] = None) -> List[OrderedDict]:
+    fields = COMMENT_COLUMNS if fields is None else fields
+    return [OrderedDict([(name, format_datetime(row[name]) if name == 'created_at' else row[name])
+                         for name in fields]) for row in rows]
+
+
+def _columns(columns: Sequence[str], fields: Optional[Sequence[str]]) -> List[str]:
+    # id identifies the rows of the counts and tags
+    return [name for name in columns if fields is None or name in fields or name == 'id']
+
+
+def _count_of(counts: Dict[int, int]):
+    return lambda row: counts.get(row['id'], 0)
+
+
+def _counts(queryset: QuerySet) -> Dict[int, int]:
+    return dict(queryset.order_by().values('image_id').annotate(count=Count('pk')).values_list('image_id', 'count'))
+
+
+class RowsListMixin(SparseFieldsMixin):
+    """
+    GET of the list answered by the fast path: values_of(queryset, fields) selects the columns,
+    rows_of(rows, request, fields) builds the output of serializer_class.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    values_of = None
+    rows_of = None
+
+    def list(self, request, *args, **kwargs):
+        return self.list_rows(self.filter_queryset(self.get_queryset()))
+
+    def list_rows(self, queryset: QuerySet) -> Response:
+        fields = self.get_selected_fields()
+        values = type(self).values_of(queryset, fields)
+        page = self.paginate_queryset(values)
+        if page is not None:
+            return self.get_paginated_response(type(self).rows_of(page, self.request, fields))
+        return Response(type(self).rows_of(values, self.request, fields))
@@ -0,0 +1,193 @@
+"""
+Logging pipeline that keeps the request thread away from the network.
+
+AsyncGELFHandler only puts records into a bounded queue, a background thread
+drains it in batches and sends them with graypy. RateLimitFilter limits how
+many records a single logger can emit per second.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import graypy
+
+from .metrics import metrics
+
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+# standard LogRecord attributes, everything else was passed via `extra`
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per logger name. Records below `sample_level` are additionally sampled with `sample_rate`,
+    records at or above `exempt_level` always pass. Suppressed records are counted and the count is attached
+    to the next record that passes as `suppressed`.
+    """
+
+    def __init__(self, rate: float = 10, burst: int = 50, sample_rate: float = 1.0, sample_level='INFO',
+                 exempt_level='CRITICAL'):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.sample_rate = float(sample_rate)
+        self.sample_level = logging._checkLevel(sample_level)
+        self.exempt_level = logging._checkLevel(exempt_level)
+        self._buckets = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # the same instance may be attached to more handlers, decide only once per record
+        decision = getattr(record, '_rate_limit_passed', None)
+        if decision is None:
+            decision = self._decide(record)
+            record._rate_limit_passed = decision
+        return decision
+
+    def _decide(self, record) -> bool:
+        if record.levelno >= self.exempt_level:
+            return True
+        if record.levelno <= self.sample_level and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return self._suppress(record)
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(record.name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now)
+                suppressed = None
+            else:
+                self._buckets[record.name] = (tokens - 1, now)
+                suppressed = self._suppressed.pop(record.name, 0)
+        if suppressed is None:
+            return self._suppress(record)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def _suppress(self, record) -> bool:
+        with self._lock:
+            self._suppressed[record.name] = self._suppressed.get(record.name, 0) + 1
+        metrics.incr('log_records_suppressed', logger=record.name)
+        return False
+
+
+class AsyncGELFHandler(logging.Handler):
+    """
+    Drop in replacement of graypy.GELFUDPHandler. emit() never blocks: when the queue is full the record is
+    dropped and counted, the number of dropped records is reported to graylog by the sender thread.
+    """
+
+    def __init__(self, host, port=12201, queue_size=10000, batch_size=200, flush_interval=0.5, **gelf_kwargs):
+        super().__init__()
+        self.target = graypy.GELFUDPHandler(host, port, **gelf_kwargs)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._pid = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record: logging.LogRecord):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+            metrics.incr('log_records_dropped', logger=record.name)
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Renders everything that depends on mutable state (args, exc_info, extra objects like the request)
+        in the calling thread, so the sender thread works only with plain values.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in list(record.__dict__.items()):
+            if key not in _RECORD_ATTRIBUTES and not isinstance(value, _PRIMITIVES):
+                record.__dict__[key] = repr(value)
+        return record
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._thread = threading.Thread(target=self._run, name='gelf-sender', daemon=True)
+            self._thread.start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._send_batch(batch)
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        if first is None:
+            return None
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is None:
+                self._send_batch(batch)
+                return None
+            batch.append(record)
+        return batch
+
+    def _send_batch(self, batch):
+        for record in batch:
+            self.target.handle(record)
+        dropped = self.dropped - self._reported_dropped
+        if dropped > 0:
+            self._reported_dropped += dropped
+            self.target.handle(logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': 'logging queue full, %d records dropped' % dropped,
+                'dropped': dropped,
+            }))
+
+    def close(self):
+        # flush what is queued on shutdown, but never hang the process
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                self._thread.join(timeout=2)
+            except queue.Full:
+                pass
+        self.target.close()
+        super().close()
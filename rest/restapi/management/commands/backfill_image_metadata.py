@@ -0,0 +1,70 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from cacheops import invalidate_model
+from django.core.management.base import BaseCommand
+
+from ... import usercache
+from ...imagemeta import METADATA_FIELDS, extract_object, pending_images
+from ...models import Image, ImageFeatures, ImageHash
+from ...similarity import matrix
+
+
+def _extract(image_id: int, key: str):
+    try:
+        return image_id, extract_object(key), None
+    except Exception as e:
+        return image_id, None, repr(e)
+
+
+class Command(BaseCommand):
+    help = 'Computes dimensions, colour, placeholder, perceptual hash and features of images without them. ' \
+           'Images are processed in order of id, an interrupted run continues where it stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='number of processes decoding images')
+        parser.add_argument('--batch-size', type=int, default=100, help='images saved in one query')
+
+    def handle(self, *args, **options):
+        total = pending_images().count()
+        self.stdout.write('{} images without metadata'.format(total))
+
+        done = failed = 0
+        last_pk = 0
+        # spawned, forked workers would inherit (and close on exit) the database connection of this process
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as executor:
+            while True:
+                batch = list(pending_images().filter(pk__gt=last_pk).order_by('pk')
+                             .values_list('pk', 'file')[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+
+                images, hashes, vectors = [], [], []
+                for image_id, metadata, error in executor.map(_extract, *zip(*batch)):
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write('image {}: {}'.format(image_id, error))
+                        continue
+                    hashes.append(ImageHash(image_id=image_id, phash=metadata.pop('phash')))
+                    vectors.append((image_id, metadata.pop('features')))
+                    images.append(Image(pk=image_id, **metadata))
+                Image.objects.bulk_update(images, METADATA_FIELDS)
+                ImageHash.objects.bulk_create(hashes, ignore_conflicts=True)
+                # images picked for a missing placeholder or hash may have features, which are in the index already
+                with_features = set(ImageFeatures.objects.nocache()
+                                    .filter(image_id__in=[image_id for image_id, _ in vectors])
+                                    .values_list('image_id', flat=True))
+                vectors = [(image_id, vector) for image_id, vector in vectors if image_id not in with_features]
+                ImageFeatures.objects.bulk_create([ImageFeatures(image_id=image_id, vector=vector.tobytes())
+                                                   for image_id, vector in vectors], ignore_conflicts=True)
+                matrix.append(vectors)
+                invalidate_model(Image)
+                usercache.bump_images([image.pk for image in images])
+
+                done += len(images)
+                self.stdout.write('{}/{} images, {} failed'.format(done + failed, total, failed))
+
+        self.stdout.write(self.style.SUCCESS('Extracted metadata of {} images, {} failed'.format(done, failed)))
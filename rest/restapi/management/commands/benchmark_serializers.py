@@ -0,0 +1,70 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from minio_storage.storage import MinioStorage
+from rest_framework.renderers import JSONRenderer
+
+from ... import listing
+from ...models import Image
+from ...serializers import ImageListSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measures per page serialization and rendering time of image lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='rows per page')
+        parser.add_argument('--pages', type=int, default=20, help='number of measured pages')
+        parser.add_argument('--database', action='store_true',
+                            help='serialize and render whole pages of images stored in database, with '
+                                 'ImageListSerializer and with the fast path of listing')
+
+    def measure(self, name, func, pages):
+        func()  # warm up
+        timings = []
+        for _ in range(pages):
+            start = time.process_time()
+            func()
+            timings.append((time.process_time() - start) * 1000)
+        self.stdout.write('{:<45} mean {:8.2f} ms   min {:8.2f} ms   max {:8.2f} ms'.format(
+            name, statistics.mean(timings), min(timings), max(timings)))
+
+    def handle(self, *args, **options):
+        rows, pages = options['rows'], options['pages']
+        storage = Image._meta.get_field('file').storage
+        now = timezone.now()
+        images = [Image(id=i, title='image {}'.format(i), description='desc', public=True, created_at=now,
+                        file='myimage{}.jpg'.format(i)) for i in range(rows)]
+        names = [image.file.name for image in images]
+        file_field = ImageListSerializer().fields['file']
+
+        self.stdout.write('{} rows per page, cpu time per page'.format(rows))
+
+        self.measure('file urls, minio_storage url()',
+                     lambda: [MinioStorage.url(storage, name) for name in names], pages)
+        if hasattr(storage, 'urls'):
+            self.measure('file urls, memoized storage.urls()', lambda: storage.urls(names), pages)
+        self.measure('file field of ImageListSerializer',
+                     lambda: [file_field.to_representation(image.file) for image in images], pages)
+
+        page = [dict(id=image.id, user=None, created_at=listing.format_datetime(now), title=image.title,
+                     description=image.description, file=file_field.to_representation(image.file), public=True,
+                     tags=['tag', 'ünïcode'], width=640, height=480, byte_size=1000, mime_type='image/jpeg',
+                     dominant_color='#aabbcc', placeholder='LEHV6nWB2yk8pyo0adR*.7kCMdnj', possible_duplicate=False,
+                     comment_count=1, upvote_count=2, downvote_count=3, favourite_count=4, report_count=0)
+                for image in images]
+        self.measure('render page, JSONRenderer', lambda: JSONRenderer().render(page), pages)
+        self.measure('render page, FastJSONRenderer', lambda: listing.FastJSONRenderer().render(page), pages)
+
+        if options['database']:
+            queryset = Image.objects.all()[:rows]
+            self.measure('ImageListSerializer page from database',
+                         lambda: ImageListSerializer(list(queryset.nocache()), many=True).data, pages)
+            self.measure('ImageListSerializer + JSONRenderer',
+                         lambda: JSONRenderer().render(ImageListSerializer(list(queryset.nocache()), many=True).data),
+                         pages)
+            self.measure('listing rows + FastJSONRenderer',
+                         lambda: listing.FastJSONRenderer().render(
+                             listing.image_rows(listing.image_values(queryset.nocache()))), pages)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import UploadTicket
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired upload tickets, their objects are deleted by collect_storage_garbage'
+
+    def handle(self, *args, **options):
+        cleared, _ = UploadTicket.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS('Cleared {} upload tickets'.format(cleared)))
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ... import tombstones
+
+
+class Command(BaseCommand):
+    help = 'Deletes storage objects of deleted images, with --sweep also objects which no row references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.STORAGE_GC_BATCH_SIZE,
+                            help='objects per multi-object delete request, at most 1000')
+        parser.add_argument('--sweep', action='store_true', help='list the bucket and enqueue unreferenced objects')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='keep running and collect every INTERVAL seconds, '
+                                 'sweep every STORAGE_GC_SWEEP_INTERVAL')
+
+    def handle(self, *args, **options):
+        batch_size = min(options['batch_size'], 1000)
+        if not options['interval']:
+            self.run(batch_size, options['sweep'])
+            return
+
+        last_sweep = 0
+        while True:
+            sweep = options['sweep'] and time.monotonic() - last_sweep >= settings.STORAGE_GC_SWEEP_INTERVAL
+            if sweep:
+                last_sweep = time.monotonic()
+            try:
+                self.run(batch_size, sweep)
+            except Exception as e:
+                self.stderr.write('Storage garbage collection failed: {!r}'.format(e))
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def run(self, batch_size: int, sweep: bool):
+        if sweep:
+            enqueued = tombstones.sweep(batch_size=batch_size)
+            self.stdout.write('Enqueued {} unreferenced objects'.format(enqueued))
+        processed = tombstones.collect(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS('Processed {} tombstones'.format(processed)))
@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...models import Image, ImageFeatures
+from ...similarity import find_similar, matrix
+
+
+class Command(BaseCommand):
+    help = 'Rewrites the similarity index from stored features, dropping deleted images and repeated records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warm', type=int, default=0,
+                            help='afterwards cache similar images of the WARM newest public images')
+        parser.add_argument('--batch-size', type=int, default=64, help='images searched in one matrix product')
+        parser.add_argument('--interval', type=int, default=0, help='keep running and compact every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.run(options['warm'], options['batch_size'])
+            except Exception as e:
+                if not options['interval']:
+                    raise
+                self.stderr.write('Compaction of similarity index failed: {!r}'.format(e))
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def run(self, warm: int, batch_size: int):
+        rows = ((image_id, np.frombuffer(bytes(vector), dtype=np.float32)) for image_id, vector in
+                ImageFeatures.objects.nocache().order_by('pk').values_list('image_id', 'vector').iterator())
+        written = matrix.rebuild(rows)
+        self.stdout.write(self.style.SUCCESS('Similarity index has {} images'.format(written)))
+
+        if warm:
+            image_ids = list(Image.objects.nocache().filter(public=True, features__isnull=False)
+                             .order_by('-created_at').values_list('pk', flat=True)[:warm])
+            for start in range(0, len(image_ids), batch_size):
+                find_similar(image_ids[start:start + batch_size])
+            self.stdout.write('Cached similar images of {} images'.format(len(image_ids)))
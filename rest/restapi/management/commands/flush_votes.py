@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ... import votebuffer
+
+
+class Command(BaseCommand):
+    help = 'Writes votes buffered in redis (VOTE_WRITE_BEHIND) to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.VOTE_FLUSH_BATCH,
+                            help='images written in one transaction')
+        parser.add_argument('--interval-ms', type=int, default=0,
+                            help='keep running and flush every INTERVAL_MS milliseconds')
+
+    def handle(self, *args, **options):
+        if not options['interval_ms']:
+            self.stdout.write(self.style.SUCCESS('Flushed votes of {} images'.format(self.run(options['batch_size']))))
+            return
+
+        while True:
+            try:
+                self.run(options['batch_size'])
+            except Exception as e:
+                # claimed votes stay in redis and are written by the next run
+                self.stderr.write('Flushing votes failed: {!r}'.format(e))
+            close_old_connections()
+            time.sleep(options['interval_ms'] / 1000)
+
+    def run(self, batch_size: int) -> int:
+        """
+        Flushes until less than a batch is pending.
+        """
+        flushed = 0
+        while True:
+            images = votebuffer.flush(batch_size)
+            flushed += images
+            if images < batch_size:
+                return flushed
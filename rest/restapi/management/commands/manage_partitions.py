@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ... import partitions
+
+
+class Command(BaseCommand):
+    help = 'Creates monthly partitions of votes and comments ahead and archives old ones, with --convert ' \
+           'partitions the tables first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='partition tables which are not partitioned yet, locks them while rows are copied')
+        parser.add_argument('--months-ahead', type=int, default=settings.PARTITION_MONTHS_AHEAD,
+                            help='future months which get their partition')
+        parser.add_argument('--drop', action='store_true', help='drop old partitions instead of keeping archive tables')
+        parser.add_argument('--interval', type=int, default=0, help='keep running and check every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            self.stdout.write('Partitions need PostgreSQL 11 or later, nothing to do')
+            return
+        while True:
+            try:
+                self.run(options['convert'], options['months_ahead'], options['drop'])
+            except Exception as e:
+                if not options['interval']:
+                    raise
+                self.stderr.write('Partition maintenance failed: {!r}'.format(e))
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def run(self, convert: bool, months_ahead: int, drop: bool):
+        archive_after = {'vote': settings.VOTE_ARCHIVE_AFTER_MONTHS,
+                         'comment': settings.COMMENT_ARCHIVE_AFTER_MONTHS}
+        for name, model in partitions.PARTITIONED_MODELS.items():
+            if not partitions.is_partitioned(model):
+                if not convert:
+                    self.stdout.write('Table of {} is not partitioned, run with --convert'.format(name))
+                    continue
+                created = partitions.convert(model, months_ahead)
+                self.stdout.write(self.style.SUCCESS('Partitioned {} into {} months'.format(name, created)))
+            for partition in partitions.create_partitions(model, months_ahead):
+                self.stdout.write(self.style.SUCCESS('Created {}'.format(partition)))
+            if archive_after[name]:
+                for partition in partitions.archive_partitions(model, archive_after[name], drop=drop):
+                    self.stdout.write(self.style.SUCCESS('{} {}'.format('Dropped' if drop else 'Archived', partition)))
@@ -0,0 +1,24 @@
+import mimetypes
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...blobs import adopt_object
+from ...models import Image
+from ...tombstones import enqueue_deletion
+
+
+class Command(BaseCommand):
+    help = 'Moves files of images uploaded before content addressed storage to blobs'
+
+    def handle(self, *args, **options):
+        migrated = 0
+        for image in Image.objects.nocache().filter(blob=None).exclude(file='').iterator():
+            name = image.file.name
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            with transaction.atomic():
+                blob = adopt_object(name, content_type)
+                Image.objects.filter(pk=image.pk).update(blob=blob, file=blob.key)
+                enqueue_deletion([name])
+            migrated += 1
+        self.stdout.write(self.style.SUCCESS('Migrated {} images'.format(migrated)))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...feed import rebuild_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Recomputes co-liked neighbours of images for the personalized feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0, help='keep running and rebuild every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                started = time.monotonic()
+                images = rebuild_neighbours()
+                self.stdout.write(self.style.SUCCESS('Neighbours of {} images in {:.1f}s'.format(
+                    images, time.monotonic() - started)))
+            except Exception as e:
+                if not options['interval']:
+                    raise
+                self.stderr.write('Rebuild of feed neighbours failed: {!r}'.format(e))
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
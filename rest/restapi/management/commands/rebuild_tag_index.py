@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...tags import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recreates tag postings and facet counts in redis from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='images read from the database at once')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        images = rebuild_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed tags of {} images in {:.1f}s'.format(
+            images, time.monotonic() - started)))
@@ -0,0 +1,213 @@
+"""
+Application metrics pushed to telegraf (socket_listener, influx line protocol).
+
+Samples are aggregated in-process and flushed every METRICS_FLUSH_INTERVAL
+seconds by a daemon thread, so the request path only touches a dict under a lock.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of latency buckets in milliseconds, the last bucket is +Inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# keep datagrams below the usual ethernet MTU
+MAX_PACKET_SIZE = 1400
+
+
+def escape_tag(value) -> str:
+    return str(value).replace('\\', '\\\\').replace(',', r'\,').replace('=', r'\=').replace(' ', r'\ ')
+
+
+def format_line(measurement: str, tags: tuple, fields: dict, timestamp_ns: int) -> str:
+    tag_part = ''.join(',{}={}'.format(key, escape_tag(value)) for key, value in tags if value != '')
+    field_part = ','.join('{}={}'.format(key, _format_field(value)) for key, value in fields.items())
+    return '{}{} {} {}'.format(escape_tag(measurement), tag_part, field_part, timestamp_ns)
+
+
+def _format_field(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    return repr(float(value))
+
+
+class Histogram:
+    __slots__ = ('buckets', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms: float):
+        index = 0
+        for bound in LATENCY_BUCKETS_MS:
+            if value_ms <= bound:
+                break
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def fields(self) -> dict:
+        fields = {'count': self.count, 'sum_ms': self.sum, 'max_ms': self.max}
+        cumulative = 0
+        for bound, hits in zip(LATENCY_BUCKETS_MS, self.buckets):
+            cumulative += hits
+            fields['le_{}'.format(bound)] = cumulative
+        fields['le_inf'] = self.count
+        return fields
+
+
+class MetricsRegistry:
+    """
+    Thread safe aggregation of counters, gauges and histograms.
+    Counters and histograms are reset on every flush, gauges keep their value.
+    """
+
+    def __init__(self, host: str, port: int, prefix: str = '', flush_interval: float = 10.0,
+                 global_tags: dict = None):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.global_tags = tuple(sorted((global_tags or {}).items()))
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._histograms = defaultdict(Histogram)
+        self._socket = None
+        self._thread = None
+        self._pid = None
+
+    def _key(self, name, tags):
+        return name, tuple(sorted(tags.items())) if tags else ()
+
+    def incr(self, name: str, value: int = 1, **tags):
+        self._ensure_started()
+        key = self._key(name, tags)
+        with self._lock:
+            self._counters[key] += value
+
+    def gauge_add(self, name: str, value: int, **tags):
+        self._ensure_started()
+        key = self._key(name, tags)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name: str, value_ms: float, **tags):
+        self._ensure_started()
+        key = self._key(name, tags)
+        with self._lock:
+            self._histograms[key].observe(value_ms)
+
+    def collect(self) -> list:
+        """
+        Swaps the aggregated state and returns it as influx lines.
+        """
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(int)
+            histograms, self._histograms = self._histograms, defaultdict(Histogram)
+            gauges = dict(self._gauges)
+
+        timestamp = time.time_ns()
+        lines = []
+        for (name, tags), value in counters.items():
+            lines.append(format_line(self.prefix + name, self.global_tags + tags, {'count': value}, timestamp))
+        for (name, tags), value in gauges.items():
+            lines.append(format_line(self.prefix + name, self.global_tags + tags, {'value': value}, timestamp))
+        for (name, tags), histogram in histograms.items():
+            lines.append(format_line(self.prefix + name, self.global_tags + tags, histogram.fields(), timestamp))
+        return lines
+
+    def flush(self):
+        lines = self.collect()
+        packet = []
+        size = 0
+        for line in lines:
+            line_size = len(line.encode()) + 1
+            if packet and size + line_size > MAX_PACKET_SIZE:
+                self._send(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += line_size
+        if packet:
+            self._send(packet)
+
+    def _send(self, lines):
+        try:
+            self._socket.sendto('\n'.join(lines).encode() + b'\n', self.address)
+        except (BlockingIOError, OSError) as e:
+            # metrics are best effort, a full socket buffer or missing telegraf must not break anything
+            logger.debug("metrics packet dropped: %s", e)
+
+    def _ensure_started(self):
+        # started lazily and per process, gunicorn forks workers after the app is imported
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+            self._thread = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+            self._thread.start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("metrics flush failed")
+
+
+class NullRegistry:
+    def incr(self, name, value=1, **tags):
+        pass
+
+    def gauge_add(self, name, value, **tags):
+        pass
+
+    def observe(self, name, value_ms, **tags):
+        pass
+
+
+def _create_registry():
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        return NullRegistry()
+    return MetricsRegistry(
+        host=settings.METRICS_HOST,
+        port=settings.METRICS_PORT,
+        prefix=getattr(settings, 'METRICS_PREFIX', ''),
+        flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 10),
+        global_tags={'host': socket.gethostname()},
+    )
+
+
+class _LazyRegistry:
+    # settings are not configured yet when this module is imported
+
+    def __init__(self):
+        self._registry = None
+
+    def __getattr__(self, item):
+        if self._registry is None:
+            self._registry = _create_registry()
+        return getattr(self._registry, item)
+
+
+metrics = _LazyRegistry()
@@ -0,0 +1,127 @@
+import re
+import time
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import compression
+from .metrics import metrics
+from .profiling import is_profiling_requested, get_superuser, profile_request
+from .tracing import start_span, current_span
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status codes and in-flight requests per url pattern, e.g. images/<int:pk>/vote
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        route = getattr(request, '_metrics_route', None)
+        if route is None:
+            route = 'unmatched'
+        else:
+            metrics.gauge_add('http_requests_in_flight', -1, route=route)
+        metrics.observe('http_request_duration', duration_ms, route=route, method=request.method)
+        metrics.incr('http_requests', route=route, method=request.method, status=response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_route = request.resolver_match.route or request.resolver_match.view_name
+        metrics.gauge_add('http_requests_in_flight', 1, route=request._metrics_route)
+
+
+class ProfilingMiddleware:
+    """
+    Runs the request under the profiler when a superuser asks for it with X-Profile header or _profile parameter.
+    The profile id is returned in X-Profile-Id header, the profile is served by /profiles/<id>.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_profiling_requested(request):
+            return self.get_response(request)
+        user = get_superuser(request)
+        if user is None:
+            return self.get_response(request)
+        return profile_request(self.get_response, request, user)
+
+
+class TracingMiddleware:
+    """
+    Opens the root span of the request, continuing the W3C traceparent header of the caller.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.TRACING_ENABLED:
+            return self.get_response(request)
+        with start_span('{} {}'.format(request.method, request.path), 'server',
+                        traceparent=request.META.get('HTTP_TRACEPARENT', ''),
+                        **{'http.method': request.method, 'http.path': request.path}) as span:
+            response = self.get_response(request)
+            if span is not None:
+                span.set_attribute('http.status_code', response.status_code)
+                response['X-Trace-Id'] = span.trace_id
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        span = current_span()
+        if span is not None:
+            span.name = '{} {}'.format(request.method, request.resolver_match.route or request.path)
+
+
+class CompressionMiddleware:
+    """
+    Compresses text and json responses by Accept-Encoding, bodies of cacheable responses are compressed once and
+    then read from redis, see restapi/compression.py.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not settings.COMPRESSION_ENABLED or response.has_header('Content-Encoding') or \
+                not compression.is_compressible(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compression.compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            content = response.content
+            if self.is_cacheable(request, response, content):
+                compressed = compression.cached_compress(content, encoding)
+            else:
+                compressed = compression.compress(content, encoding)
+            if len(compressed) >= len(content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # the compressed body is a different representation of the same resource
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        response['Content-Encoding'] = encoding
+        return response
+
+    def is_cacheable(self, request, response, content: bytes) -> bool:
+        return request.method in ('GET', 'HEAD') and response.status_code == 200 and \
+            'no-store' not in response.get('Cache-Control', '') and len(content) <= settings.COMPRESSION_CACHE_MAX_SIZE
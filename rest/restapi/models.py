@@ -1,3 +1,5 @@
+import uuid
+
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
@@ -24,6 +26,17 @@ class Item(models.Model):
 # rm ./rest/restapi/migrations/ -- !("__init__.py")
 
 
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=100, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.__class__) + ": " + self.key + ", " + str(self.ref_count)
+
+
 class Image(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     title = models.CharField(max_length=100, blank=False, default='')
@@ -32,6 +45,15 @@ class Image(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='images', on_delete=models.CASCADE,
                              db_column="user", blank=True, null=True)
     file = models.ImageField()
+    blob = models.ForeignKey(Blob, related_name='images', on_delete=models.PROTECT, db_column="blob",
+                             blank=True, null=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    byte_size = models.BigIntegerField(blank=True, null=True)
+    mime_type = models.CharField(max_length=50, blank=True, default='')
+    dominant_color = models.CharField(max_length=7, blank=True, default='')
+    placeholder = models.CharField(max_length=64, blank=True, default='')  # blurhash
+    possible_duplicate = models.BooleanField(default=False)
     comments = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Comment', blank=True,
                                       related_name="image_comments")
     favourites = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Favourite',
@@ -39,6 +61,7 @@ class Image(models.Model):
     votes = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Vote', blank=True, related_name="image_votes")
     reports = models.ManyToManyField(settings.AUTH_USER_MODEL, through='ReportImage', blank=True,
                                      related_name="image_reports")
+    tags = models.ManyToManyField('Tag', through='ImageTag', blank=True, related_name="images")
 
     def __str__(self):
         return str(self.__class__) + ": " + str(self.id) + ", " + str(self.user)
@@ -47,6 +70,71 @@ class Image(models.Model):
         ordering = ['created_at']
 
 
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return str(self.__class__) + ": " + str(self.id) + ", " + self.name
+
+
+class ImageTag(models.Model):
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, db_column="image", related_name="image_tag_to_image")
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, db_column="tag", related_name="image_tag_to_tag")
+    automatic = models.BooleanField(default=False)  # derived from the title
+
+    class Meta:
+        unique_together = ('image', 'tag')
+
+
+class ImageHash(models.Model):
+    """
+    Perceptual hash of an image. Rows are only inserted, their ids tell the duplicate index what is new.
+    """
+    image = models.OneToOneField(Image, related_name='hash', on_delete=models.CASCADE, db_column="image")
+    phash = models.BigIntegerField()  # 64 bit dHash stored as signed
+
+    def __str__(self):
+        return str(self.__class__) + ": " + str(self.id) + ", " + str(self.image_id)
+
+
+class ImageFeatures(models.Model):
+    """
+    Feature vector of an image (float32 bytes) for the similarity search.
+    """
+    image = models.OneToOneField(Image, related_name='features', on_delete=models.CASCADE, db_column="image")
+    vector = models.BinaryField()
+
+    def __str__(self):
+        return str(self.__class__) + ": " + str(self.id) + ", " + str(self.image_id)
+
+
+class UploadTicket(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    title = models.CharField(max_length=100, blank=False, default='')
+    description = models.CharField(max_length=255, blank=True, default='')
+    public = models.BooleanField(null=False, default=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_tickets', on_delete=models.CASCADE,
+                             db_column="user", blank=True, null=True)
+    content_type = models.CharField(max_length=50)
+    object_name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return str(self.__class__) + ": " + str(self.id) + ", " + str(self.user)
+
+
+class StorageTombstone(models.Model):
+    key = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+
+    def __str__(self):
+        return str(self.__class__) + ": " + self.key + ", " + str(self.attempts)
+
+
 class Favourite(models.Model):
     image = models.ForeignKey(Image, on_delete=models.CASCADE, db_column="image", related_name='favourite_to_image')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
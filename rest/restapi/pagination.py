@@ -1,7 +1,105 @@
+from collections import OrderedDict
+from functools import partial
+
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from . import counting
+
+
+class OpenPage(Page):
+    """
+    Page of a paginator without an exact count, a next page exists when a row after this one was fetched.
+    """
+
+    def __init__(self, object_list, number, paginator, more: bool):
+        super().__init__(object_list, number, paginator)
+        self.more = more
+
+    def has_next(self):
+        return self.more
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class CountingPaginator(Paginator):
+    """
+    Counts querysets in count_mode. Other modes than EXACT may report an estimated, capped or cached count, so
+    pages are not cut by it: each page fetches one row more to tell whether there is a next one.
+    """
+
+    def __init__(self, object_list, per_page, count_mode: str = counting.EXACT, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_mode = count_mode
+
+    @cached_property
+    def counted(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count, True
+        return counting.paginated_count(self.object_list, self.count_mode)
+
+    @property
+    def count(self) -> int:
+        return self.counted[0]
+
+    @property
+    def count_exact(self) -> bool:
+        return self.counted[1]
+
+    def page(self, number):
+        if self.count_mode == counting.EXACT or not isinstance(self.object_list, QuerySet):
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return OpenPage(rows[:self.per_page], number, self, len(rows) > self.per_page)
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 1000
\ No newline at end of file
+    max_page_size = 1000
+    count_mode = counting.EXACT
+
+    @property
+    def django_paginator_class(self):
+        return partial(CountingPaginator, count_mode=self.count_mode)
+
+    def get_paginated_response(self, data):
+        if self.count_mode == counting.EXACT:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_exact', self.page.paginator.count_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class CappedCountPagination(DefaultPagination):
+    """
+    Counts rows up to PAGINATION_COUNT_CAP, for filtered lists of big tables.
+    """
+    count_mode = counting.CAPPED
+
+
+class EstimatedCountPagination(DefaultPagination):
+    """
+    Counts rows from the planner estimate on big tables, for lists which are rarely filtered.
+    """
+    count_mode = counting.ESTIMATED
@@ -0,0 +1,242 @@
+"""
+Monthly range partitions of the Vote and Comment tables by created_at (PostgreSQL 11 or later).
+
+manage_partitions --convert turns the tables into partitioned ones once: a partitioned copy with primary key
+(id, created_at) and a partition for every month since the oldest row is filled in one transaction and takes the
+name of the table, so the conversion locks the table for as long as the copy takes. Afterwards manage_partitions
+creates the partitions of PARTITION_MONTHS_AHEAD future months and detaches partitions older than
+<TABLE>_ARCHIVE_AFTER_MONTHS, which are kept as <table>_archive_<yyyymm> tables or dropped. Queries filtering by
+created_at, like the trending images of the last day, read the partitions of the months they cover only. Rows
+outside all partitions go to the default partition.
+
+Unique constraints of a partitioned table have to contain the partition key, so unique_together of a model
+(image and user of a vote) is kept by a <table>_key table with a primary key of those columns. Triggers insert and
+delete its rows with the rows of the partitions, a second vote of a user on an image fails with the unique violation
+of the key table like it did before. ON CONFLICT does not see the key table, so the vote buffer skips existing votes
+with NOT EXISTS. Rows of archived partitions release their keys.
+"""
+import datetime
+import re
+from typing import List, Tuple, Type
+
+from cacheops import invalidate_model
+from django.db import connection, transaction
+from django.db.models import Min, Model
+from django.utils import timezone
+
+from .models import Comment, Vote
+
+PARTITIONED_MODELS = {'vote': Vote, 'comment': Comment}
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first: datetime.date, last: datetime.date) -> List[datetime.date]:
+    months, month = [], month_start(first)
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def partition_name(table: str, month: datetime.date) -> str:
+    return '{}_p{:%Y%m}'.format(table, month)
+
+
+def archive_name(table: str, month: datetime.date) -> str:
+    return '{}_archive_{:%Y%m}'.format(table, month)
+
+
+def key_table(table: str) -> str:
+    return '{}_key'.format(table)
+
+
+def _q(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _bound(month: datetime.date) -> str:
+    return "'{:%Y-%m-%d} 00:00:00+00'".format(month)
+
+
+def _unique_columns(model: Type[Model]) -> List[str]:
+    unique_together = model._meta.unique_together
+    if not unique_together:
+        return []
+    return [model._meta.get_field(name).column for name in unique_together[0]]
+
+
+def partition_statements(table: str, month: datetime.date) -> List[str]:
+    return ['CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'.format(
+        _q(partition_name(table, month)), _q(table), _bound(month), _bound(add_months(month, 1)))]
+
+
+def convert_statements(model: Type[Model], months: List[datetime.date]) -> List[str]:
+    """
+    SQL turning the table of model into a partitioned table with partitions of months.
+    """
+    table = model._meta.db_table
+    new, old = '{}_partitioned'.format(table), '{}_unpartitioned'.format(table)
+    created_at = model._meta.get_field('created_at').column
+    pk = model._meta.pk.column
+    statements = [
+        'LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(_q(table)),
+        'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE ({})'.format(_q(new), _q(table),
+                                                                                      _q(created_at)),
+        'ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({}, {})'.format(_q(new), _q('{}_part_pkey'.format(table)),
+                                                                       _q(pk), _q(created_at)),
+    ]
+    for field in model._meta.concrete_fields:
+        if field.is_relation:
+            statements += [
+                'CREATE INDEX {} ON {} ({})'.format(_q('{}_{}_part_idx'.format(table, field.column)), _q(new),
+                                                    _q(field.column)),
+                'ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} ({}) DEFERRABLE INITIALLY DEFERRED'
+                .format(_q(new), _q('{}_{}_part_fk'.format(table, field.column)), _q(field.column),
+                        _q(field.related_model._meta.db_table), _q(field.target_field.column)),
+            ]
+    statements.append('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(_q('{}_default'.format(table)), _q(new)))
+    for month in months:
+        statements.append('CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'.format(
+            _q(partition_name(table, month)), _q(new), _bound(month), _bound(add_months(month, 1))))
+    # the copied default keeps drawing ids from the sequence of the old table, which must outlive it
+    sequence = _q('{}_{}_seq'.format(table, pk))
+    statements += [
+        'INSERT INTO {} SELECT * FROM {}'.format(_q(new), _q(table)),
+        'ALTER SEQUENCE {} OWNED BY NONE'.format(sequence),
+        'ALTER TABLE {} RENAME TO {}'.format(_q(table), _q(old)),
+        'ALTER TABLE {} RENAME TO {}'.format(_q(new), _q(table)),
+        'DROP TABLE {}'.format(_q(old)),
+        'ALTER SEQUENCE {} OWNED BY {}.{}'.format(sequence, _q(table), _q(pk)),
+    ]
+    return statements + key_statements(model)
+
+
+def key_statements(model: Type[Model]) -> List[str]:
+    """
+    SQL of the key table keeping unique_together of model and of the triggers filling it.
+    """
+    columns = _unique_columns(model)
+    if not columns:
+        return []
+    table = model._meta.db_table
+    key = key_table(table)
+    names = ', '.join(_q(column) for column in columns)
+    new_values = ', '.join('NEW.{}'.format(_q(column)) for column in columns)
+    matches_old = ' AND '.join('{0} = OLD.{0}'.format(_q(column)) for column in columns)
+    changed = '({}) IS DISTINCT FROM ({})'.format(', '.join('OLD.{}'.format(_q(column)) for column in columns),
+                                                  new_values)
+    function = _q('{}_sync'.format(key))
+    return [
+        'CREATE TABLE {} ({}, PRIMARY KEY ({}))'.format(
+            _q(key), ', '.join('{} integer NOT NULL'.format(_q(column)) for column in columns), names),
+        'INSERT INTO {0} ({1}) SELECT {1} FROM {2}'.format(_q(key), names, _q(table)),
+        """CREATE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        DELETE FROM {key} WHERE {matches_old};
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {key} ({names}) VALUES ({new_values});
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql""".format(function=function, key=_q(key), matches_old=matches_old, names=names,
+                              new_values=new_values),
+        'CREATE TRIGGER {} AFTER INSERT OR DELETE ON {} FOR EACH ROW EXECUTE PROCEDURE {}()'.format(
+            _q('{}_sync'.format(key)), _q(table), function),
+        # save() updates every column, the key is only touched when it changes
+        'CREATE TRIGGER {} AFTER UPDATE ON {} FOR EACH ROW WHEN ({}) EXECUTE PROCEDURE {}()'.format(
+            _q('{}_sync_update'.format(key)), _q(table), changed, function),
+    ]
+
+
+def is_supported() -> bool:
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned(model: Type[Model]) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [model._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def partitions(model: Type[Model]) -> List[Tuple[str, datetime.date]]:
+    """
+    Monthly partitions of the table of model with their months, the oldest first.
+    """
+    table = model._meta.db_table
+    pattern = re.compile(r'^{}_p(\d{{4}})(\d{{2}})$'.format(re.escape(table)))
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                       'WHERE i.inhparent = %s::regclass', [table])
+        names = [row[0] for row in cursor.fetchall()]
+    found = [(name, pattern.match(name)) for name in names]
+    return sorted(((name, datetime.date(int(match.group(1)), int(match.group(2)), 1))
+                   for name, match in found if match), key=lambda partition: partition[1])
+
+
+def convert(model: Type[Model], months_ahead: int) -> int:
+    """
+    Partitions the table of model, returns the number of partitions.
+    """
+    this_month = month_start(timezone.now().date())
+    oldest = model.objects.nocache().aggregate(oldest=Min('created_at'))['oldest']
+    months = months_between(month_start(oldest.date()) if oldest else this_month, add_months(this_month, months_ahead))
+    with transaction.atomic(), connection.cursor() as cursor:
+        for statement in convert_statements(model, months):
+            cursor.execute(statement)
+    invalidate_model(model)
+    return len(months)
+
+
+def create_partitions(model: Type[Model], months_ahead: int) -> List[str]:
+    """
+    Creates missing partitions from this month to months_ahead months ahead, returns their names.
+    """
+    table = model._meta.db_table
+    existing = {month for _, month in partitions(model)}
+    this_month = month_start(timezone.now().date())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for month in months_between(this_month, add_months(this_month, months_ahead)):
+            if month not in existing:
+                for statement in partition_statements(table, month):
+                    cursor.execute(statement)
+                created.append(partition_name(table, month))
+    return created
+
+
+def archive_partitions(model: Type[Model], after_months: int, drop: bool = False) -> List[str]:
+    """
+    Detaches partitions of months ending more than after_months months ago, renamed to their archive names or
+    dropped. Returns the names of the detached partitions.
+    """
+    table = model._meta.db_table
+    columns = _unique_columns(model)
+    before = add_months(month_start(timezone.now().date()), -after_months)
+    detached = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, month in partitions(model):
+            if month >= before:
+                break
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(_q(table), _q(name)))
+            if columns:
+                cursor.execute('DELETE FROM {} k USING {} p WHERE {}'.format(
+                    _q(key_table(table)), _q(name),
+                    ' AND '.join('k.{0} = p.{0}'.format(_q(column)) for column in columns)))
+            if drop:
+                cursor.execute('DROP TABLE {}'.format(_q(name)))
+            else:
+                cursor.execute('ALTER TABLE {} RENAME TO {}'.format(_q(name), _q(archive_name(table, month))))
+            detached.append(name)
+    if detached:
+        invalidate_model(model)
+    return detached
@@ -0,0 +1,155 @@
+"""
+On demand profiling of single requests.
+
+A superuser sends the X-Profile header or the _profile query parameter, the request then runs under cProfile
+with all SQL statements recorded and the result is stored in redis for PROFILE_TIMEOUT seconds.
+"""
+import cProfile
+import json
+import pstats
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from contextlib import ExitStack
+from typing import Union
+
+from cacheops.redis import redis_client
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_QUERY_PARAM = '_profile'
+PROFILE_KEY = 'profile:{}'
+
+
+def is_profiling_requested(request) -> bool:
+    # plain string checks first, so untriggered requests don't even parse the query string
+    if PROFILE_HEADER in request.META:
+        return True
+    return PROFILE_QUERY_PARAM in request.META.get('QUERY_STRING', '') and PROFILE_QUERY_PARAM in request.GET
+
+
+def get_superuser(request):
+    """
+    Django middleware knows only the session user, token and basic authentication happen in DRF views,
+    so run the DRF authenticators here. Called only for requests that asked for profiling.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            user = drf_request.user
+        except APIException:
+            return None
+    return user if user.is_authenticated and user.is_superuser else None
+
+
+class SQLRecorder:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': context['connection'].alias,
+                'sql': sql,
+                'params': [str(param) for param in params] if params and not many else None,
+                'many': many,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+def _function_name(key) -> str:
+    filename, line, name = key
+    if filename == '~':
+        return name  # built-in
+    return '{}:{}({})'.format(filename, line, name)
+
+
+def _call_tree(stats: dict, callees: dict, key, min_time: float, depth: int, path: frozenset) -> dict:
+    primitive_calls, calls, own_time, cumulative_time, _ = stats[key]
+    node = {
+        'function': _function_name(key),
+        'calls': calls,
+        'own_ms': round(own_time * 1000, 3),
+        'cumulative_ms': round(cumulative_time * 1000, 3),
+        'children': [],
+    }
+    if depth <= 0:
+        return node
+    # children ordered by the time they spent when called from this function
+    children = sorted(((stats[child][4][key][3], child) for child in callees.get(key, ()) if child not in path),
+                      reverse=True)
+    for child_time, child in children:
+        if child_time < min_time:
+            break
+        node['children'].append(_call_tree(stats, callees, child, min_time, depth - 1, path | {child}))
+    return node
+
+
+def build_profile(profiler: cProfile.Profile, recorder: SQLRecorder, request, user, response, duration: float) -> dict:
+    stats = pstats.Stats(profiler).stats
+    callees = defaultdict(list)
+    for key, value in stats.items():
+        for caller in value[4]:
+            callees[caller].append(key)
+    # the entry of the request has the most cumulative time; it can't be told by having no callers, the handler
+    # calls itself through the middleware chain
+    root = max(stats, key=lambda key: stats[key][3], default=None)
+    call_tree = {}
+    if root is not None:
+        call_tree = _call_tree(stats, callees, root, stats[root][3] * settings.PROFILE_TREE_MIN_SHARE,
+                               settings.PROFILE_TREE_DEPTH, frozenset([root]))
+    top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:settings.PROFILE_TOP_FUNCTIONS]
+    return {
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'user': user.username,
+        'created_at': time.time(),
+        'duration_ms': round(duration * 1000, 3),
+        'sql_count': len(recorder.queries),
+        'sql_duration_ms': round(sum(query['duration_ms'] for query in recorder.queries), 3),
+        'sql': recorder.queries,
+        'functions': [{
+            'function': _function_name(key),
+            'calls': value[1],
+            'own_ms': round(value[2] * 1000, 3),
+            'cumulative_ms': round(value[3] * 1000, 3),
+        } for key, value in top],
+        'call_tree': call_tree,
+    }
+
+
+def profile_request(get_response, request, user):
+    recorder = SQLRecorder()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        response = profiler.runcall(get_response, request)
+    duration = time.perf_counter() - start
+
+    profile_id = uuid.uuid4().hex
+    profile = build_profile(profiler, recorder, request, user, response, duration)
+    profile['id'] = profile_id
+    redis_client.setex(PROFILE_KEY.format(profile_id), settings.PROFILE_TIMEOUT,
+                       zlib.compress(json.dumps(profile).encode()))
+    response['X-Profile-Id'] = profile_id
+    return response
+
+
+def load_profile(profile_id: str) -> Union[dict, None]:
+    data = redis_client.get(PROFILE_KEY.format(profile_id))
+    if data is None:
+        return None
+    return json.loads(zlib.decompress(data))
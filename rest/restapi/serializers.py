@@ -1,9 +1,15 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model, password_validation
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 
-from .models import Item, Image, Comment, Vote, Favourite, ReportImage
+from .fieldsets import SparseFieldsSerializerMixin
+from .models import Item, Image, Comment, Vote, Favourite, ReportImage, UploadTicket
+from .tags import normalize_all, set_image_tags
+from .uploads import allowed_content_types
 
 User = get_user_model()
 
@@ -14,7 +20,7 @@ class ItemSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['id', 'name']
 
 
-class CommentListSerializer(serializers.ModelSerializer):
+class CommentListSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = ['id', 'image', 'user', 'created_at', 'comment_text']
@@ -66,14 +72,80 @@ class FavouriteCreateSerializer(serializers.Serializer):
         return value
 
 
-class ReportImageListSerilizer(serializers.ModelSerializer):
+class ReportImageListSerilizer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ReportImage
         fields = ['id', 'image', 'user', 'comment', 'created_at']
         read_only_fields = ['id', 'image', 'user', 'created_at']
 
 
-class ImageListSerializer(serializers.ModelSerializer):
+class ImagePageSerializer(serializers.ListSerializer):
+    """
+    Resolves file urls of the whole page with one storage call before the rows are serialized.
+    """
+
+    def to_representation(self, data):
+        images = list(data.all() if isinstance(data, models.Manager) else data)
+        storage = Image._meta.get_field('file').storage
+        if hasattr(storage, 'urls') and 'file' in self.child.fields:
+            storage.urls(image.file.name for image in images)
+        if 'tags' in self.child.fields:
+            prefetch_related_objects(images, 'tags')
+        return super().to_representation(images)
+
+
+class StreamedImageField(serializers.ImageField):
+    """
+    Files validated by StreamingImageUploadHandler are not opened by Pillow again.
+    """
+
+    def to_internal_value(self, data):
+        if getattr(data, 'image_header', None) is not None:
+            return serializers.FileField.to_internal_value(self, data)
+        return super().to_internal_value(data)
+
+
+class TagListField(serializers.ListField):
+    """
+    Tag names as a list or comma separated, stored normalized. Reads sorted names of the tags of the image.
+    """
+    child = serializers.CharField()
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [data]
+        names = normalize_all(name for value in super().to_internal_value(data) for name in value.split(','))
+        if len(names) > settings.IMAGE_MAX_TAGS:
+            raise serializers.ValidationError("At most {} tags".format(settings.IMAGE_MAX_TAGS))
+        return names
+
+    def to_representation(self, tags):
+        return sorted(tag.name for tag in tags.all())
+
+
+class TaggedImageSerializerMixin:
+    """
+    Tags are written after the image, tags from the title are refreshed when the title changes.
+    """
+
+    def create(self, validated_data):
+        tags = validated_data.pop('tags', None)
+        image = super().create(validated_data)
+        set_image_tags(image, tags)
+        return image
+
+    def update(self, instance, validated_data):
+        tags = validated_data.pop('tags', None)
+        title = instance.title
+        image = super().update(instance, validated_data)
+        if tags is not None or image.title != title:
+            set_image_tags(image, tags)
+        return image
+
+
+class ImageListSerializer(SparseFieldsSerializerMixin, TaggedImageSerializerMixin, serializers.ModelSerializer):
+    file = StreamedImageField()
+    tags = TagListField(required=False)
     comment_count = serializers.SerializerMethodField()
     upvote_count = serializers.SerializerMethodField()
     downvote_count = serializers.SerializerMethodField()
@@ -82,12 +154,12 @@ class ImageListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Image
-        fields = ['id', 'user', 'created_at', 'title', 'description', 'file', "public", "comment_count",
+        fields = ['id', 'user', 'created_at', 'title', 'description', 'file', "public", 'tags', 'width', 'height',
+                  'byte_size', 'mime_type', 'dominant_color', 'placeholder', 'possible_duplicate', "comment_count",
                   "upvote_count", 'downvote_count', "favourite_count", "report_count"]
-        read_only_fields = ["id", 'user', 'created_at']
-        extra_kwargs = {
-            'file': {'read_only': False},
-        }
+        read_only_fields = ["id", 'user', 'created_at', 'width', 'height', 'byte_size', 'mime_type',
+                            'dominant_color', 'placeholder', 'possible_duplicate']
+        list_serializer_class = ImagePageSerializer
 
     def validate_public(self, value):
         if value is None:
@@ -113,7 +185,27 @@ class ImageListSerializer(serializers.ModelSerializer):
         return image.report_to_image.count()
 
 
-class ImageDetailSerializer(serializers.ModelSerializer):
+class UploadTicketSerializer(serializers.ModelSerializer):
+    content_type = serializers.ChoiceField(choices=[])
+
+    class Meta:
+        model = UploadTicket
+        fields = ['id', 'title', 'description', 'public', 'content_type', 'created_at', 'expires_at']
+        read_only_fields = ['id', 'created_at', 'expires_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['content_type'].choices = allowed_content_types()
+
+    def validate_public(self, value):
+        user = self.context['request'].user
+        if not user.is_authenticated and not value:
+            raise serializers.ValidationError("Anonymous user can have only public images")
+        return value
+
+
+class ImageDetailSerializer(SparseFieldsSerializerMixin, TaggedImageSerializerMixin, serializers.ModelSerializer):
+    tags = TagListField(required=False)
     comments = CommentListSerializer(many=True, required=False, source="comment_to_image", read_only=True)
     votes = VoteSerializer(many=True, required=False, source="vote_to_image", read_only=True)
     favourites = FavouritesSerializer(many=True, required=False, source='favourite_to_image', read_only=True)
@@ -122,23 +214,49 @@ class ImageDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Image
-        fields = ['id', 'user', 'created_at', 'title', 'description', 'public', 'file', "comments",
+        fields = ['id', 'user', 'created_at', 'title', 'description', 'public', 'tags', 'file', 'width', 'height',
+                  'byte_size', 'mime_type', 'dominant_color', 'placeholder', 'possible_duplicate', "comments",
                   "votes", "favourites", "reports"]
-        read_only_fields = ['id', 'user', 'created_at', 'file', 'comments', 'votes', 'favourites', "reports"]
+        read_only_fields = ['id', 'user', 'created_at', 'file', 'width', 'height', 'byte_size', 'mime_type',
+                            'dominant_color', 'placeholder', 'possible_duplicate', 'comments', 'votes',
+                            'favourites', "reports"]
         # extra_kwargs = {
         #     'uploaded_by': {'write_only': True},
         # }
 
 
-class UserSerializer(serializers.ModelSerializer):
-    images = ImageDetailSerializer(many=True, required=False)
-    comments = CommentListSerializer(many=True, required=False, source="comment_to_user")
-    votes = VoteSerializer(many=True, required=False, source="vote_to_user")
-    favourites = FavouritesSerializer(many=True, required=False, source="favourite_to_user")
+class UserImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Image
+        fields = ['id', 'created_at', 'title', 'description', 'public', 'width', 'height', 'mime_type']
+
+
+class UserSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    """
+    Summary of a user with counts annotated by the view, relations named in context['expand'] are nested too.
+    """
+    EXPANDABLE = {
+        'images': lambda: UserImageSerializer(many=True, read_only=True),
+        'comments': lambda: CommentListSerializer(many=True, read_only=True, source='comment_to_user'),
+        'votes': lambda: VoteSerializer(many=True, read_only=True, source='vote_to_user'),
+        'favourites': lambda: FavouritesSerializer(many=True, read_only=True, source='favourite_to_user'),
+    }
+    image_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    upvote_count = serializers.IntegerField(read_only=True)
+    downvote_count = serializers.IntegerField(read_only=True)
+    favourite_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'images', "comments", 'votes', "favourites"]
+        fields = ['id', 'username', 'date_joined', 'image_count', 'comment_count', 'upvote_count', 'downvote_count',
+                  'favourite_count']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.context.get('expand', ()):
+            fields[name] = self.EXPANDABLE[name]()
+        return fields
 
 
 class UserRegisterSerializer(serializers.ModelSerializer):
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .blobs import release_blob
+from .feed import record_like
+from .models import Favourite, Image, UploadTicket, Vote
+from .tags import sync_on_commit
+from .tombstones import enqueue_deletion
+
+
+@receiver(post_delete, sender=Image, dispatch_uid='restapi_release_image_file')
+def release_image_file(sender, instance: Image, **kwargs):
+    # also runs for images deleted by cascade from their user
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
+    elif instance.file.name:
+        enqueue_deletion([instance.file.name])
+
+
+@receiver(post_save, sender=Image, dispatch_uid='restapi_index_image_tags')
+def index_image_tags(sender, instance: Image, created: bool, **kwargs):
+    # visibility may have changed, tags of new images are indexed when they are set
+    if not created:
+        sync_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=Image, dispatch_uid='restapi_unindex_image_tags')
+def unindex_image_tags(sender, instance: Image, **kwargs):
+    sync_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=UploadTicket, dispatch_uid='restapi_release_upload')
+def release_upload(sender, instance: UploadTicket, **kwargs):
+    # confirmed uploads were copied to their blob, others were never confirmed
+    enqueue_deletion([instance.object_name])
+
+
+@receiver(post_save, sender=Vote, dispatch_uid='restapi_feed_vote')
+def feed_vote(sender, instance: Vote, **kwargs):
+    if instance.upvote:
+        record_like(instance.user_id, instance.image_id)
+
+
+@receiver(post_save, sender=Favourite, dispatch_uid='restapi_feed_favourite')
+def feed_favourite(sender, instance: Favourite, created: bool, **kwargs):
+    if created:
+        record_like(instance.user_id, instance.image_id)
@@ -0,0 +1,199 @@
+"""
+Visually similar images.
+
+Every image gets a feature vector of its downscaled copy: colour histogram and 8x8 luminance, normalised so
+the dot product of two vectors is their cosine similarity. ImageFeatures rows are the source of truth, each
+process searches a memory-mapped file of (image id, float32 vector) records built from them, so the page
+cache holds the matrix once for all processes. New vectors are appended to the file, compaction rewrites it
+without deleted images. A search multiplies the matrix by a batch of query vectors chunk by chunk.
+"""
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image as PilImage
+from cacheops import CacheMiss, cache
+from django.conf import settings
+
+from .models import ImageFeatures
+
+HISTOGRAM_LEVELS = 4  # per channel
+LUMINANCE_SIZE = 8
+FEATURE_SIZE = HISTOGRAM_LEVELS ** 3 + LUMINANCE_SIZE ** 2
+RECORD = np.dtype([('image_id', '<i8'), ('vector', '<f4', (FEATURE_SIZE,))])
+SEARCH_CHUNK_ROWS = 256 * 1024
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def features(image: PilImage.Image) -> np.ndarray:
+    """
+    Histogram (square roots of bin shares) and mean-free luminance have the same weight.
+    """
+    pixels = np.asarray(image.convert('RGB')).reshape(-1, 3) // (256 // HISTOGRAM_LEVELS)
+    bins = (pixels[:, 0].astype(np.int64) * HISTOGRAM_LEVELS + pixels[:, 1]) * HISTOGRAM_LEVELS + pixels[:, 2]
+    histogram = np.sqrt(np.bincount(bins, minlength=HISTOGRAM_LEVELS ** 3) / len(bins))
+    luminance = np.asarray(image.convert('L').resize((LUMINANCE_SIZE, LUMINANCE_SIZE), PilImage.BILINEAR),
+                           dtype=np.float32).ravel()
+    luminance = _unit(luminance - luminance.mean())
+    return _unit(np.concatenate([_unit(histogram), luminance])).astype(np.float32)
+
+
+class FeatureMatrix:
+    """
+    Appends and rewrites take an exclusive lock of <path>.lock, readers map the file without locking
+    and remap it when it grew or was replaced. Records are written whole, a partly written one is ignored.
+    """
+
+    def __init__(self, path: str = None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._records = np.empty(0, dtype=RECORD)
+        self._inode = None
+
+    @property
+    def path(self) -> str:
+        return self._path or settings.SIMILARITY_INDEX_PATH
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def records(self) -> np.ndarray:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return np.empty(0, dtype=RECORD)
+        rows = stat.st_size // RECORD.itemsize
+        with self._lock:
+            if stat.st_ino != self._inode or rows != len(self._records):
+                self._records = np.memmap(self.path, dtype=RECORD, mode='r', shape=(rows,)) if rows \
+                    else np.empty(0, dtype=RECORD)
+                self._inode = stat.st_ino
+            return self._records
+
+    def append(self, rows: Iterable[Tuple[int, np.ndarray]]):
+        data = np.array(list(rows), dtype=RECORD)
+        if not len(data):
+            return
+        with self._file_lock():
+            with open(self.path, 'ab') as file:
+                file.write(data.tobytes())
+
+    def rebuild(self, rows: Iterable[Tuple[int, np.ndarray]], batch_size: int = 10000) -> int:
+        """
+        Writes the rows to a new file which replaces the current one. Records appended meanwhile are copied over,
+        the lock is held only for that.
+        """
+        start_rows = len(self.records())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+        written = 0
+        with open(temporary, 'wb') as file:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    file.write(np.array(batch, dtype=RECORD).tobytes())
+                    written += len(batch)
+                    batch = []
+            file.write(np.array(batch, dtype=RECORD).tobytes())
+            written += len(batch)
+            with self._file_lock():
+                appended = self.records()[start_rows:]
+                file.write(np.asarray(appended).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+                os.replace(temporary, self.path)
+        return written + len(appended)
+
+    def search(self, queries: np.ndarray, count: int,
+               exclude: Optional[Sequence[int]] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Returns (image id, cosine similarity) of the count most similar records for every query vector,
+        the most similar first. exclude holds one image id per query which is left out of its results.
+        """
+        records = self.records()
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, FEATURE_SIZE)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        # a few more candidates, an image appended twice shows up twice
+        keep = count + 8
+        for start in range(0, len(records), SEARCH_CHUNK_ROWS):
+            chunk = records[start:start + SEARCH_CHUNK_ROWS]
+            scores = queries @ chunk['vector'].T
+            if exclude is not None:
+                scores[np.asarray(exclude)[:, None] == chunk['image_id'][None, :]] = -np.inf
+            if scores.shape[1] > keep:
+                top = np.argpartition(scores, -keep, axis=1)[:, -keep:]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, chunk['image_id'][top]], axis=1)
+            if best_scores.shape[1] > keep:
+                top = np.argpartition(best_scores, -keep, axis=1)[:, -keep:]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+
+        results = []
+        for scores, ids in zip(best_scores, best_ids):
+            found = {}
+            for i in np.argsort(-scores, kind='stable'):
+                if np.isfinite(scores[i]) and int(ids[i]) not in found:
+                    found[int(ids[i])] = float(scores[i])
+            results.append(list(found.items())[:count])
+        return results
+
+
+matrix = FeatureMatrix()
+
+
+def _cache_key(image_id: int) -> str:
+    return 'similar:{}'.format(image_id)
+
+
+def store_features(image_id: int, vector: np.ndarray):
+    _, created = ImageFeatures.objects.get_or_create(image_id=image_id, defaults={'vector': vector.tobytes()})
+    if created:
+        matrix.append([(image_id, vector)])
+    cache.delete(_cache_key(image_id))
+
+
+def find_similar(image_ids: List[int]) -> dict:
+    """
+    Candidates of similar images of every image which has features, cached for SIMILAR_IMAGES_CACHE_TIMEOUT.
+    The candidates include private and deleted images, callers filter them.
+    """
+    vectors = {image_id: np.frombuffer(bytes(vector), dtype=np.float32) for image_id, vector in
+               ImageFeatures.objects.nocache().filter(image_id__in=image_ids).values_list('image_id', 'vector')}
+    if not vectors:
+        return {}
+    ids = list(vectors)
+    found = matrix.search(np.stack([vectors[image_id] for image_id in ids]), settings.SIMILAR_IMAGES_CANDIDATES,
+                          exclude=ids)
+    for image_id, similar in zip(ids, found):
+        cache.set(_cache_key(image_id), similar, settings.SIMILAR_IMAGES_CACHE_TIMEOUT)
+    return dict(zip(ids, found))
+
+
+def similar_images(image_id: int) -> Optional[List[Tuple[int, float]]]:
+    """
+    Returns None when features of the image are not computed yet.
+    """
+    try:
+        return cache.get(_cache_key(image_id))
+    except CacheMiss:
+        pass
+    return find_similar([image_id]).get(image_id)
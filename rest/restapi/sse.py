@@ -0,0 +1,253 @@
+"""
+Server-Sent Events served by restapiproject.asgi.
+
+StreamRouter serves the path of each Stream and passes other requests to Django. Listeners of a stream in a
+process share one redis subscription: a Hub task receives published messages and puts items into asyncio queues
+of the listeners interested in them, so an idle listener is a coroutine waiting on its queue, not a thread.
+A listener which can not keep up (STREAM_QUEUE_SIZE items waiting), or loses the subscription, gets None and is
+disconnected; EventSource reconnects after STREAM_RETRY milliseconds.
+"""
+import asyncio
+import io
+import json
+import logging
+import re
+from functools import wraps
+from typing import Callable, Hashable, Iterable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from redis import asyncio as aioredis
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+ERRORS = {400: 'Bad request', 401: 'Unauthorized', 403: 'Permission denied', 404: 'Image not found'}
+
+
+def async_redis_client() -> aioredis.Redis:
+    return aioredis.Redis.from_url(settings.STREAM_REDIS, decode_responses=True)
+
+
+def format_event(event: str, data: str, event_id: Optional[str] = None) -> bytes:
+    lines = 'id: {}\n'.format(event_id) if event_id is not None else ''
+    return '{}event: {}\ndata: {}\n\n'.format(lines, event, data).encode()
+
+
+def database_sync_to_async(function):
+    """
+    Runs function in the thread with the database connections, which are closed when obsolete like after a request.
+    """
+    @sync_to_async(thread_sensitive=True)
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+def request_for(scope: dict) -> Request:
+    """
+    Request of the stream for permission checks, request.user authenticates it like the API does.
+    """
+    return Request(ASGIRequest(scope, io.BytesIO()),
+                   authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+
+
+async def start(send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': HEADERS})
+    await send({'type': 'http.response.body', 'body': 'retry: {}\n\n'.format(settings.STREAM_RETRY).encode(),
+                'more_body': True})
+
+
+async def send_body(send, body: bytes):
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+
+async def finish(send):
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_error(send, status: int, detail: str):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': detail}).encode()})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def relay(receive, send, queue: asyncio.Queue, render: Callable[[object], Optional[bytes]]):
+    """
+    Sends rendered queue items until the client disconnects or the queue gets None, render may skip an item
+    by returning None. A comment line keeps idle connections open.
+    """
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while True:
+            getting = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getting, disconnected}, timeout=settings.STREAM_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                getting.cancel()
+                return
+            if getting not in done:
+                getting.cancel()
+                await send_body(send, b': keepalive\n\n')
+                continue
+            item = getting.result()
+            if item is None:
+                return
+            body = render(item)
+            if body is not None:
+                await send_body(send, body)
+    finally:
+        disconnected.cancel()
+
+
+class Hub:
+    """
+    Queues of listeners by key, filled by handle() from messages of channels matching pattern. Subclasses may
+    run more background coroutines next to the subscription.
+    """
+    pattern = None
+
+    def __init__(self):
+        self._listeners = {}
+        self._keys = {}
+        self._tasks = []
+        self._ready = None
+
+    def watched(self) -> Iterable[Hashable]:
+        return self._listeners.keys()
+
+    async def join(self, keys: Iterable[Hashable]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.STREAM_QUEUE_SIZE)
+        self._keys[queue] = list(keys)
+        for key in self._keys[queue]:
+            self._listeners.setdefault(key, set()).add(queue)
+        if not self._tasks or self._tasks[0].done():
+            self._ready = asyncio.Event()
+            self._tasks = [asyncio.ensure_future(self._run())] + \
+                          [asyncio.ensure_future(coroutine) for coroutine in self.background()]
+        await self._ready.wait()
+        return queue
+
+    def leave(self, queue: asyncio.Queue):
+        for key in self._keys.pop(queue, ()):
+            queues = self._listeners.get(key)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._listeners[key]
+
+    def deliver(self, key: Hashable, item):
+        for queue in list(self._listeners.get(key, ())):
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._disconnect(queue)
+
+    def _disconnect(self, queue: asyncio.Queue):
+        self.leave(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def handle(self, message: dict):
+        raise NotImplementedError
+
+    def background(self) -> List:
+        return []
+
+    async def _run(self):
+        client = async_redis_client()
+        pubsub = client.pubsub()
+        try:
+            await pubsub.psubscribe(self.pattern)
+            self._ready.set()
+            async for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    await self.handle(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('subscription of %s failed', self.pattern)
+        finally:
+            for task in self._tasks[1:]:
+                task.cancel()
+            for queue in list(self._keys):
+                self._disconnect(queue)
+            self._ready.set()
+            await pubsub.aclose()
+            await client.aclose()
+
+    async def close(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+class Stream:
+    """
+    GET requests of paths matching path are served by serve() with the named groups as arguments.
+    """
+    path = None
+
+    async def serve(self, scope, receive, send, **kwargs):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StreamRouter:
+    """
+    ASGI application serving the streams, other requests go to application.
+    """
+
+    def __init__(self, application, streams: List[Stream]):
+        self.application = application
+        self.streams = streams
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for stream in self.streams:
+                match = re.match(stream.path, scope['path'])
+                if match is not None:
+                    return await stream.serve(scope, receive, send, **match.groupdict())
+        return await self.application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        for stream in self.streams:
+            await stream.close()
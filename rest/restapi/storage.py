@@ -0,0 +1,74 @@
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.utils.deconstruct import deconstructible
+from minio_storage.storage import MinioMediaStorage
+
+
+@deconstructible
+class MediaStorage(MinioMediaStorage):
+    """
+    Minio media storage with memoized url().
+
+    Urls of a public bucket are assembled from the precomputed base url without touching the minio client.
+    Presigned urls are cached for half of their validity, so a cached url is always valid when served.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._urls = OrderedDict()
+        self._urls_lock = threading.Lock()
+        self.url_cache_size = getattr(settings, 'MINIO_STORAGE_URL_CACHE_SIZE', 100000)
+        self.presigned_url_max_age = timedelta(seconds=getattr(settings, 'MINIO_STORAGE_PRESIGNED_URL_MAX_AGE',
+                                                               60 * 60))
+        self._public_base = None
+        if not self.presign_urls and self.base_url is not None:
+            self._public_base = self.base_url.rstrip('/') + '/'
+
+    def url(self, name: str, *args, max_age: timedelta = None) -> str:
+        if max_age is not None:
+            return super().url(name, *args, max_age=max_age)
+        cached = self._urls.get(name)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]  # lru order is refreshed by the bulk lookups of pages
+        return self.urls([name])[name]
+
+    def urls(self, names: Iterable[str]) -> Dict[str, str]:
+        """
+        Urls of many objects at once, the page serializers resolve all file urls of a page with one call.
+        """
+        now = time.monotonic()
+        result = {}
+        missing = []
+        with self._urls_lock:
+            for name in names:
+                if not name or name in result:
+                    continue
+                cached = self._urls.get(name)
+                if cached is not None and cached[1] > now:
+                    self._urls.move_to_end(name)
+                    result[name] = cached[0]
+                else:
+                    missing.append(name)
+
+        computed = [(name,) + self._compute_url(name, now) for name in missing]
+        with self._urls_lock:
+            for name, url, expires_at in computed:
+                self._urls[name] = (url, expires_at)
+                result[name] = url
+            while len(self._urls) > self.url_cache_size:
+                self._urls.popitem(last=False)
+        return result
+
+    def _compute_url(self, name: str, now: float):
+        if self._public_base is not None:
+            return self._public_base + urllib.parse.quote(name.lstrip('/')), float('inf')
+        if self.presign_urls:
+            url = super().url(name, max_age=self.presigned_url_max_age)
+            return url, now + self.presigned_url_max_age.total_seconds() / 2
+        return super().url(name), float('inf')
@@ -0,0 +1,247 @@
+"""
+Image tags and their inverted index.
+
+Tags are given on upload and PUT, images also get tags from the words of their title. ImageTag rows are the source
+of truth, redis keeps a posting set of image ids for every tag, one with all images and one with public images, so
+tag queries are set intersections and unions. Counts of images per tag (facets) are sorted sets next to them.
+Every committed change of an image reconciles its postings and counts in one script, which remembers the tags and
+visibility the image was indexed with. rebuild_tag_index recreates everything from the database.
+"""
+import re
+import uuid
+from functools import lru_cache, partial
+from typing import Iterable, List, Optional, Set, Tuple
+
+from cacheops.redis import redis_client
+from django.conf import settings
+from django.db import transaction
+
+from . import usercache
+from .models import Image, ImageTag, Tag
+
+KEY_PREFIX = 'tags:'
+TAG_RE = re.compile(r'[^a-z0-9_-]+')
+WORD_RE = re.compile(r'[a-z0-9]+')
+TITLE_STOP_WORDS = {
+    'and', 'the', 'for', 'with', 'from', 'img', 'image', 'photo', 'pic', 'picture', 'copy', 'final', 'jpg', 'jpeg',
+    'png', 'gif', 'webp', 'dsc', 'dcim',
+}
+
+# KEYS: tags of the image, visibility of the image; ARGV: image id, public ('1'/'0'), tag, tag, ...
+SYNC_IMAGE = """
+local prefix = 'tags:'
+local old = redis.call('smembers', KEYS[1])
+local was_public = redis.call('get', KEYS[2]) == '1'
+for _, tag in ipairs(old) do
+    redis.call('srem', prefix .. 'all:' .. tag, ARGV[1])
+    redis.call('zincrby', prefix .. 'counts:all', -1, tag)
+    if was_public then
+        redis.call('srem', prefix .. 'public:' .. tag, ARGV[1])
+        redis.call('zincrby', prefix .. 'counts:public', -1, tag)
+    end
+end
+redis.call('del', KEYS[1], KEYS[2])
+for i = 3, #ARGV do
+    local tag = ARGV[i]
+    redis.call('sadd', KEYS[1], tag)
+    redis.call('sadd', prefix .. 'all:' .. tag, ARGV[1])
+    redis.call('zincrby', prefix .. 'counts:all', 1, tag)
+    if ARGV[2] == '1' then
+        redis.call('sadd', prefix .. 'public:' .. tag, ARGV[1])
+        redis.call('zincrby', prefix .. 'counts:public', 1, tag)
+    end
+end
+if #ARGV > 2 then
+    redis.call('set', KEYS[2], ARGV[2])
+end
+redis.call('zremrangebyscore', prefix .. 'counts:all', '-inf', 0)
+redis.call('zremrangebyscore', prefix .. 'counts:public', '-inf', 0)
+return #ARGV - 2
+"""
+
+
+@lru_cache(maxsize=None)
+def _sync_image_script():
+    return redis_client.register_script(SYNC_IMAGE)
+
+
+def _scope(public_only: bool) -> str:
+    return 'public' if public_only else 'all'
+
+
+def posting_key(tag: str, public_only: bool) -> str:
+    return '{}{}:{}'.format(KEY_PREFIX, _scope(public_only), tag)
+
+
+def counts_key(public_only: bool) -> str:
+    return '{}counts:{}'.format(KEY_PREFIX, _scope(public_only))
+
+
+def normalize(name: str) -> str:
+    return TAG_RE.sub('-', name.strip().lower()).strip('-')[:Tag._meta.get_field('name').max_length]
+
+
+def normalize_all(names: Iterable[str]) -> List[str]:
+    normalized = []
+    for name in names:
+        name = normalize(name)
+        if name and name not in normalized:
+            normalized.append(name)
+    return normalized
+
+
+def title_tags(title: str) -> List[str]:
+    """
+    Words of the title which make sense as tags, e.g. 'Sunset_at-the_beach2.jpg' gives sunset, beach2.
+    """
+    words = [word for word in WORD_RE.findall(title.lower())
+             if len(word) >= 3 and not word.isdigit() and word not in TITLE_STOP_WORDS]
+    return normalize_all(words)[:settings.IMAGE_TITLE_TAGS]
+
+
+def sync_image(image_id: int, tags: List[str], public: bool):
+    """
+    Indexes the image with exactly these tags, a deleted image has none.
+    """
+    # tag names contain no colon, so these keys never clash with postings
+    keys = ['{}image:{}'.format(KEY_PREFIX, image_id), '{}visibility:{}'.format(KEY_PREFIX, image_id)]
+    _sync_image_script()(keys=keys, args=[image_id, '1' if public else '0'] + list(tags))
+
+
+def sync_from_database(image_id: int):
+    image = Image.objects.nocache().filter(pk=image_id).values('public').first()
+    if image is None:
+        sync_image(image_id, [], False)
+        return
+    tags = ImageTag.objects.nocache().filter(image_id=image_id).values_list('tag__name', flat=True)
+    sync_image(image_id, list(tags), image['public'])
+
+
+def sync_on_commit(image_id: int):
+    """
+    Reindexes the image from the database when the transaction commits, postings written before would stay
+    after a rollback.
+    """
+    transaction.on_commit(partial(sync_from_database, image_id))
+
+
+def set_image_tags(image: Image, names: Optional[Iterable[str]] = None):
+    """
+    Replaces tags given by the user (kept when names is None) and tags from the title.
+    """
+    current = {image_tag.tag.name: image_tag for image_tag in
+               ImageTag.objects.nocache().filter(image=image).select_related('tag')}
+    if names is None:
+        manual = [name for name, image_tag in current.items() if not image_tag.automatic]
+    else:
+        manual = normalize_all(names)[:settings.IMAGE_MAX_TAGS]
+    wanted = {name: False for name in manual}
+    for name in title_tags(image.title):
+        wanted.setdefault(name, True)
+
+    with transaction.atomic():
+        stale = [image_tag.pk for name, image_tag in current.items()
+                 if name not in wanted or image_tag.automatic != wanted[name]]
+        ImageTag.objects.filter(pk__in=stale).delete()
+        missing = [name for name in wanted if name not in current or current[name].pk in stale]
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+            tag_ids = dict(Tag.objects.nocache().filter(name__in=missing).values_list('name', 'pk'))
+            ImageTag.objects.bulk_create([ImageTag(image=image, tag_id=tag_ids[name], automatic=wanted[name])
+                                          for name in missing])
+    sync_on_commit(image.pk)
+    if stale or missing:
+        # lists showing the tags of the image
+        transaction.on_commit(partial(usercache.bump_images, [image.pk]))
+
+
+def parse_query(value: str) -> List[str]:
+    return normalize_all(value.split(','))
+
+
+def tagged_image_ids(tags: List[str], match_all: bool, public_only: bool) -> Set[int]:
+    """
+    Ids of images with all (or any) of the tags, the TAG_QUERY_MAX_CANDIDATES newest (highest ids) of them,
+    so the database gets a bounded list. The postings are combined and cut in redis.
+    """
+    keys = [posting_key(tag, public_only) for tag in tags]
+    if not keys:
+        return set()
+    result = '{}query:{}'.format(KEY_PREFIX, uuid.uuid4().hex)
+    pipeline = redis_client.pipeline()
+    if match_all:
+        pipeline.sinterstore(result, keys)
+    else:
+        pipeline.sunionstore(result, keys)
+    pipeline.sort(result, start=0, num=settings.TAG_QUERY_MAX_CANDIDATES, desc=True)
+    pipeline.delete(result)
+    members = pipeline.execute()[1]
+    return {int(member) for member in members}
+
+
+def facet_counts(public_only: bool, limit: int, prefix: str = '') -> List[Tuple[str, int]]:
+    """
+    Tags with the most images, with prefix the most used tags starting with it.
+    """
+    if not prefix:
+        counts = [(tag.decode(), int(count)) for tag, count in
+                  redis_client.zrevrange(counts_key(public_only), 0, limit - 1, withscores=True)]
+    else:
+        names = list(Tag.objects.filter(name__startswith=prefix).order_by('name')
+                     .values_list('name', flat=True)[:settings.TAG_PREFIX_CANDIDATES])
+        pipeline = redis_client.pipeline(transaction=False)
+        for name in names:
+            pipeline.zscore(counts_key(public_only), name)
+        counts = [(name, int(score)) for name, score in zip(names, pipeline.execute()) if score]
+    # redis orders equal counts by reversed name
+    return sorted(counts, key=lambda count: (-count[1], count[0]))[:limit]
+
+
+def rebuild_index(batch_size: int = 1000) -> int:
+    """
+    Deletes all keys of the index and indexes every tagged image again, returns the number of images.
+    """
+    for keys in _batches(redis_client.scan_iter(match=KEY_PREFIX + '*', count=batch_size), batch_size):
+        redis_client.delete(*keys)
+    indexed = 0
+    last_pk = 0
+    while True:
+        images = list(Image.objects.nocache().filter(pk__gt=last_pk, tags__isnull=False).distinct()
+                      .order_by('pk').values_list('pk', 'public')[:batch_size])
+        if not images:
+            return indexed
+        last_pk = images[-1][0]
+        _sync_batch(images)
+        indexed += len(images)
+
+
+def sync_images(image_ids: List[int], batch_size: int = 1000):
+    """
+    Reindexes images changed without signals, like by QuerySet.update().
+    """
+    for start in range(0, len(image_ids), batch_size):
+        batch = image_ids[start:start + batch_size]
+        images = list(Image.objects.nocache().filter(pk__in=batch).values_list('pk', 'public'))
+        _sync_batch(images)
+        for image_id in set(batch) - {pk for pk, _ in images}:
+            sync_image(image_id, [], False)
+
+
+def _sync_batch(images: List[Tuple[int, bool]]):
+    tags = {}
+    for image_id, name in ImageTag.objects.nocache().filter(image_id__in=[pk for pk, _ in images]) \
+            .values_list('image_id', 'tag__name'):
+        tags.setdefault(image_id, []).append(name)
+    for image_id, public in images:
+        sync_image(image_id, tags.get(image_id, []), public)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
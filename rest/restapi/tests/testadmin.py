@@ -0,0 +1,78 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .dataclasses import UserTestData
+from .testimage import ImageTestBase
+from .. import counting, tags
+from ..models import Comment, Image as ModelImage, Vote
+
+
+class TestCounting(ImageTestBase):
+
+    def test_fast_count(self):
+        ModelImage.objects.create(title='image', file='image.png')
+        with mock.patch.object(counting, 'estimated_count', return_value=500000):
+            self.assertEqual(counting.fast_count(ModelImage.objects.all()), 500000)
+            self.assertEqual(counting.fast_count(ModelImage.objects.filter(public=True)), 1)
+            with override_settings(ESTIMATED_COUNT_THRESHOLD=10 ** 6):
+                self.assertEqual(counting.fast_count(ModelImage.objects.all()), 1)
+        # no estimates without postgres
+        self.assertEqual(counting.fast_count(ModelImage.objects.all()), 1)
+
+
+@override_settings(ADMIN_INLINE_PER_PAGE=5)
+class TestAdmin(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.superuserInfo.user)
+        self.image = ModelImage.objects.create(title='image', file='image.png', user=self.user1Owner.user)
+
+    def add_votes(self, count):
+        start = Vote.objects.count()
+        for i in range(start, start + count):
+            user = self.create_user(UserTestData('voter{}'.format(i), 'easypass', 'voter{}@test.com'.format(i))).user
+            Vote.objects.create(image=self.image, user=user, upvote=True)
+            Comment.objects.create(image=self.image, user=user, comment_text='comment {}'.format(i))
+
+    def change_page(self, query=''):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/admin/restapi/image/{}/change/{}'.format(self.image.pk, query))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(context.captured_queries)
+
+    def test_inlines_are_paginated(self):
+        self.add_votes(7)
+        content, queries = self.change_page()
+        self.assertIn('1 / 2', content)
+        self.assertIn('comment 4', content)
+        self.assertNotIn('comment 5', content)
+        content, _ = self.change_page('?comment_to_image-page=2')
+        self.assertIn('comment 6', content)
+        self.assertNotIn('comment 4', content)
+
+        # rows of other pages cost no queries
+        self.add_votes(20)
+        self.assertLessEqual(self.change_page()[1], queries)
+
+    def test_changelists(self):
+        self.add_votes(2)
+        for model in ('image', 'vote', 'comment', 'favourite', 'myuser'):
+            response = self.client.get('/admin/restapi/{}/'.format(model))
+            self.assertEqual(response.status_code, 200, model)
+        response = self.client.get('/admin/restapi/vote/?image__id__exact={}'.format(self.image.pk))
+        self.assertContains(response, '2 votes')
+        response = self.client.get('/admin/restapi/myuser/{}/change/'.format(Vote.objects.first().user_id))
+        self.assertContains(response, 'comment 0')
+
+    def test_visibility_actions(self):
+        tags.set_image_tags(self.image, ['cat'])
+        response = self.client.post('/admin/restapi/image/', {'action': 'make_private',
+                                                              '_selected_action': [self.image.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ModelImage.objects.get(pk=self.image.pk).public)
+        self.assertEqual(tags.tagged_image_ids(['cat'], True, public_only=True), set())
+        self.assertEqual(tags.tagged_image_ids(['cat'], True, public_only=False), {self.image.pk})
@@ -0,0 +1,135 @@
+import asyncio
+import json
+from unittest import mock
+
+import fakeredis
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from rest_framework.authtoken.models import Token
+
+from .testimage import ImageTestBase
+from .. import commentstream, countstream, sse
+from ..commentstream import CommentStream
+from ..models import Image as ModelImage
+
+
+def parse_events(body: bytes):
+    events = []
+    for block in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class StreamTestBase(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        # one local redis for the views publishing and the streams reading
+        server = fakeredis.FakeServer()
+        publisher = fakeredis.FakeRedis(server=server)
+        patchers = [
+            mock.patch.object(commentstream, 'redis_client', publisher),
+            mock.patch.object(countstream, 'redis_client', publisher),
+            mock.patch.object(sse, 'async_redis_client',
+                              lambda: fakeredis.FakeAsyncRedis(server=server, decode_responses=True)),
+            # connections of the test case are kept
+            mock.patch.object(sse, 'close_old_connections'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.image = ModelImage.objects.create(title='image', file='image.png', user=self.user1Owner.user)
+        self.stream = self.create_stream()
+        self.application = sse.StreamRouter(None, [self.stream])
+
+    def create_stream(self) -> sse.Stream:
+        raise NotImplementedError
+
+    def scope(self, path: str, user=None, query='', headers=()):
+        headers = list(headers)
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user.user)
+            headers.append((b'authorization', 'Token {}'.format(token.key).encode()))
+        return {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'query_string': query.encode(),
+                'headers': headers}
+
+    def run_stream(self, scope, scenario=None, live_events=0):
+        """
+        Returns status and events sent to the listener, live_events are awaited after scenario ran.
+        A coroutine scenario runs in the loop of the stream, other in the thread of the test.
+        """
+        async def run():
+            communicator = ApplicationCommunicator(self.application, scope)
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(5)
+            body = b''
+            if start['status'] == 200:
+                body += (await communicator.receive_output(5))['body']  # retry
+                if asyncio.iscoroutinefunction(scenario):
+                    await scenario()
+                elif scenario is not None:
+                    await sync_to_async(scenario)()
+                for _ in range(live_events):
+                    body += (await communicator.receive_output(5))['body']
+                await communicator.send_input({'type': 'http.disconnect'})
+            while True:
+                message = await communicator.receive_output(5)
+                body += message['body']
+                if not message.get('more_body'):
+                    break
+            await communicator.wait(5)
+            await self.application.close()
+            return start['status'], parse_events(body)
+        return async_to_sync(run)()
+
+
+class TestCommentStream(StreamTestBase):
+
+    def create_stream(self):
+        return CommentStream()
+
+    def comment_scope(self, image: ModelImage, user=None, query='', headers=()):
+        return self.scope('/images/{}/comment/stream'.format(image.pk), user, query, headers)
+
+    def comment(self, user, text):
+        response = user.client.post('/images/{}/comment'.format(self.image.pk), {'comment_text': text})
+        return response.data['id']
+
+    def test_live_events(self):
+        def scenario():
+            comment_id = self.comment(self.user2Observer, 'first')
+            self.user2Observer.client.put('/comment/{}'.format(comment_id), {'comment_text': 'edited'})
+            self.user2Observer.client.delete('/comment/{}'.format(comment_id))
+
+        status, events = self.run_stream(self.comment_scope(self.image), scenario, live_events=3)
+        self.assertEqual(status, 200)
+        self.assertEqual([(event, data.get('comment_text')) for _, event, data in events],
+                         [('created', 'first'), ('updated', 'edited'), ('deleted', None)])
+        self.assertEqual(len({event_id for event_id, _, _ in events}), 3)
+
+    def test_resume_since(self):
+        self.comment(self.user2Observer, 'first')
+        self.comment(self.user2Observer, 'second')
+        self.comment(self.user2Observer, 'third')
+        status, events = self.run_stream(self.comment_scope(self.image, query='since=0'))
+        self.assertEqual([data['comment_text'] for _, _, data in events], ['first', 'second', 'third'])
+
+        first_id = events[0][0]
+        _, resumed = self.run_stream(self.comment_scope(self.image, query='since={}'.format(first_id)))
+        self.assertEqual([data['comment_text'] for _, _, data in resumed], ['second', 'third'])
+        headers = [(b'last-event-id', events[1][0].encode())]
+        _, resumed = self.run_stream(self.comment_scope(self.image, headers=headers))
+        self.assertEqual([data['comment_text'] for _, _, data in resumed], ['third'])
+
+        # without a cursor only new events are sent
+        self.assertEqual(self.run_stream(self.comment_scope(self.image))[1], [])
+
+    def test_permissions(self):
+        ModelImage.objects.filter(pk=self.image.pk).update(public=False)
+        self.assertEqual(self.run_stream(self.comment_scope(self.image))[0], 403)
+        self.assertEqual(self.run_stream(self.comment_scope(self.image, self.user2Observer))[0], 403)
+        self.assertEqual(self.run_stream(self.comment_scope(self.image, self.user1Owner))[0], 200)
+        self.assertEqual(self.run_stream(self.comment_scope(self.image, query='since=abc'))[0], 400)
+        self.assertEqual(self.run_stream(self.comment_scope(ModelImage(pk=self.image.pk + 1)))[0], 404)
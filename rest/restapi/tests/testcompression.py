@@ -0,0 +1,87 @@
+import gzip
+import unittest
+import zlib
+from unittest import mock
+
+from cacheops.redis import redis_client
+from django.test import override_settings
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import compression
+from ..models import Image as ModelImage
+
+
+class TestEncodingNegotiation(unittest.TestCase):
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_gzip_only(self):
+        self.assertEqual(compression.accepted_encoding('gzip, deflate, br'), compression.GZIP)
+        self.assertEqual(compression.accepted_encoding('*'), compression.GZIP)
+        self.assertIsNone(compression.accepted_encoding('br, gzip;q=0'))
+        self.assertIsNone(compression.accepted_encoding('identity'))
+        self.assertIsNone(compression.accepted_encoding(''))
+
+    @mock.patch.object(compression, 'brotli', mock.Mock())
+    def test_brotli_preferred(self):
+        self.assertEqual(compression.accepted_encoding('gzip, br'), compression.BROTLI)
+        self.assertEqual(compression.accepted_encoding('gzip, br;q=0'), compression.GZIP)
+
+    def test_compressible_types(self):
+        self.assertTrue(compression.is_compressible('application/json'))
+        self.assertTrue(compression.is_compressible('text/html; charset=utf-8'))
+        self.assertFalse(compression.is_compressible('text/event-stream'))
+        self.assertFalse(compression.is_compressible('application/zip'))
+
+    @override_settings(COMPRESSION_GZIP_LEVEL=6)
+    def test_stream(self):
+        chunks = [b'{"chunk": %d}\n' % i * 50 for i in range(10)]
+        compressed = list(compression.compress_stream(iter(chunks), compression.GZIP))
+        self.assertGreaterEqual(len(compressed), len(chunks))
+        self.assertEqual(zlib.decompress(b''.join(compressed), 16 + zlib.MAX_WBITS), b''.join(chunks))
+
+    @unittest.skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_stream(self):
+        chunks = [b'{"chunk": %d}\n' % i * 50 for i in range(10)]
+        compressed = b''.join(compression.compress_stream(iter(chunks), compression.BROTLI))
+        self.assertEqual(compression.brotli.decompress(compressed), b''.join(chunks))
+
+
+@override_settings(COMPRESSION_ENABLED=True, COMPRESSION_MIN_SIZE=1024)
+class TestCompressionMiddleware(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        keys = list(redis_client.scan_iter(match='compressed:*'))
+        if keys:
+            redis_client.delete(*keys)
+        for i in range(10):
+            ModelImage.objects.create(title='image {}'.format(i), description='description ' * 10,
+                                      file='image{}.png'.format(i))
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_json_is_compressed_once(self):
+        client = self.user1Owner.client
+        identity = client.get('/images/')
+        self.assertEqual(identity.status_code, status.HTTP_200_OK)
+        self.assertFalse(identity.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', identity['Vary'])
+
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            for _ in range(3):
+                response = client.get('/images/', HTTP_ACCEPT_ENCODING='gzip, br')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertEqual(response['Content-Length'], str(len(response.content)))
+                self.assertEqual(gzip.decompress(response.content), identity.content)
+        self.assertEqual(compress.call_count, 1)
+
+    def test_small_and_error_responses(self):
+        response = self.user1Owner.client.get('/images/tags', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        with override_settings(COMPRESSION_MIN_SIZE=1), \
+                mock.patch.object(compression, 'cached_compress') as cached_compress:
+            response = self.user1Owner.client.get('/images/?fields=unknown', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        cached_compress.assert_not_called()
@@ -0,0 +1,62 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.test import override_settings
+
+from .testcommentstream import StreamTestBase
+from ..countstream import CountStream
+from ..models import Image as ModelImage
+
+
+# counts are sent when the test flushes them
+@override_settings(COUNT_STREAM_INTERVAL=3600)
+class TestCountStream(StreamTestBase):
+
+    def create_stream(self):
+        return CountStream()
+
+    def count_scope(self, *images, user=None):
+        return self.scope('/images/counts/stream', user, 'ids=' + ','.join(str(image.pk) for image in images))
+
+    async def flush_changes(self):
+        # the views published, the subscription has to receive it first
+        for _ in range(100):
+            if self.stream.hub._changed:
+                break
+            await asyncio.sleep(0.01)
+        await self.stream.hub.flush()
+
+    def test_coalesced_counts(self):
+        other = ModelImage.objects.create(title='other', file='other.png')
+        zero = {'upvote_count': 0, 'downvote_count': 0, 'favourite_count': 0}
+
+        def change():
+            for user, vote in ((self.superuserInfo, 'up'), (self.user1Owner, 'up'), (self.user2Observer, 'down')):
+                user.client.put('/images/{}/vote'.format(self.image.pk), {'type': vote})
+            self.user2Observer.client.put('/images/{}/favourite'.format(self.image.pk), {'type': 'add'})
+
+        async def scenario():
+            await sync_to_async(change)()
+            await self.flush_changes()
+            # unchanged counts are not sent again
+            self.stream.hub._changed.add(self.image.pk)
+            await self.stream.hub.flush()
+
+        status, events = self.run_stream(self.count_scope(self.image, other), scenario, live_events=1)
+        self.assertEqual(status, 200)
+        self.assertEqual([data for _, _, data in events], [
+            dict(zero, id=self.image.pk),
+            dict(zero, id=other.pk),
+            {'id': self.image.pk, 'upvote_count': 2, 'downvote_count': 1, 'favourite_count': 1},
+        ])
+
+    def test_visibility(self):
+        ModelImage.objects.filter(pk=self.image.pk).update(public=False)
+        self.assertEqual(self.run_stream(self.count_scope(self.image))[0], 404)
+        self.assertEqual(self.run_stream(self.count_scope(self.image, user=self.user2Observer))[0], 404)
+        self.assertEqual(self.run_stream(self.count_scope(self.image, user=self.user1Owner))[0], 200)
+        self.assertEqual(self.run_stream(self.count_scope(self.image, user=self.superuserInfo))[0], 200)
+        self.assertEqual(self.run_stream(self.scope('/images/counts/stream', query='ids=a'))[0], 400)
+        with self.settings(COUNT_STREAM_MAX_IDS=1):
+            other = ModelImage.objects.create(title='other', file='other.png')
+            self.assertEqual(self.run_stream(self.count_scope(self.image, other))[0], 400)
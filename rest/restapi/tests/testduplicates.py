@@ -0,0 +1,98 @@
+import io
+from unittest import mock
+
+from PIL import Image as PilImage, ImageFilter
+from django.test import SimpleTestCase
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .testimagemeta import gradient, image_bytes
+from .. import duplicates
+from ..duplicates import HashIndex, dhash, hamming
+from ..imagemeta import extract_object, save_metadata
+from ..models import Image as ModelImage, ImageHash
+
+
+class TestPerceptualHash(SimpleTestCase):
+
+    def test_similar_images_are_close(self):
+        image = gradient().resize((400, 300))
+        recompressed = PilImage.open(io.BytesIO(image_bytes(image, 'JPEG'))).resize((200, 150))
+        blurred = image.filter(ImageFilter.GaussianBlur(2))
+        self.assertLessEqual(hamming(dhash(image), dhash(recompressed)), 4)
+        self.assertLessEqual(hamming(dhash(image), dhash(blurred)), 4)
+        self.assertGreater(hamming(dhash(image), dhash(image.transpose(PilImage.FLIP_LEFT_RIGHT))), 16)
+
+    def test_hash_is_signed_64_bit(self):
+        value = dhash(gradient().transpose(PilImage.FLIP_LEFT_RIGHT))
+        self.assertTrue(-2 ** 63 <= value < 2 ** 63)
+
+
+class TestHashIndex(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.images = [ModelImage.objects.create(title=str(i), file='image{}.png'.format(i)) for i in range(3)]
+
+    def test_search(self):
+        ImageHash.objects.create(image=self.images[0], phash=0)
+        ImageHash.objects.create(image=self.images[1], phash=0b111)
+        ImageHash.objects.create(image=self.images[2], phash=-1)
+        index = HashIndex()
+        self.assertEqual(index.search(0b1, 2), [(self.images[0].pk, 1), (self.images[1].pk, 2)])
+        self.assertEqual(index.search(0, 2, exclude=self.images[0].pk), [])
+        self.assertEqual(index.search(-2, 1), [(self.images[2].pk, 1)])
+
+    def test_new_hashes_are_loaded(self):
+        index = HashIndex()
+        self.assertEqual(len(index.search(0, 64)), 0)
+        ImageHash.objects.create(image=self.images[0], phash=0)
+        self.assertEqual(len(index.search(0, 64)), 0)  # refreshed at most every DUPLICATE_INDEX_REFRESH seconds
+        self.assertEqual(len(index.search(0, 64, refresh=True)), 1)
+
+
+@mock.patch.object(duplicates, 'index', new_callable=HashIndex)
+class TestDuplicates(ImageTestBase):
+
+    def upload(self, data: bytes, name: str) -> ModelImage:
+        file = io.BytesIO(data)
+        file.name = name
+        response = self.user1Owner.client.post('/images/', data={'title': name, 'public': True, 'file': file},
+                                               format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = ModelImage.objects.get(pk=response.data['id'])
+        # runs after commit in the upload request
+        save_metadata(image.pk, extract_object(image.file.name))
+        return ModelImage.objects.nocache().get(pk=image.pk)
+
+    def test_reupload_is_flagged(self, index):
+        original = self.upload(image_bytes(gradient(), 'PNG'), 'original.png')
+        other = self.upload(image_bytes(gradient().transpose(PilImage.FLIP_LEFT_RIGHT), 'PNG'), 'other.png')
+        repost = self.upload(image_bytes(gradient().resize((80, 60)), 'JPEG'), 'repost.jpg')
+        self.assertFalse(original.possible_duplicate)
+        self.assertFalse(other.possible_duplicate)
+        self.assertTrue(repost.possible_duplicate)
+
+        response = self.superuserInfo.client.get('/images/{}/duplicates'.format(original.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([image['id'] for image in response.data], [repost.pk])
+        self.assertLessEqual(response.data[0]['distance'], 6)
+
+        response = self.superuserInfo.client.get('/images/?possible_duplicate=true')
+        self.assertEqual([image['id'] for image in response.data['results']], [repost.pk])
+
+    def test_deleted_image_is_not_returned(self, index):
+        original = self.upload(image_bytes(gradient(), 'PNG'), 'original.png')
+        repost = self.upload(image_bytes(gradient(), 'JPEG'), 'repost.jpg')
+        repost.delete()
+        response = self.superuserInfo.client.get('/images/{}/duplicates'.format(original.pk))
+        self.assertEqual(response.data, [])
+
+    def test_only_admin(self, index):
+        original = self.upload(image_bytes(gradient(), 'PNG'), 'original.png')
+        response = self.user1Owner.client.get('/images/{}/duplicates'.format(original.pk))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.superuserInfo.client.get('/images/{}/duplicates?distance=65'.format(original.pk))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.superuserInfo.client.get('/images/{}/duplicates'.format(original.pk + 1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,97 @@
+import numpy as np
+from cacheops.redis import redis_client
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import feed
+from ..models import Favourite, Image as ModelImage, Vote
+
+
+class TestNeighbours(SimpleTestCase):
+
+    def test_cosine_of_co_occurrence(self):
+        # users 1 and 2 like images 10 and 20, user 3 likes 20 and 30
+        pairs = np.array([[1, 10], [1, 20], [2, 10], [2, 20], [3, 20], [3, 30]])
+        neighbours = feed.compute_neighbours(pairs, 5)
+        self.assertEqual(neighbours[10]['image_id'].tolist(), [20])
+        self.assertAlmostEqual(float(neighbours[10]['score'][0]), 2 / np.sqrt(2 * 3), places=5)
+        self.assertEqual(neighbours[20]['image_id'].tolist(), [10, 30])
+        self.assertEqual(neighbours[30]['image_id'].tolist(), [20])
+
+    def test_count(self):
+        pairs = np.array([[1, image_id] for image_id in range(10)])
+        self.assertEqual([len(values) for values in feed.compute_neighbours(pairs, 3).values()], [3] * 10)
+        self.assertEqual(feed.compute_neighbours(np.array([[1, 1], [2, 2]]), 3), {})
+
+
+class TestFeed(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.images = [ModelImage.objects.create(title=str(i), file='image{}.png'.format(i)) for i in range(5)]
+        for user in (self.superuserInfo, self.user1Owner, self.user2Observer):
+            redis_client.delete(feed.candidates_key(user.user.pk), feed.liked_key(user.user.pk))
+
+    def like(self, user, *images):
+        for image in images:
+            Vote.objects.create(user=user.user, image=image, upvote=True)
+
+    def feed(self, user):
+        response = user.client.get('/me/feed')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [image['id'] for image in response.data['results']]
+
+    def test_feed(self):
+        first, second, third, fourth, private = self.images
+        ModelImage.objects.filter(pk=private.pk).update(public=False)
+        self.like(self.superuserInfo, first, second, third, private)
+        Favourite.objects.create(user=self.user1Owner.user, image=first)
+        self.like(self.user1Owner, second)
+        feed.rebuild_neighbours()
+
+        self.like(self.user2Observer, first)
+        self.assertEqual(self.feed(self.user2Observer), [second.pk, third.pk])
+
+        # a new like adds neighbours of the image, liked images leave the feed
+        self.like(self.superuserInfo, fourth)
+        feed.rebuild_neighbours()
+        self.like(self.user2Observer, second)
+        self.assertEqual(self.feed(self.user2Observer), [third.pk, fourth.pk])
+
+    def test_downvote_is_no_like(self):
+        first, second = self.images[:2]
+        self.like(self.superuserInfo, first, second)
+        feed.rebuild_neighbours()
+        Vote.objects.create(user=self.user2Observer.user, image=first, upvote=False)
+        self.assertEqual(feed.user_candidates(self.user2Observer.user.pk), [])
+
+    def test_without_likes(self):
+        self.assertEqual(len(self.feed(self.user1Owner)), 5)
+        self.assertEqual(self.anonymousUser.client.get('/me/feed').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ordering_is_ignored(self):
+        first, second, third = self.images[:3]
+        self.like(self.superuserInfo, first, second, third)
+        feed.rebuild_neighbours()
+        self.like(self.user2Observer, first)
+        best_first = self.feed(self.user2Observer)
+        response = self.user2Observer.client.get('/me/feed?ordering=created_at')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([image['id'] for image in response.data['results']], best_first)
+        response = self.user1Owner.client.get('/me/feed?ordering=created_at')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_queries_do_not_grow_with_the_page(self):
+        self.like(self.superuserInfo, *self.images)
+        feed.rebuild_neighbours()
+        self.like(self.user2Observer, self.images[0])
+        self.feed(self.user2Observer)
+        with CaptureQueriesContext(connection) as four:
+            self.assertEqual(len(self.feed(self.user2Observer)), 4)
+        ModelImage.objects.filter(pk__in=[image.pk for image in self.images[2:]]).update(public=False)
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(len(self.feed(self.user2Observer)), 1)
+        self.assertEqual(len(four), len(one))
@@ -0,0 +1,71 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from ..models import Comment, Image as ModelImage, Vote
+
+
+class TestFieldsets(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        owner = self.user1Owner.user
+        self.images = [ModelImage.objects.create(title='image {}'.format(i), file='image{}.png'.format(i),
+                                                 user=owner, public=True) for i in range(3)]
+        Vote.objects.create(image=self.images[0], user=self.user2Observer.user, upvote=True)
+        Comment.objects.create(image=self.images[0], user=owner, comment_text='nice')
+
+    def get(self, client, path, expected_status=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        self.assertEqual(response.status_code, expected_status)
+        return response.data, [query['sql'] for query in queries]
+
+    def test_image_list_reads_selected_fields(self):
+        client = self.user1Owner.client
+        data, queries = self.get(client, '/images/?ordering=created_at&fields=id,file,upvote_count')
+        self.assertEqual([list(image) for image in data['results']], [['id', 'file', 'upvote_count']] * 3)
+        self.assertEqual(data['results'][0]['upvote_count'], 1)
+        self.assertTrue(data['results'][0]['file'].endswith('image0.png'))
+        self.assertFalse([sql for sql in queries if 'restapi_imagetag' in sql or 'restapi_comment' in sql])
+        page = next(sql for sql in queries if sql.startswith('SELECT "restapi_image"."id"') and 'LIMIT' in sql)
+        self.assertNotIn('"restapi_image"."title"', page)
+
+        data, _ = self.get(client, '/images/trending?exclude=tags,description,file')
+        self.assertNotIn('tags', data['results'][0])
+        self.assertIn('comment_count', data['results'][0])
+
+    def test_unknown_fields(self):
+        data, _ = self.get(self.user1Owner.client, '/images/?fields=id,secret&exclude=nothing',
+                           status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(data), {'fields', 'exclude'})
+
+    def test_detail_skips_relations(self):
+        image = self.images[0]
+        data, queries = self.get(self.user2Observer.client, '/images/{}?fields=id,title'.format(image.pk))
+        self.assertEqual(data, {'id': image.pk, 'title': image.title})
+        self.assertFalse([sql for sql in queries if 'restapi_vote' in sql or 'restapi_comment' in sql])
+
+        data, _ = self.get(self.user2Observer.client, '/images/{}?exclude=file,votes'.format(image.pk))
+        self.assertEqual(len(data['comments']), 1)
+        self.assertEqual(set(data['comments'][0]), {'id', 'image', 'user', 'created_at', 'comment_text'})
+
+    def test_comments_and_writes(self):
+        client = self.user1Owner.client
+        path = '/images/{}/comment?fields=comment_text'.format(self.images[0].pk)
+        data, _ = self.get(client, path)
+        self.assertEqual(data['results'], [{'comment_text': 'nice'}])
+
+        # writes answer with all fields
+        response = client.post(path, {'comment_text': 'again'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('id', response.data)
+
+    def test_users(self):
+        client = self.superuserInfo.client
+        data, queries = self.get(client, '/users/?fields=id,image_count,images&expand=images,comments')
+        owner = next(user for user in data['results'] if user['id'] == self.user1Owner.user.pk)
+        self.assertEqual(list(owner), ['id', 'image_count', 'images'])
+        self.assertEqual(owner['image_count'], 3)
+        self.assertFalse([sql for sql in queries if 'restapi_comment' in sql or 'restapi_vote' in sql])
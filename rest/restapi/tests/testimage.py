@@ -1,7 +1,10 @@
+import os
+import tempfile
 from typing import Dict
 
+from cacheops.redis import redis_client
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -25,6 +28,17 @@ class ImageTestBase(TestCase):
         return ImageClientData(user, client)
 
     def setUp(self):
+        # users of earlier tests had the same ids
+        keys = list(redis_client.scan_iter(match='me:*'))
+        if keys:
+            redis_client.delete(*keys)
+        # features of processed uploads are appended to the similarity index file
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        index_settings = override_settings(SIMILARITY_INDEX_PATH=os.path.join(index_dir.name, 'similarity.index'))
+        index_settings.enable()
+        self.addCleanup(index_settings.disable)
+
         self.superuserInfo = self.create_user(UserTestData('admin', '1234pass', 'admin@gmail.com'), True, True)
         self.user1Owner = self.create_user(UserTestData('owner', 'easypass', 'user1@gmail.com'), False, True)
         self.user2Observer = self.create_user(UserTestData('observer', 'easypass', 'user2@gmail.com'), False, True)
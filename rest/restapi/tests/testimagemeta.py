@@ -0,0 +1,89 @@
+import io
+from unittest import mock
+
+from PIL import Image as PilImage
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from ..imagemeta import blurhash, dominant_color, extract, pending_images, sample
+from ..management.commands import backfill_image_metadata
+from ..models import Image as ModelImage
+
+
+def gradient() -> PilImage.Image:
+    image = PilImage.new('RGB', (40, 30))
+    for x in range(40):
+        for y in range(30):
+            image.putpixel((x, y), (x * 255 // 40, y * 255 // 30, (x * y) % 256))
+    return image
+
+
+def image_bytes(image: PilImage.Image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class TestImageMetadata(SimpleTestCase):
+
+    def test_blurhash(self):
+        # same as the reference implementation (pip install blurhash-python)
+        self.assertEqual(blurhash(gradient(), 4, 3), 'LyH2ZU2mwtX3l[WUjuf9gFfkfTfl')
+        self.assertEqual(blurhash(PilImage.new('RGB', (8, 8), (255, 0, 0)), 1, 1), '00TI:j')
+
+    def test_dominant_color(self):
+        image = PilImage.new('RGB', (10, 10), (0, 0, 255))
+        image.paste((255, 255, 0), (0, 0, 3, 10))
+        self.assertEqual(dominant_color(image), '#0000ff')
+
+    def test_sample_is_small_rgb(self):
+        small, width, height, image_format = sample(io.BytesIO(image_bytes(gradient().resize((400, 300)), 'JPEG')))
+        self.assertEqual((width, height, image_format), (400, 300, 'JPEG'))
+        self.assertEqual(small.mode, 'RGB')
+        self.assertLessEqual(max(small.size), 32)
+
+    def test_transparency_on_white(self):
+        metadata = extract(io.BytesIO(image_bytes(PilImage.new('RGBA', (20, 20), (0, 0, 0, 0)), 'PNG')))
+        self.assertEqual(metadata['dominant_color'], '#ffffff')
+        self.assertEqual(metadata['mime_type'], 'image/png')
+
+
+class TestImageMetadataOfUploads(ImageTestBase):
+
+    def test_upload_stores_header_metadata(self):
+        file = io.BytesIO(image_bytes(gradient(), 'PNG'))
+        file.name = 'image.png'
+        response = self.user1Owner.client.post('/images/', data={'title': 'meta', 'public': True, 'file': file},
+                                               format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['width'], response.data['height']), (40, 30))
+        self.assertEqual(response.data['mime_type'], 'image/png')
+        self.assertEqual(response.data['byte_size'], len(file.getvalue()))
+
+    def test_backfill(self):
+        file = io.BytesIO(image_bytes(gradient(), 'JPEG'))
+        file.name = 'image.jpg'
+        response = self.user1Owner.client.post('/images/', data={'title': 'meta', 'public': True, 'file': file},
+                                               format='multipart')
+        image_id = response.data['id']
+        # extraction after commit does not run inside the test transaction
+        self.assertEqual(list(pending_images().values_list('pk', flat=True)), [image_id])
+
+        call_command('backfill_image_metadata', workers=1, stdout=io.StringIO(), stderr=io.StringIO())
+        image = ModelImage.objects.nocache().get(pk=image_id)
+        self.assertEqual(len(image.placeholder), 28)
+        self.assertRegex(image.dominant_color, '^#[0-9a-f]{6}$')
+        self.assertEqual(image.byte_size, len(file.getvalue()))
+        self.assertFalse(pending_images().exists())
+
+        response = self.user1Owner.client.get('/images/{}'.format(image_id))
+        self.assertEqual(response.data['placeholder'], image.placeholder)
+
+        # features of an image picked for its placeholder only are in the similarity index already
+        ModelImage.objects.filter(pk=image_id).update(placeholder='')
+        with mock.patch.object(backfill_image_metadata.matrix, 'append') as append:
+            call_command('backfill_image_metadata', workers=1, stdout=io.StringIO(), stderr=io.StringIO())
+        append.assert_called_once_with([])
+        self.assertFalse(pending_images().exists())
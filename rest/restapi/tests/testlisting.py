@@ -0,0 +1,98 @@
+import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .testimage import ImageTestBase
+from .. import listing
+from ..models import Comment, Favourite, Image as ModelImage, ReportImage, Vote
+from ..serializers import CommentListSerializer, ImageListSerializer
+from ..tags import set_image_tags
+
+
+class TestFastJSONRenderer(ImageTestBase):
+
+    def assertSameRendering(self, data, **context):
+        self.assertEqual(listing.FastJSONRenderer().render(data, renderer_context=context),
+                         JSONRenderer().render(data, renderer_context=context))
+
+    def test_same_bytes_as_json_renderer(self):
+        self.assertSameRendering({
+            'text': 'quote " backslash \\ tab \t newline \n nul \x00 del \x7f ünïcödé 🙂    ',
+            'numbers': [0, -1, 2 ** 63 - 1, True, False, None],
+            'decimal': Decimal('1.50'),
+            'datetime': datetime.datetime(2020, 1, 2, 3, 4, 5, 6000, tzinfo=datetime.timezone.utc),
+            'lazy': gettext_lazy('lazy'),
+            1: 'integer key',
+        })
+        self.assertSameRendering([2 ** 70, 'bigger than orjson integers'])
+        self.assertSameRendering({'indented': ['ü', 1]}, indent=4)
+        self.assertEqual(listing.FastJSONRenderer().render(None), b'')
+
+
+class TestListing(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        owner, observer = self.user1Owner.user, self.user2Observer.user
+        titles = ['plain', 'ünïcödé 🙂', 'line separator', 'quote " and \\', 'control \x01 char']
+        self.images = [ModelImage.objects.create(title=title, description='description {}'.format(i),
+                                                 file='image{}.png'.format(i) if i else '',
+                                                 user=owner if i % 2 else None, public=True)
+                       for i, title in enumerate(titles)]
+        first, second = self.images[:2]
+        set_image_tags(first, ['zebra', 'apple'])
+        Vote.objects.create(image=first, user=owner, upvote=True)
+        Vote.objects.create(image=first, user=observer, upvote=False)
+        Vote.objects.create(image=second, user=observer, upvote=True)
+        Favourite.objects.create(image=first, user=observer)
+        ReportImage.objects.create(image=second, user=observer, comment='spam')
+        for text in ('first', 'sëcond  '):
+            Comment.objects.create(image=first, user=observer, comment_text=text)
+
+    def results(self, response) -> bytes:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.content[response.content.index(b'"results":') + len(b'"results":'):-1]
+        self.assertEqual(response.content[-1:], b'}')
+        return results
+
+    def test_images_like_serializer(self):
+        response = self.user1Owner.client.get('/images/?ordering=created_at')
+        queryset = ModelImage.objects.order_by('created_at')
+        expected = ImageListSerializer(queryset, many=True, context={'request': response.wsgi_request}).data
+        self.assertEqual(self.results(response), JSONRenderer().render(expected))
+
+        rows = listing.image_rows(listing.image_values(queryset), response.wsgi_request)
+        self.assertEqual(rows, expected)
+        self.assertEqual(rows[0]['tags'], ['apple', 'plain', 'zebra'])  # with the tag of the title
+        self.assertEqual([rows[0][name] for name in ('comment_count', 'upvote_count', 'downvote_count',
+                                                     'favourite_count')], [2, 1, 1, 1])
+        self.assertIsNone(rows[0]['file'])
+
+    def test_user_lists_like_serializer(self):
+        client = self.user2Observer.client
+        for path, images in (('/me/images/voted', self.images[:2]), ('/me/images/favourites', self.images[:1])):
+            response = client.get(path)
+            expected = ImageListSerializer(images, many=True, context={'request': response.wsgi_request}).data
+            self.assertEqual(self.results(response), JSONRenderer().render(expected))
+
+    def test_comments_like_serializer(self):
+        first = self.images[0]
+        response = self.user1Owner.client.get('/images/{}/comment?ordering=created_at'.format(first.pk))
+        expected = CommentListSerializer(Comment.objects.filter(image=first).order_by('created_at'), many=True).data
+        self.assertEqual(self.results(response), JSONRenderer().render(expected))
+
+    def test_page_queries_do_not_grow_with_rows(self):
+        for i in range(20):
+            ModelImage.objects.create(title='more {}'.format(i), file='more{}.png'.format(i))
+        client = self.user1Owner.client
+        client.get('/images/?page_size=5')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/images/?page_size=25')
+        self.assertEqual(len(response.data['results']), 25)
+        # the page, tags, four counts and the count of the list unless cached
+        self.assertLessEqual(len(queries), 7)
@@ -0,0 +1,95 @@
+import logging
+import sys
+import time
+
+from django.test import SimpleTestCase
+
+from ..log import RateLimitFilter, AsyncGELFHandler
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_record(name='restapi.views', level=logging.INFO, msg='image %s not found', args=(1,)):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+class TestRateLimitFilter(SimpleTestCase):
+
+    def test_limits_per_logger(self):
+        rate_filter = RateLimitFilter(rate=0.0001, burst=5)
+        passed = [rate_filter.filter(make_record()) for _ in range(20)]
+        self.assertEqual(passed.count(True), 5)
+        # other loggers have their own bucket
+        self.assertTrue(rate_filter.filter(make_record(name='django.request')))
+
+    def test_exempt_level_always_passes(self):
+        rate_filter = RateLimitFilter(rate=0.0001, burst=1)
+        passed = [rate_filter.filter(make_record(level=logging.CRITICAL)) for _ in range(10)]
+        self.assertTrue(all(passed))
+
+    def test_suppressed_count_attached_to_next_record(self):
+        rate_filter = RateLimitFilter(rate=0.0001, burst=1)
+        self.assertTrue(rate_filter.filter(make_record()))
+        self.assertFalse(rate_filter.filter(make_record()))
+        self.assertFalse(rate_filter.filter(make_record()))
+        # refill the bucket
+        rate_filter._buckets['restapi.views'] = (1, time.monotonic())
+        record = make_record()
+        self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.suppressed, 2)
+
+    def test_decision_is_shared_between_handlers(self):
+        rate_filter = RateLimitFilter(rate=0.0001, burst=1)
+        record = make_record()
+        self.assertTrue(rate_filter.filter(record))
+        self.assertTrue(rate_filter.filter(record))  # second handler sees the same decision
+
+
+class SyncAsyncGELFHandler(AsyncGELFHandler):
+
+    def _ensure_started(self):
+        pass  # records are drained manually in tests
+
+
+class TestAsyncGELFHandler(SimpleTestCase):
+
+    def setUp(self):
+        self.handler = SyncAsyncGELFHandler('localhost', 12201, queue_size=3, batch_size=2)
+        self.handler.target = RecordingHandler()
+
+    def tearDown(self):
+        self.handler.target = RecordingHandler()
+        self.handler.close()
+
+    def test_full_queue_drops_and_reports(self):
+        for i in range(5):
+            self.handler.emit(make_record(args=(i,)))
+        self.assertEqual(self.handler.dropped, 2)
+
+        self.handler._send_batch(self.handler._next_batch())
+        self.handler._send_batch(self.handler._next_batch())
+        messages = [record.getMessage() for record in self.handler.target.records]
+        self.assertEqual(messages[:2], ['image 0 not found', 'image 1 not found'])
+        self.assertIn('2 records dropped', messages[2])
+        self.assertEqual(messages[3], 'image 2 not found')
+
+    def test_prepare_renders_mutable_state(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('restapi', logging.ERROR, __file__, 1, 'failed %s', ({'a': 1},), sys.exc_info())
+        record.request = object()
+        prepared = self.handler.prepare(record)
+        self.assertEqual(prepared.msg, "failed {'a': 1}")
+        self.assertIsNone(prepared.args)
+        self.assertIsNone(prepared.exc_info)
+        self.assertIn('ValueError: boom', prepared.exc_text)
+        self.assertIsInstance(prepared.request, str)
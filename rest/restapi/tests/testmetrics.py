@@ -0,0 +1,81 @@
+from django.test import SimpleTestCase
+
+from ..metrics import MetricsRegistry, Histogram, format_line, MAX_PACKET_SIZE
+
+
+class RecordingRegistry(MetricsRegistry):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.packets = []
+
+    def _ensure_started(self):
+        pass  # no flusher thread in tests
+
+    def _send(self, lines):
+        self.packets.append(lines)
+
+
+class TestLineProtocol(SimpleTestCase):
+
+    def test_format_line_escapes_tags(self):
+        line = format_line('http_requests', (('route', 'images/<int:pk>/vote'), ('method', 'PUT'), ('x', 'a b,c=d')),
+                           {'count': 3, 'sum_ms': 1.5}, 10)
+        self.assertEqual(line,
+                         r'http_requests,route=images/<int:pk>/vote,method=PUT,x=a\ b\,c\=d count=3i,sum_ms=1.5 10')
+
+    def test_histogram_is_cumulative(self):
+        histogram = Histogram()
+        for value in (1, 7, 7, 300, 10000):
+            histogram.observe(value)
+        fields = histogram.fields()
+        self.assertEqual(fields['count'], 5)
+        self.assertEqual(fields['le_5'], 1)
+        self.assertEqual(fields['le_10'], 3)
+        self.assertEqual(fields['le_250'], 3)
+        self.assertEqual(fields['le_500'], 4)
+        self.assertEqual(fields['le_5000'], 4)
+        self.assertEqual(fields['le_inf'], 5)
+        self.assertEqual(fields['max_ms'], 10000)
+
+
+class TestMetricsRegistry(SimpleTestCase):
+
+    def test_aggregates_until_flush(self):
+        registry = RecordingRegistry('localhost', 8094, prefix='restapi_')
+        for _ in range(100):
+            registry.incr('http_requests', route='images/', status=200)
+            registry.observe('http_request_duration', 12, route='images/')
+        registry.incr('image_uploads')
+
+        registry.flush()
+        lines = [line for packet in registry.packets for line in packet]
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(any(line.startswith('restapi_http_requests,route=images/,status=200 count=100i')
+                            for line in lines))
+        self.assertTrue(any(line.startswith('restapi_image_uploads count=1i') for line in lines))
+
+        # counters are reset after flush
+        registry.packets = []
+        registry.flush()
+        self.assertEqual(registry.packets, [])
+
+    def test_gauges_survive_flush(self):
+        registry = RecordingRegistry('localhost', 8094)
+        registry.gauge_add('in_flight', 1, route='images/')
+        registry.gauge_add('in_flight', 1, route='images/')
+        registry.gauge_add('in_flight', -1, route='images/')
+        registry.flush()
+        registry.flush()
+        self.assertEqual(len(registry.packets), 2)
+        self.assertIn('value=1i', registry.packets[1][0])
+
+    def test_packets_respect_size_limit(self):
+        registry = RecordingRegistry('localhost', 8094)
+        for i in range(200):
+            registry.incr('http_requests', route='route/{}'.format(i))
+        registry.flush()
+        self.assertGreater(len(registry.packets), 1)
+        for packet in registry.packets:
+            self.assertLessEqual(len('\n'.join(packet).encode()) + 1, MAX_PACKET_SIZE)
+        self.assertEqual(sum(len(packet) for packet in registry.packets), 200)
@@ -0,0 +1,73 @@
+from unittest import mock
+
+from cacheops.redis import redis_client
+from django.test import override_settings
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import counting
+from ..models import Image as ModelImage
+
+
+class TestCountModes(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        keys = list(redis_client.scan_iter(match='pagination:count:*'))
+        if keys:
+            redis_client.delete(*keys)
+        for i in range(5):
+            ModelImage.objects.create(title='image {}'.format(i), file='image{}.png'.format(i),
+                                      user=self.user1Owner.user if i == 0 else None)
+
+    def get(self, client, path):
+        response = client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @override_settings(PAGINATION_COUNT_CAP=3)
+    def test_capped_count(self):
+        client = self.user1Owner.client
+        page = self.get(client, '/images/?page_size=2')
+        self.assertEqual((page['count'], page['count_exact']), (3, False))
+        self.assertIn('page=2', page['next'])
+
+        # pages after the cap are served, the last has no next page
+        page = self.get(client, '/images/?page_size=2&page=3')
+        self.assertEqual(len(page['results']), 1)
+        self.assertIsNone(page['next'])
+        self.assertIn('page=2', page['previous'])
+        self.assertEqual(client.get('/images/?page_size=2&page=4').status_code, status.HTTP_404_NOT_FOUND)
+
+        page = self.get(client, '/images/?page_size=2&anonymous=false')
+        self.assertEqual((page['count'], page['count_exact']), (1, True))
+
+    @override_settings(PAGINATION_COUNT_CAP=3)
+    def test_counts_which_are_not_exact_are_cached(self):
+        client = self.user1Owner.client
+        with mock.patch.object(counting, 'capped_count', wraps=counting.capped_count) as capped_count:
+            self.assertEqual(self.get(client, '/images/')['count'], 3)
+            self.assertEqual(self.get(client, '/images/')['count'], 3)
+        self.assertEqual(capped_count.call_count, 1)
+
+        # exact counts are never served stale
+        page = self.get(client, '/images/?anonymous=false')
+        self.assertEqual((page['count'], page['count_exact']), (1, True))
+        ModelImage.objects.create(title='new', file='new.png', user=self.user2Observer.user)
+        page = self.get(client, '/images/?anonymous=false')
+        self.assertEqual((page['count'], page['count_exact']), (2, True))
+
+    def test_estimated_count(self):
+        client = self.superuserInfo.client
+        page = self.get(client, '/users/')
+        self.assertEqual((page['count'], page['count_exact']), (3, True))
+
+        with mock.patch.object(counting, 'estimated_count', return_value=250000):
+            page = self.get(client, '/users/?page_size=2')
+        self.assertEqual((page['count'], page['count_exact']), (250000, False))
+        self.assertEqual(len(page['results']), 2)
+        self.assertIn('page=2', page['next'])
+
+    def test_exact_lists_are_unchanged(self):
+        page = self.get(self.user1Owner.client, '/me/images')
+        self.assertEqual(list(page), ['count', 'next', 'previous', 'results'])
@@ -0,0 +1,95 @@
+import datetime
+import unittest
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import partitions, votebuffer
+from ..models import Comment, Image as ModelImage, Vote
+
+
+class TestPartitionStatements(unittest.TestCase):
+
+    def test_months(self):
+        self.assertEqual(partitions.month_start(datetime.date(2020, 2, 29)), datetime.date(2020, 2, 1))
+        self.assertEqual(partitions.add_months(datetime.date(2020, 11, 1), 3), datetime.date(2021, 2, 1))
+        self.assertEqual(partitions.add_months(datetime.date(2020, 1, 1), -1), datetime.date(2019, 12, 1))
+        self.assertEqual(partitions.months_between(datetime.date(2019, 11, 15), datetime.date(2020, 1, 1)),
+                         [datetime.date(2019, 11, 1), datetime.date(2019, 12, 1), datetime.date(2020, 1, 1)])
+        self.assertEqual(partitions.partition_name('restapi_vote', datetime.date(2020, 3, 1)), 'restapi_vote_p202003')
+        self.assertEqual(partitions.archive_name('restapi_vote', datetime.date(2020, 3, 1)),
+                         'restapi_vote_archive_202003')
+
+    def test_vote_keeps_unique_image_and_user(self):
+        statements = partitions.convert_statements(Vote, [datetime.date(2020, 12, 1)])
+        sql = '\n'.join(statements)
+        self.assertIn('PARTITION BY RANGE ("created_at")', sql)
+        self.assertIn('PRIMARY KEY ("id", "created_at")', sql)
+        self.assertIn('"restapi_vote_p202012" PARTITION OF "restapi_vote_partitioned" FOR VALUES '
+                      'FROM (\'2020-12-01 00:00:00+00\') TO (\'2021-01-01 00:00:00+00\')', sql)
+        self.assertIn('CREATE TABLE "restapi_vote_key" ("image" integer NOT NULL, "user" integer NOT NULL, '
+                      'PRIMARY KEY ("image", "user"))', sql)
+        self.assertIn('REFERENCES "restapi_image" ("id") DEFERRABLE INITIALLY DEFERRED', sql)
+        # rows are copied before the tables are swapped, the key table is filled from the partitioned table
+        self.assertLess(sql.index('INSERT INTO "restapi_vote_partitioned"'), sql.index('DROP TABLE'))
+        self.assertLess(sql.index('DROP TABLE'), sql.index('INSERT INTO "restapi_vote_key"'))
+
+    def test_comment_has_no_key_table(self):
+        sql = '\n'.join(partitions.convert_statements(Comment, [datetime.date(2020, 12, 1)]))
+        self.assertIn('PRIMARY KEY ("id", "created_at")', sql)
+        self.assertNotIn('_key', sql)
+
+
+class TestPartitionedQueries(ImageTestBase):
+
+    def test_command_needs_postgresql(self):
+        if partitions.is_supported():
+            self.skipTest('runs against PostgreSQL')
+        out = StringIO()
+        call_command('manage_partitions', '--convert', stdout=out)
+        self.assertIn('PostgreSQL', out.getvalue())
+
+    def test_trending_counts_votes_of_the_last_day(self):
+        owner, observer = self.user1Owner.user, self.user2Observer.user
+        old, recent = [ModelImage.objects.create(title=title, file='{}.png'.format(title), public=True)
+                       for title in ('old', 'recent')]
+        Vote.objects.create(image=recent, user=owner, upvote=True)
+        for user in (owner, observer):
+            vote = Vote.objects.create(image=old, user=user, upvote=True)
+            Vote.objects.filter(pk=vote.pk).update(created_at=vote.created_at - datetime.timedelta(days=2))
+
+        response = self.anonymousUser.client.get('/images/trending')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([image['id'] for image in response.json()['results']], [recent.pk, old.pk])
+
+
+class TestPartitionedVotes(ImageTestBase):
+    """
+    Runs the generated statements and triggers, skipped unless the tests run against PostgreSQL 11 or later.
+    """
+
+    def setUp(self):
+        super().setUp()
+        if not partitions.is_supported():
+            self.skipTest('needs PostgreSQL 11 or later')
+        self.image = ModelImage.objects.create(title='voted', file='voted.png', public=True)
+        Vote.objects.create(image=self.image, user=self.user1Owner.user, upvote=True)
+        partitions.convert(Vote, 1)
+
+    def test_key_table_keeps_unique_image_and_user(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(image=self.image, user=self.user1Owner.user, upvote=False)
+        vote = Vote.objects.create(image=self.image, user=self.user2Observer.user, upvote=False)
+        vote.delete()
+        Vote.objects.create(image=self.image, user=self.user2Observer.user, upvote=True)
+        self.assertEqual(Vote.objects.count(), 2)
+
+    def test_buffered_votes_skip_existing_ones(self):
+        owner, observer = self.user1Owner.user, self.user2Observer.user
+        votebuffer.insert_missing([Vote(image=self.image, user=owner, upvote=False),
+                                   Vote(image=self.image, user=observer, upvote=False)])
+        self.assertEqual(sorted(Vote.objects.values_list('user_id', 'upvote')),
+                         [(owner.pk, True), (observer.pk, False)])
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from cacheops.redis import redis_client
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import profiling
+from ..models import Image as ModelImage
+
+
+class TestProfiling(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        keys = list(redis_client.scan_iter(match=profiling.PROFILE_KEY.format('*')))
+        if keys:
+            redis_client.delete(*keys)
+        ModelImage.objects.create(title='profiled', file='profiled.png', public=True)
+
+    def test_superuser_request_is_profiled(self):
+        client = self.superuserInfo.client
+        response = client.get('/images/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+
+        response = client.get('/profiles/{}'.format(profile_id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = response.json()
+        self.assertEqual(profile['id'], profile_id)
+        self.assertEqual((profile['method'], profile['path'], profile['user']), ('GET', '/images/', 'admin'))
+        self.assertGreater(profile['sql_count'], 0)
+        self.assertEqual(len(profile['sql']), profile['sql_count'])
+        self.assertTrue(all(query['sql'] for query in profile['sql']))
+        self.assertIn('function', profile['call_tree'])
+        self.assertTrue(profile['call_tree']['children'])
+
+    def test_other_users_are_not_profiled(self):
+        response = self.user1Owner.client.get('/images/?_profile=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertFalse(self.anonymousUser.client.get('/images/', HTTP_X_PROFILE='1').has_header('X-Profile-Id'))
+        self.assertEqual(list(redis_client.scan_iter(match=profiling.PROFILE_KEY.format('*'))), [])
+
+    def test_profiles_are_for_admins(self):
+        profile_id = self.superuserInfo.client.get('/images/?_profile=1')['X-Profile-Id']
+        response = self.user1Owner.client.get('/profiles/{}'.format(profile_id))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_unknown_or_expired_profile(self):
+        client = self.superuserInfo.client
+        self.assertEqual(client.get('/profiles/unknown').status_code, status.HTTP_404_NOT_FOUND)
+        profile_id = client.get('/images/', HTTP_X_PROFILE='1')['X-Profile-Id']
+        redis_client.delete(profiling.PROFILE_KEY.format(profile_id))
+        self.assertEqual(client.get('/profiles/{}'.format(profile_id)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_profile_without_frames(self):
+        request = mock.Mock(method='GET', **{'get_full_path.return_value': '/images/'})
+        with mock.patch.object(profiling.pstats, 'Stats', return_value=mock.Mock(stats={})):
+            profile = profiling.build_profile(mock.Mock(), profiling.SQLRecorder(), request,
+                                              self.superuserInfo.user, mock.Mock(status_code=200), 0.2)
+        self.assertEqual(profile['call_tree'], {})
+        self.assertEqual(profile['functions'], [])
@@ -0,0 +1,108 @@
+import io
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+from PIL import Image as PilImage
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .testimagemeta import gradient, image_bytes
+from .. import duplicates
+from ..duplicates import HashIndex
+from ..imagemeta import extract_object, save_metadata
+from ..models import Image as ModelImage
+from ..similarity import FEATURE_SIZE, FeatureMatrix, features
+
+
+def unit_vector(*values) -> np.ndarray:
+    vector = np.zeros(FEATURE_SIZE, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+class TestFeatures(SimpleTestCase):
+
+    def test_cosine_similarity(self):
+        image = gradient().resize((400, 300))
+        vector = features(image)
+        self.assertEqual(vector.shape, (FEATURE_SIZE,))
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1, places=5)
+        self.assertGreater(float(vector @ features(image.resize((100, 75)))), 0.95)
+        self.assertLess(float(vector @ features(PilImage.new('RGB', (400, 300), (0, 200, 0)))), 0.5)
+
+
+class TestFeatureMatrix(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.matrix = FeatureMatrix(os.path.join(directory.name, 'index'))
+
+    def test_search(self):
+        self.assertEqual(self.matrix.search(unit_vector(1), 2), [[]])
+        self.matrix.append([(1, unit_vector(1)), (2, unit_vector(1, 1)), (3, unit_vector(0, 1))])
+        self.matrix.append([(2, unit_vector(1, 1))])  # appended again, e.g. by backfill
+        first, second = self.matrix.search(np.stack([unit_vector(1), unit_vector(0, 1)]), 2, exclude=[1, 3])
+        self.assertEqual([image_id for image_id, score in first], [2, 3])
+        self.assertAlmostEqual(first[0][1], 0.7071, places=4)
+        self.assertEqual([image_id for image_id, score in second], [2, 1])
+
+    @mock.patch('restapi.similarity.SEARCH_CHUNK_ROWS', 3)
+    def test_search_in_chunks(self):
+        self.matrix.append([(i, unit_vector(1, i)) for i in range(10)])
+        found = self.matrix.search(unit_vector(1), 3)[0]
+        self.assertEqual([image_id for image_id, score in found], [0, 1, 2])
+
+    def test_rebuild(self):
+        self.matrix.append([(1, unit_vector(1)), (2, unit_vector(1, 1))])
+        self.assertEqual(self.matrix.rebuild([(2, unit_vector(1, 1))]), 1)
+        self.assertEqual([image_id for image_id, score in self.matrix.search(unit_vector(1), 5)[0]], [2])
+
+
+@mock.patch.object(duplicates, 'index', new_callable=HashIndex)
+class TestSimilarImages(ImageTestBase):
+
+    def upload(self, client, image: PilImage.Image, public=True) -> ModelImage:
+        file = io.BytesIO(image_bytes(image, 'PNG'))
+        file.name = 'image.png'
+        response = client.post('/images/', data={'title': 'similar', 'public': public, 'file': file},
+                               format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = ModelImage.objects.get(pk=response.data['id'])
+        save_metadata(image.pk, extract_object(image.file.name))
+        return image
+
+    def similar(self, client, image: ModelImage):
+        return client.get('/images/{}/similar'.format(image.pk))
+
+    def test_similar_public_images(self, index):
+        client = self.user1Owner.client
+        image = self.upload(client, gradient())
+        brighter = self.upload(client, gradient().point(lambda value: min(255, value + 20)))
+        green = self.upload(client, PilImage.new('RGB', (40, 30), (0, 200, 0)))
+        private = self.upload(client, gradient().resize((20, 15)), public=False)
+
+        response = self.similar(self.anonymousUser.client, image)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data], [brighter.pk, green.pk])
+        self.assertGreater(response.data[0]['similarity'], response.data[1]['similarity'])
+
+        # cached candidates are filtered again
+        ModelImage.objects.filter(pk=brighter.pk).update(public=False)
+        response = self.similar(self.anonymousUser.client, image)
+        self.assertEqual([item['id'] for item in response.data], [green.pk])
+
+        self.assertEqual(self.similar(self.user2Observer.client, private).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.similar(client, private).status_code, status.HTTP_200_OK)
+
+    def test_compaction_drops_deleted_images(self, index):
+        image = self.upload(self.user1Owner.client, gradient())
+        other = self.upload(self.user1Owner.client, gradient().resize((20, 15)))
+        other.delete()
+        call_command('compact_similarity_index', warm=10, stdout=io.StringIO())
+        response = self.similar(self.user1Owner.client, image)
+        self.assertEqual(response.data, [])
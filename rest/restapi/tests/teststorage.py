@@ -0,0 +1,37 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from minio_storage.storage import MinioStorage
+
+from ..storage import MediaStorage
+
+
+@override_settings(MINIO_STORAGE_ASSUME_MEDIA_BUCKET_EXISTS=True, MINIO_STORAGE_MEDIA_URL='http://localhost:9001/media',
+                   MINIO_STORAGE_URL_CACHE_SIZE=2)
+class TestMediaStorage(SimpleTestCase):
+
+    def test_public_url_built_from_base(self):
+        storage = MediaStorage()
+        with mock.patch.object(MinioStorage, 'url') as url:
+            self.assertEqual(storage.url('a b.jpg'), 'http://localhost:9001/media/a%20b.jpg')
+            url.assert_not_called()
+
+    def test_bulk_urls_and_eviction(self):
+        storage = MediaStorage()
+        urls = storage.urls(['1.jpg', '2.jpg', '1.jpg', ''])
+        self.assertEqual(set(urls), {'1.jpg', '2.jpg'})
+        storage.url('3.jpg')
+        self.assertEqual(list(storage._urls), ['2.jpg', '3.jpg'])
+
+    @override_settings(MINIO_STORAGE_MEDIA_USE_PRESIGNED=True, MINIO_STORAGE_PRESIGNED_URL_MAX_AGE=100)
+    def test_presigned_url_cached_for_half_validity(self):
+        storage = MediaStorage()
+        with mock.patch.object(MinioStorage, 'url', return_value='signed') as url, \
+                mock.patch('restapi.storage.time.monotonic', return_value=1000):
+            self.assertEqual(storage.url('1.jpg'), 'signed')
+            storage.url('1.jpg')
+            url.assert_called_once_with('1.jpg', max_age=timedelta(seconds=100))
+        with mock.patch.object(MinioStorage, 'url', return_value='signed again') as url, \
+                mock.patch('restapi.storage.time.monotonic', return_value=1051):
+            self.assertEqual(storage.url('1.jpg'), 'signed again')
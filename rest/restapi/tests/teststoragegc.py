@@ -0,0 +1,73 @@
+import io
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.utils import timezone
+
+from .dataclasses import ImageTestData
+from .testimage import ImageTestBase
+from ..models import StorageTombstone
+from ..tombstones import collect, enqueue_deletion, sweep
+
+
+def put_object(key: str, data: bytes = b'data'):
+    default_storage.client.put_object(default_storage.bucket_name, key, io.BytesIO(data), len(data))
+
+
+class TestStorageGarbageCollection(ImageTestBase):
+
+    def test_cascade_delete_enqueues_files(self):
+        image = ImageTestData.create_image_test("Image 1", "lorem ipsum", True, self.user1Owner.user)
+        image_in_db = image.create_model_image()
+        name = image_in_db.file.name
+
+        self.user1Owner.user.delete()
+        self.assertTrue(StorageTombstone.objects.filter(key=name).exists())
+        self.assertTrue(default_storage.exists(name))
+
+        collect(grace=0)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StorageTombstone.objects.exists())
+
+    def test_grace_period(self):
+        put_object('gc/young')
+        enqueue_deletion(['gc/young'])
+        collect()
+        self.assertTrue(default_storage.exists('gc/young'))
+
+    def test_failed_delete_is_retried_later(self):
+        put_object('gc/failing')
+        enqueue_deletion(['gc/failing'])
+        with mock.patch('restapi.tombstones._remove_objects', return_value={'gc/failing': 'InternalError: boom'}):
+            collect(grace=0)
+        tombstone = StorageTombstone.objects.get(key='gc/failing')
+        self.assertEqual(tombstone.attempts, 1)
+        self.assertEqual(tombstone.last_error, 'InternalError: boom')
+        self.assertGreater(tombstone.next_attempt_at, timezone.now())
+
+        collect(grace=0)  # not due yet
+        self.assertTrue(default_storage.exists('gc/failing'))
+
+        StorageTombstone.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        collect(grace=0)
+        self.assertFalse(default_storage.exists('gc/failing'))
+
+    def test_referenced_object_is_kept(self):
+        image = ImageTestData.create_image_test("Image 1", "lorem ipsum", True, self.user1Owner.user)
+        name = image.create_model_image().file.name
+        enqueue_deletion([name])
+        collect(grace=0)
+        self.assertTrue(default_storage.exists(name))
+        self.assertFalse(StorageTombstone.objects.exists())
+
+    @override_settings(STORAGE_GC_SWEEP_MIN_AGE=0)
+    def test_sweep_enqueues_orphans(self):
+        image = ImageTestData.create_image_test("Image 1", "lorem ipsum", True, self.user1Owner.user)
+        name = image.create_model_image().file.name
+        put_object('gc/orphan')
+
+        sweep()
+        self.assertTrue(StorageTombstone.objects.filter(key='gc/orphan').exists())
+        self.assertFalse(StorageTombstone.objects.filter(key=name).exists())
@@ -0,0 +1,124 @@
+from cacheops.redis import redis_client
+from django.db import connection, transaction
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status
+
+from .dataclasses import ImageTestData
+from .testimage import ImageTestBase
+from .. import tags
+from ..models import Image as ModelImage
+
+
+class TestTagNames(SimpleTestCase):
+
+    def test_normalize(self):
+        self.assertEqual(tags.normalize('  Black & White '), 'black-white')
+        self.assertEqual(tags.normalize_all(['Cat', 'cat', ' ', 'tag:with:colons']), ['cat', 'tag-with-colons'])
+
+    def test_title_tags(self):
+        self.assertEqual(tags.title_tags('Sunset_at-the_beach2 IMG_2041.jpg'), ['sunset', 'beach2'])
+
+
+class TestTags(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        tags.rebuild_index()  # nothing is tagged yet, drops keys of previous tests
+
+    def upload(self, user, title, tag_names, public=True) -> int:
+        image = ImageTestData.create_image_test(title, "lorem ipsum", public, user.user)
+        data = image.to_dict()
+        data['tags'] = tag_names
+        response = user.client.post('/images/', data=data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def sync_committed(self):
+        # test transactions never commit, run the reindexing left for the commit
+        for _, callback in connection.run_on_commit:
+            if getattr(callback, 'func', None) is tags.sync_from_database:
+                callback()
+
+    def tagged(self, client, query):
+        self.sync_committed()
+        response = client.get('/images/?' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(image['id'] for image in response.data['results'])
+
+    def facets(self, client, query=''):
+        self.sync_committed()
+        response = client.get('/images/tags?' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(tag['name'], tag['count']) for tag in response.data]
+
+    def test_upload_and_put(self):
+        image_id = self.upload(self.user1Owner, 'Mountain lake', ['Nature', 'water'])
+        response = self.user1Owner.client.get('/images/{}'.format(image_id))
+        self.assertEqual(response.data['tags'], ['lake', 'mountain', 'nature', 'water'])
+
+        response = self.user1Owner.client.put('/images/{}'.format(image_id), {'title': 'Forest', 'tags': 'trees'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['tags'], ['forest', 'trees'])
+        self.assertEqual(self.facets(self.anonymousUser.client), [('forest', 1), ('trees', 1)])
+
+        # without tags the given tags are kept
+        response = self.user1Owner.client.put('/images/{}'.format(image_id), {'title': 'Dark forest'})
+        self.assertEqual(response.data['tags'], ['dark', 'forest', 'trees'])
+
+        response = self.user1Owner.client.put('/images/{}'.format(image_id),
+                                              {'title': 'Forest', 'tags': ','.join(map(str, range(21)))})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query(self):
+        first = self.upload(self.user1Owner, 'first', ['cat', 'dog'])
+        second = self.upload(self.user1Owner, 'second', ['cat'])
+        self.upload(self.user1Owner, 'third', ['bird'])
+        private = self.upload(self.user1Owner, 'fourth', ['cat', 'dog'], public=False)
+
+        client = self.user2Observer.client
+        self.assertEqual(self.tagged(client, 'tags=cat,dog'), [first])
+        self.assertEqual(self.tagged(client, 'tags=Cat'), [first, second])
+        self.assertEqual(self.tagged(client, 'tags=dog,cat&tags_mode=any'), [first, second])
+        self.assertEqual(self.tagged(client, 'tags=fish'), [])
+        self.assertEqual(self.tagged(self.superuserInfo.client, 'tags=cat,dog'), [first, private])
+
+    def test_query_is_cut_to_the_newest_images(self):
+        first = self.upload(self.user1Owner, 'first', ['cat'])
+        second = self.upload(self.user1Owner, 'second', ['cat', 'dog'])
+        third = self.upload(self.user1Owner, 'third', ['cat'])
+        client = self.anonymousUser.client
+        with override_settings(TAG_QUERY_MAX_CANDIDATES=2):
+            self.assertEqual(self.tagged(client, 'tags=cat'), [second, third])
+            self.assertEqual(self.tagged(client, 'tags=dog,cat&tags_mode=any'), [second, third])
+        self.assertEqual(self.tagged(client, 'tags=cat'), [first, second, third])
+        self.assertEqual(list(redis_client.scan_iter(match=tags.KEY_PREFIX + 'query:*')), [])
+
+    def test_rolled_back_tags_are_not_indexed(self):
+        image_id = self.upload(self.user1Owner, 'first', ['cat'])
+        image = ModelImage.objects.get(pk=image_id)
+        try:
+            with transaction.atomic():
+                tags.set_image_tags(image, ['dog'])
+                raise RuntimeError('rolled back')
+        except RuntimeError:
+            pass
+        self.assertEqual(self.facets(self.anonymousUser.client), [('cat', 1), ('first', 1)])
+        self.assertEqual(self.tagged(self.anonymousUser.client, 'tags=dog'), [])
+
+    def test_facets_follow_visibility(self):
+        first = self.upload(self.user1Owner, 'first', ['cat', 'dog'])
+        second = self.upload(self.user1Owner, 'second', ['cat', 'cow'], public=False)
+        client = self.anonymousUser.client
+        self.assertEqual(self.facets(client), [('cat', 1), ('dog', 1), ('first', 1)])
+        self.assertEqual(self.facets(self.superuserInfo.client, 'prefix=c'), [('cat', 2), ('cow', 1)])
+
+        image = ModelImage.objects.get(pk=second)
+        image.public = True
+        image.save()
+        self.assertEqual(self.facets(client, 'prefix=c&limit=1'), [('cat', 2)])
+        self.assertEqual(self.tagged(client, 'tags=cow'), [second])
+
+        ModelImage.objects.get(pk=first).delete()
+        self.assertEqual(self.facets(client, 'prefix=c'), [('cat', 1), ('cow', 1)])
+        self.assertEqual(self.facets(client, 'prefix=d'), [])
+        self.assertEqual(client.get('/images/tags?limit=0').status_code, status.HTTP_400_BAD_REQUEST)
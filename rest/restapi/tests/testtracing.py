@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import requests
+from cacheops.redis import redis_client
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import tracing
+from ..models import Image as ModelImage
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+def install_tracing(test):
+    if tracing.install():
+        test.addCleanup(tracing.uninstall)
+
+
+class RecordingAdapter(requests.adapters.BaseAdapter):
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        response = requests.Response()
+        response.status_code = 204
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class TestTraceContext(SimpleTestCase):
+
+    def test_parse_traceparent(self):
+        self.assertEqual(tracing.parse_traceparent('00-{}-{}-01'.format(TRACE_ID, PARENT_ID)),
+                         (TRACE_ID, PARENT_ID, True))
+        self.assertEqual(tracing.parse_traceparent(' 00-{}-{}-00 '.format(TRACE_ID.upper(), PARENT_ID)),
+                         (TRACE_ID, PARENT_ID, False))
+        for value in (None, '', 'garbage', '01-{}-{}-01'.format(TRACE_ID, PARENT_ID),
+                      '00-{}-{}-01'.format(TRACE_ID[:-1], PARENT_ID), '00-{}-{}-01'.format('0' * 32, PARENT_ID)):
+            self.assertIsNone(tracing.parse_traceparent(value), value)
+
+    @override_settings(TRACING_ENABLED=True)
+    def test_outbound_requests_carry_traceparent(self):
+        install_tracing(self)
+        adapter = RecordingAdapter()
+        session = requests.Session()
+        session.mount('http://', adapter)
+        with mock.patch.object(tracing, 'get_exporter') as get_exporter:
+            with tracing.start_span('GET /images/', 'server', traceparent='00-{}-{}-01'.format(TRACE_ID, PARENT_ID)):
+                session.get('http://collector/api?secret=1')
+            session.get('http://collector/untraced')
+        spans = get_exporter.return_value.export.call_args[0][0]
+        http = next(span for span in spans if span['name'] == 'http GET')
+        self.assertEqual(adapter.requests[0].headers['traceparent'], '00-{}-{}-01'.format(TRACE_ID, http['id']))
+        self.assertEqual(http['tags']['http.url'], 'http://collector/api')
+        self.assertEqual(http['tags']['http.status_code'], '204')
+        self.assertNotIn('traceparent', adapter.requests[1].headers)
+
+    @override_settings(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=1.0)
+    def test_redis_commands_are_spans(self):
+        install_tracing(self)
+        with mock.patch.object(tracing, 'get_exporter') as get_exporter:
+            with tracing.start_span('GET /images/', 'server'):
+                redis_client.get('tracing:missing')
+        spans = get_exporter.return_value.export.call_args[0][0]
+        root = next(span for span in spans if span['name'] == 'GET /images/')
+        command = next(span for span in spans if span['name'] == 'redis GET')
+        self.assertEqual((command['kind'], command['parentId']), ('CLIENT', root['id']))
+
+    def test_uninstall_restores_the_libraries(self):
+        from rest_framework.views import APIView
+        send, dispatch = requests.Session.send, APIView.dispatch
+        if not tracing.install():
+            self.skipTest('instrumented by TRACING_ENABLED')
+        self.addCleanup(tracing.uninstall)
+        self.assertIsNot(requests.Session.send, send)
+        tracing.uninstall()
+        self.assertIs(requests.Session.send, send)
+        self.assertIs(APIView.dispatch, dispatch)
+        self.assertTrue(tracing.install())
+
+    def test_file_exporter_writes_json_lines(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'traces.jsonl')
+        traces = [[{'traceId': TRACE_ID, 'id': PARENT_ID, 'name': 'GET /images/'}], [{'traceId': 'a' * 32}]]
+        tracing.FileExporter(path).export_batch(traces)
+        with open(path) as f:
+            self.assertEqual([json.loads(line) for line in f], traces)
+
+    def test_zipkin_exporter_posts_spans_untraced(self):
+        traces = [[{'id': '1'}, {'id': '2'}], [{'id': '3'}]]
+        with mock.patch('requests.post') as post:
+            tracing.ZipkinExporter('http://collector:9411/api/v2/spans').export_batch(traces)
+        self.assertEqual(post.call_args[0][0], 'http://collector:9411/api/v2/spans')
+        self.assertEqual(json.loads(post.call_args[1]['data']), [{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+
+@override_settings(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=1.0, TRACING_SLOW_REQUEST_MS=60000,
+                   TRACING_SLOW_SPAN_MS=60000)
+class TestRequestTracing(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        install_tracing(self)
+        ModelImage.objects.create(title='traced', file='traced.png', user=self.user1Owner.user, public=True)
+        patcher = mock.patch.object(tracing, 'get_exporter')
+        self.exporter = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def get(self, path, **headers):
+        response = self.user1Owner.client.get(path, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def exported(self):
+        self.assertEqual(self.exporter.export.call_count, 1)
+        return self.exporter.export.call_args[0][0]
+
+    def test_trace_is_continued(self):
+        response = self.get('/me/images', HTTP_TRACEPARENT='00-{}-{}-01'.format(TRACE_ID, PARENT_ID))
+        self.assertEqual(response['X-Trace-Id'], TRACE_ID)
+
+        spans = self.exported()
+        self.assertTrue(all(span['traceId'] == TRACE_ID for span in spans))
+        by_id = {span['id']: span for span in spans}
+        root = spans[0]
+        self.assertEqual((root['name'], root['kind'], root['parentId']), ('GET me/images', 'SERVER', PARENT_ID))
+        self.assertEqual(root['tags']['http.status_code'], '200')
+        view = next(span for span in spans if span['name'] == 'view ImageUserView')
+        self.assertEqual(view['parentId'], root['id'])
+
+        def ancestors(span):
+            while span.get('parentId') in by_id:
+                span = by_id[span['parentId']]
+                yield span['id']
+
+        sql = [span for span in spans if span['name'] == 'sql']
+        redis = [span for span in spans if span['name'].startswith('redis')]
+        self.assertTrue(sql)
+        for span in sql + redis:
+            self.assertEqual(span['kind'], 'CLIENT')
+            self.assertIn(root['id'], ancestors(span))
+        self.assertTrue(any(view['id'] in ancestors(span) for span in sql))
+        self.assertTrue(all(span['tags']['db.statement'] for span in sql))
+
+    def test_malformed_traceparent_starts_a_new_trace(self):
+        response = self.get('/me/images', HTTP_TRACEPARENT='00-not-a-trace-01')
+        trace_id = response['X-Trace-Id']
+        self.assertRegex(trace_id, '^[0-9a-f]{32}$')
+        root = self.exported()[0]
+        self.assertEqual(root['traceId'], trace_id)
+        self.assertNotIn('parentId', root)
+
+    def test_not_sampled(self):
+        response = self.get('/me/images', HTTP_TRACEPARENT='00-{}-{}-00'.format(TRACE_ID, PARENT_ID))
+        self.assertFalse(response.has_header('X-Trace-Id'))
+        self.exporter.export.assert_not_called()
+        self.assertIsNone(tracing.current_span())
+
+    @override_settings(TRACING_SLOW_REQUEST_MS=0)
+    def test_slow_trace_is_logged(self):
+        with self.assertLogs('restapi.tracing', 'WARNING') as logs:
+            self.get('/me/images', HTTP_TRACEPARENT='00-{}-{}-01'.format(TRACE_ID, PARENT_ID))
+        self.assertEqual(len(logs.records), 1)
+        record = logs.records[0]
+        self.assertEqual(record.trace_id, TRACE_ID)
+        message = record.getMessage()
+        self.assertIn('slow trace {}: GET me/images'.format(TRACE_ID), message)
+        self.assertIn('\n  view ImageUserView', message)
+        self.assertIn('\n    ', message)
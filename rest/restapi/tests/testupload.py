@@ -0,0 +1,240 @@
+import hashlib
+import io
+from unittest import mock
+
+from PIL import Image as PilImage
+from django.core.files.storage import default_storage
+from django.http.multipartparser import MultiPartParser
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import blobs
+from ..models import Blob, Image as ModelImage, UploadTicket
+from ..tombstones import collect
+from ..uploads import ImageHeader, ImageUploadError, StreamingImageUploadHandler, UploadRejected, read_header
+
+
+def image_bytes(image_format='JPEG') -> bytes:
+    buffer = io.BytesIO()
+    PilImage.new('RGB', (100, 100)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class TestReadHeader(SimpleTestCase):
+
+    def test_header_is_enough(self):
+        self.assertEqual(read_header(image_bytes('PNG')[:64], False), ImageHeader('PNG', 100, 100))
+        self.assertEqual(read_header(image_bytes('JPEG')[:1024], False), ImageHeader('JPEG', 100, 100))
+        self.assertEqual(read_header(image_bytes('WEBP')[:64], False), ImageHeader('WEBP', 100, 100))
+
+    def test_needs_more_bytes(self):
+        self.assertIsNone(read_header(image_bytes('PNG')[:8], False))
+        with self.assertRaises(UploadRejected):
+            read_header(image_bytes('PNG')[:8], True)
+
+    def test_not_an_image(self):
+        with self.assertRaises(UploadRejected):
+            read_header(b'<html></html>', True)
+
+    @override_settings(IMAGE_UPLOAD_ALLOWED_FORMATS=('JPEG',))
+    def test_format_not_allowed(self):
+        with self.assertRaises(UploadRejected):
+            read_header(image_bytes('PNG'), True)
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=99 * 100)
+    def test_too_many_pixels(self):
+        with self.assertRaises(UploadRejected):
+            read_header(image_bytes('PNG')[:64], False)
+
+
+class CountingStream(io.BytesIO):
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestStreamingImageUploadHandler(SimpleTestCase):
+
+    def parse(self, data: bytes, content_length: int = None):
+        boundary = 'BoUnDaRy'
+        head = ('--{0}\r\nContent-Disposition: form-data; name="file"; filename="image.png"\r\n'
+                'Content-Type: image/png\r\n\r\n').format(boundary).encode()
+        body = head + data + '\r\n--{0}--\r\n'.format(boundary).encode()
+        stream = CountingStream(body)
+        meta = {
+            'CONTENT_TYPE': 'multipart/form-data; boundary={}'.format(boundary),
+            'CONTENT_LENGTH': str(content_length or len(body)),
+        }
+        parser = MultiPartParser(meta, stream, [StreamingImageUploadHandler()])
+        try:
+            return parser.parse()[1]['file']
+        finally:
+            self.bytes_read = stream.bytes_read
+
+    def test_file_is_hashed_while_streaming(self):
+        data = image_bytes('PNG')
+        file = self.parse(data)
+        self.assertEqual(file.image_header, ImageHeader('PNG', 100, 100))
+        self.assertEqual(file.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(file.read(), data)
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_rejected_after_first_chunk(self):
+        data = image_bytes('PNG') + b'\0' * 1024 * 1024
+        with self.assertRaises(ImageUploadError):
+            self.parse(data)
+        self.assertLess(self.bytes_read, 256 * 1024)
+
+    def test_not_an_image_rejected_after_sniff_bytes(self):
+        with self.assertRaises(ImageUploadError):
+            self.parse(b'\0' * 1024 * 1024)
+        self.assertLess(self.bytes_read, 512 * 1024)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1000)
+    def test_content_length_rejected_before_reading(self):
+        with self.assertRaises(ImageUploadError):
+            self.parse(image_bytes('PNG'), content_length=10 * 1024 * 1024)
+        self.assertEqual(self.bytes_read, 0)
+
+
+class TestDirectUpload(ImageTestBase):
+
+    def request_ticket(self, client, content_type='image/jpeg', public=True):
+        response = client.post('/images/upload', data={'title': 'direct', 'description': 'lorem ipsum',
+                                                       'public': public, 'content_type': content_type})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['upload_method'], 'PUT')
+        return UploadTicket.objects.get(pk=response.data['id'])
+
+    def put_object(self, ticket: UploadTicket, data: bytes):
+        # the client PUTs to upload_url, tests write the object through the storage client directly
+        default_storage.client.put_object(default_storage.bucket_name, ticket.object_name, io.BytesIO(data), len(data))
+
+    def test_upload_and_confirm(self):
+        client = self.user1Owner.client
+        ticket = self.request_ticket(client, public=False)
+
+        response = client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # nothing uploaded yet
+
+        self.put_object(ticket, image_bytes())
+        response = client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = ModelImage.objects.get(pk=response.data['id'])
+        self.assertEqual(image.user, self.user1Owner.user)
+        self.assertEqual(image.file.name, image.blob.key)
+        self.assertFalse(image.public)
+        self.assertFalse(UploadTicket.objects.filter(pk=ticket.pk).exists())
+
+        response = client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_anonymous_user_only_public(self):
+        response = self.anonymousUser.client.post('/images/upload', data={'title': 'direct', 'public': False,
+                                                                          'content_type': 'image/jpeg'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.anonymousUser.client.post('/images/upload', data={'title': 'direct', 'public': True,
+                                                                          'content_type': 'text/html'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_only_owner_confirms(self):
+        ticket = self.request_ticket(self.user1Owner.client)
+        self.put_object(ticket, image_bytes())
+        response = self.user2Observer.client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_object_replaced_after_verification(self):
+        ticket = self.request_ticket(self.user1Owner.client)
+        self.put_object(ticket, image_bytes())
+        hash_object = blobs.hash_object
+
+        def replace_then_hash(object_name, etag):
+            self.put_object(ticket, b'not an image' * 1000)
+            return hash_object(object_name, etag)
+
+        with mock.patch.object(blobs, 'hash_object', side_effect=replace_then_hash):
+            response = self.user1Owner.client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ModelImage.objects.count(), 0)
+        self.assertEqual(Blob.objects.count(), 0)
+
+    def test_copy_is_pinned_to_the_verified_object(self):
+        # the storage refuses the copy when the etag changed (the test server ignores the condition)
+        ticket = self.request_ticket(self.user1Owner.client)
+        self.put_object(ticket, image_bytes())
+        etag = default_storage.client.stat_object(default_storage.bucket_name, ticket.object_name).etag
+        with mock.patch.object(default_storage.client, 'copy_object',
+                               wraps=default_storage.client.copy_object) as copy_object:
+            response = self.user1Owner.client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(copy_object.call_args[1]['conditions']['X-Amz-Copy-Source-If-Match'], etag)
+
+    def test_wrong_content_rejected(self):
+        ticket = self.request_ticket(self.user1Owner.client, content_type='image/png')
+        self.put_object(ticket, image_bytes('JPEG'))
+        response = self.user1Owner.client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ModelImage.objects.count(), 0)
+        collect(grace=0)
+        self.assertFalse(default_storage.exists(ticket.object_name))
+
+
+class TestContentAddressedStorage(ImageTestBase):
+
+    def upload(self, client, data: bytes, name='image.png'):
+        file = io.BytesIO(data)
+        file.name = name
+        response = client.post('/images/', data={'title': name, 'description': '', 'public': True, 'file': file},
+                               format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return ModelImage.objects.get(pk=response.data['id'])
+
+    def test_duplicate_upload_shares_blob(self):
+        data = image_bytes('PNG')
+        first = self.upload(self.user1Owner.client, data, 'first.png')
+        second = self.upload(self.user2Observer.client, data, 'second.png')
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith('blobs/'))
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 2)
+
+        response = self.user1Owner.client.delete('/images/{}'.format(first.pk))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 1)
+        self.assertTrue(default_storage.exists(second.file.name))
+
+        self.user2Observer.client.delete('/images/{}'.format(second.pk))
+        self.assertFalse(Blob.objects.filter(pk=first.blob_id).exists())
+        collect(grace=0)
+        self.assertFalse(default_storage.exists(second.file.name))
+
+    def test_direct_upload_deduplicated(self):
+        data = image_bytes('JPEG')
+        uploaded = self.upload(self.user1Owner.client, data, 'first.jpg')
+        response = self.user2Observer.client.post('/images/upload', data={'title': 'direct', 'public': True,
+                                                                          'content_type': 'image/jpeg'})
+        ticket = UploadTicket.objects.get(pk=response.data['id'])
+        default_storage.client.put_object(default_storage.bucket_name, ticket.object_name, io.BytesIO(data), len(data))
+        response = self.user2Observer.client.post('/images/upload/{}'.format(ticket.pk))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = ModelImage.objects.get(pk=response.data['id'])
+        self.assertEqual(image.blob_id, uploaded.blob_id)
+        collect(grace=0)
+        self.assertFalse(default_storage.exists(ticket.object_name))
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_upload_rejected_by_header(self):
+        file = io.BytesIO(image_bytes('PNG'))
+        file.name = 'image.png'
+        response = self.user1Owner.client.post('/images/', data={'title': 'big', 'public': True, 'file': file},
+                                               format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pixels', response.data['detail'])
+        self.assertEqual(ModelImage.objects.count(), 0)
@@ -0,0 +1,97 @@
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import imagemeta, usercache
+from ..models import Image as ModelImage
+
+
+@override_settings(ME_CACHE_TIMEOUT=300)
+class TestUserResponseCache(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner, self.observer = self.user1Owner, self.user2Observer
+        self.images = [ModelImage.objects.create(title='image {}'.format(i), file='image{}.png'.format(i),
+                                                 user=self.owner.user, public=True) for i in range(2)]
+
+    def results(self, client, path):
+        response = client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['results']
+
+    def test_repeated_request_is_served_from_cache(self):
+        client = self.owner.client
+        first = client.get('/me/images?ordering=created_at')
+        with self.assertNumQueries(0):
+            second = client.get('/me/images?ordering=created_at')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+
+        # other parameters are other responses
+        self.assertEqual(len(self.results(client, '/me/images?page_size=1')), 1)
+        # the browsable API is not cached
+        self.assertEqual(client.get('/me/images?format=api').status_code, status.HTTP_200_OK)
+        self.assertIsNone(usercache.lookup(self.owner.user.pk, 'http://testserver/me/images?format=api')[1])
+
+    def test_activity_bumps_the_version(self):
+        owner, observer = self.owner.client, self.observer.client
+        image = self.images[0]
+        self.assertEqual([row['upvote_count'] for row in self.results(owner, '/me/images')], [0, 0])
+        self.assertEqual(self.results(observer, '/me/images/voted'), [])
+        self.assertEqual(self.results(observer, '/me/images/favourites'), [])
+
+        observer.put('/images/{}/vote'.format(image.pk), {'type': 'up'})
+        observer.put('/images/{}/favourite'.format(image.pk), {'type': 'add'})
+        self.assertEqual(sorted(row['upvote_count'] for row in self.results(owner, '/me/images')), [0, 1])
+        self.assertEqual([row['id'] for row in self.results(observer, '/me/images/voted')], [image.pk])
+        self.assertEqual([row['id'] for row in self.results(observer, '/me/images/favourites')], [image.pk])
+
+        owner.delete('/images/{}'.format(image.pk))
+        self.assertEqual(len(self.results(owner, '/me/images')), 1)
+        self.assertEqual(self.results(observer, '/me/images/voted'), [])
+        self.assertEqual(self.results(observer, '/me/images/favourites'), [])
+
+    @override_settings(VOTE_WRITE_BEHIND=True)
+    def test_flushed_votes_bump_the_owner(self):
+        owner, observer = self.owner.client, self.observer.client
+        image = self.images[0]
+        self.results(owner, '/me/images')
+        observer.put('/images/{}/vote'.format(image.pk), {'type': 'down'})
+        self.assertEqual([row['id'] for row in self.results(observer, '/me/images/voted')], [image.pk])
+        call_command('flush_votes', stdout=mock.Mock())
+        self.assertEqual(sorted(row['downvote_count'] for row in self.results(owner, '/me/images')), [0, 1])
+
+    def test_admin_and_background_writes_bump_owner_and_voters(self):
+        owner, observer = self.owner.client, self.observer.client
+        image = self.images[0]
+        observer.put('/images/{}/favourite'.format(image.pk), {'type': 'add'})
+
+        def duplicates():
+            return [sorted(row['possible_duplicate'] for row in self.results(owner, '/me/images')),
+                    [row['possible_duplicate'] for row in self.results(observer, '/me/images/favourites')]]
+
+        self.assertEqual(duplicates(), [[False, False], [False]])
+        with mock.patch.object(imagemeta, 'index_image', return_value=True), \
+                mock.patch.object(imagemeta, 'store_features'):
+            imagemeta.save_metadata(image.pk, {'phash': 0, 'features': None, 'dominant_color': '#000000'})
+        self.assertEqual(duplicates(), [[False, True], [True]])
+
+        admin = self.superuserInfo.client
+        admin.force_login(self.superuserInfo.user)
+        response = admin.post('/admin/restapi/image/', {'action': 'clear_possible_duplicate',
+                                                        '_selected_action': [image.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(duplicates(), [[False, False], [False]])
+        admin.post('/admin/restapi/image/', {'action': 'make_private', '_selected_action': [image.pk]})
+        self.assertEqual([row['public'] for row in self.results(observer, '/me/images/favourites')], [False])
+
+    @override_settings(ME_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        client = self.owner.client
+        self.results(client, '/me/images')
+        self.assertEqual(usercache.lookup(self.owner.user.pk, 'http://testserver/me/images'), (0, None))
@@ -0,0 +1,69 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework import status
+
+from .dataclasses import UserTestData
+from .testimage import ImageTestBase
+from ..models import Comment, Favourite, Image as ModelImage, Vote
+
+
+class TestUserList(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        owner, observer = self.user1Owner.user, self.user2Observer.user
+        self.images = [ModelImage.objects.create(title=str(i), file='image{}.png'.format(i), user=owner)
+                       for i in range(3)]
+        for image in self.images:
+            Comment.objects.create(image=image, user=observer, comment_text='nice')
+            Vote.objects.create(image=image, user=observer, upvote=image != self.images[0])
+            Favourite.objects.create(image=image, user=observer)
+        Vote.objects.create(image=self.images[0], user=owner, upvote=True)
+
+    def users(self, query=''):
+        response = self.superuserInfo.client.get('/users/' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {user['username']: user for user in response.data['results']}
+
+    def test_summary(self):
+        users = self.users()
+        self.assertEqual(set(users), {'admin', 'owner', 'observer'})
+        counts = ['image_count', 'comment_count', 'upvote_count', 'downvote_count', 'favourite_count']
+        self.assertEqual([users['owner'][name] for name in counts], [3, 0, 1, 0, 0])
+        self.assertEqual([users['observer'][name] for name in counts], [0, 3, 2, 1, 3])
+        self.assertNotIn('images', users['owner'])
+
+        response = self.superuserInfo.client.get('/users/{}/'.format(self.user2Observer.user.pk))
+        self.assertEqual(response.data['comment_count'], 3)
+        self.assertEqual(self.user1Owner.client.get('/users/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_expand(self):
+        users = self.users('?expand=images,votes')
+        self.assertEqual(sorted(image['id'] for image in users['owner']['images']),
+                         [image.pk for image in self.images])
+        self.assertEqual(len(users['observer']['votes']), 3)
+        self.assertNotIn('comments', users['observer'])
+
+        with override_settings(USER_EXPAND_LIMIT=2):
+            users = self.users('?expand=comments')
+        self.assertEqual([comment['image'] for comment in users['observer']['comments']],
+                         [self.images[2].pk, self.images[1].pk])
+        self.assertEqual(users['observer']['comment_count'], 3)
+
+        response = self.superuserInfo.client.get('/users/?expand=passwords')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_queries_do_not_grow_with_users(self):
+        def queries():
+            with CaptureQueriesContext(connection) as context:
+                self.users('?page_size=1000&expand=images,comments,votes,favourites')
+            return len(context.captured_queries)
+
+        before = queries()
+        self.assertLessEqual(before, 6)  # count, users, one per expanded relation
+        for i in range(20):
+            user = self.create_user(UserTestData('user{}'.format(i), 'easypass', 'user{}@test.com'.format(i))).user
+            image = ModelImage.objects.create(title='more', file='more.png', user=user)
+            Comment.objects.create(image=image, user=user, comment_text='more')
+            Vote.objects.create(image=image, user=user, upvote=True)
+        self.assertEqual(queries(), before)
@@ -0,0 +1,113 @@
+from unittest import mock
+
+from cacheops.redis import redis_client
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import override_settings
+from rest_framework import status
+
+from .testimage import ImageTestBase
+from .. import votebuffer
+from ..models import Image as ModelImage, Vote
+
+
+@override_settings(VOTE_WRITE_BEHIND=True)
+class TestVoteBuffer(ImageTestBase):
+
+    def setUp(self):
+        super().setUp()
+        keys = list(redis_client.scan_iter(match='votes:*'))
+        if keys:
+            redis_client.delete(*keys)
+        self.images = [ModelImage.objects.create(title=str(i), file='image{}.png'.format(i)) for i in range(3)]
+
+    def vote(self, user, image, action):
+        return user.client.put('/images/{}/vote'.format(image.pk), {'type': action})
+
+    def voted(self, user, query=''):
+        response = user.client.get('/me/images/voted' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(image['id'] for image in response.data['results'])
+
+    def stored(self):
+        return sorted(Vote.objects.values_list('image_id', 'user_id', 'upvote'))
+
+    def test_pending_votes_are_read_by_their_user(self):
+        first, second, third = self.images
+        Vote.objects.create(image=third, user=self.user1Owner.user, upvote=True)
+        self.assertEqual(self.vote(self.user1Owner, first, 'up').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.vote(self.user1Owner, second, 'down').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.vote(self.user1Owner, third, 'undo').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Vote.objects.count(), 1)
+
+        self.assertEqual(self.voted(self.user1Owner), [first.pk, second.pk])
+        self.assertEqual(self.voted(self.user1Owner, '?voted=down'), [second.pk])
+        self.assertEqual(self.voted(self.user2Observer), [])
+        # the pending undo counts as not voted
+        self.assertEqual(self.vote(self.user1Owner, third, 'undo').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_flush(self):
+        first, second, _ = self.images
+        owner, observer = self.user1Owner.user.pk, self.user2Observer.user.pk
+        self.vote(self.user1Owner, first, 'up')
+        self.vote(self.user1Owner, first, 'down')
+        self.vote(self.user2Observer, first, 'up')
+        self.vote(self.user2Observer, second, 'up')
+        self.vote(self.user2Observer, second, 'undo')
+        call_command('flush_votes', stdout=mock.Mock())
+
+        self.assertEqual(self.stored(), [(first.pk, owner, False), (first.pk, observer, True)])
+        self.assertEqual(votebuffer.user_pending(owner), {})
+        self.assertEqual(list(redis_client.scan_iter(match='votes:*')), [])
+        self.assertEqual(self.voted(self.user1Owner, '?voted=down'), [first.pk])
+
+        # votes after the flush change the stored ones
+        self.vote(self.user1Owner, first, 'undo')
+        self.assertEqual(votebuffer.flush(10), 1)
+        self.assertEqual(self.stored(), [(first.pk, observer, True)])
+
+    def test_failed_flush_is_retried(self):
+        first, second, _ = self.images
+        owner = self.user1Owner.user.pk
+        self.vote(self.user1Owner, first, 'up')
+        with mock.patch.object(votebuffer, 'insert_missing', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                votebuffer.flush(10)
+        self.assertEqual(Vote.objects.count(), 0)
+        self.assertTrue(redis_client.exists(votebuffer.flushing_key(first.pk)))
+        self.assertEqual(self.voted(self.user1Owner), [first.pk])
+
+        # the newer vote is written after the claimed one
+        self.vote(self.user1Owner, first, 'down')
+        self.vote(self.user1Owner, second, 'up')
+        self.assertEqual(votebuffer.flush(10), 2)
+        self.assertEqual(self.stored(), [(first.pk, owner, True), (second.pk, owner, True)])
+        self.assertEqual(self.voted(self.user1Owner, '?voted=down'), [first.pk])
+        votebuffer.flush(10)
+        self.assertEqual(self.stored(), [(first.pk, owner, False), (second.pk, owner, True)])
+
+    def test_replay_is_idempotent(self):
+        first, second, _ = self.images
+        owner = self.user1Owner.user.pk
+        claimed = {first.pk: {owner: votebuffer.UP}, second.pk: {owner: votebuffer.DOWN}}
+        votebuffer.apply(claimed)
+        votebuffer.apply(claimed)
+        self.assertEqual(self.stored(), [(first.pk, owner, True), (second.pk, owner, False)])
+
+    def test_existing_votes_are_not_inserted(self):
+        first, second, _ = self.images
+        owner = self.user1Owner.user
+        Vote.objects.create(image=first, user=owner, upvote=False)
+        votebuffer.insert_missing([Vote(image=first, user=owner, upvote=True),
+                                   Vote(image=second, user=owner, upvote=True)])
+        self.assertEqual(self.stored(), [(first.pk, owner.pk, False), (second.pk, owner.pk, True)])
+
+    def test_votes_of_deleted_images_are_dropped(self):
+        first, second, _ = self.images
+        self.vote(self.user1Owner, first, 'up')
+        self.vote(self.user1Owner, second, 'up')
+        first_pk = first.pk
+        first.delete()
+        self.assertEqual(votebuffer.flush(10), 2)
+        self.assertEqual(self.stored(), [(second.pk, self.user1Owner.user.pk, True)])
+        self.assertFalse(redis_client.exists(votebuffer.flushing_key(first_pk)))
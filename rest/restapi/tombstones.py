@@ -0,0 +1,125 @@
+"""
+Deferred deletion of storage objects.
+
+Deleting rows only enqueues object keys into StorageTombstone in the same transaction, so a storage outage
+never blocks a request or leaves a row without its object. collect_storage_garbage deletes the objects in
+batches with multi-object delete, failed keys are retried with exponential backoff. The sweep enqueues objects
+which no row references, e.g. uploads that were never confirmed.
+"""
+import logging
+from datetime import timedelta
+from typing import Iterable, List, Set
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import metrics
+from .models import Blob, Image, StorageTombstone, UploadTicket
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_deletion(keys: Iterable[str]):
+    now = timezone.now()
+    StorageTombstone.objects.bulk_create([StorageTombstone(key=key, next_attempt_at=now) for key in keys if key],
+                                         ignore_conflicts=True)
+
+
+def referenced_keys(keys: List[str]) -> Set[str]:
+    """
+    Keys still in use, a blob may have been uploaded again after its tombstone was written.
+    """
+    referenced = set(Blob.objects.nocache().filter(key__in=keys).values_list('key', flat=True))
+    referenced.update(Image.objects.nocache().filter(file__in=keys).values_list('file', flat=True))
+    referenced.update(UploadTicket.objects.nocache().filter(object_name__in=keys).values_list('object_name', flat=True))
+    return referenced
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(settings.STORAGE_GC_RETRY_BASE * 2 ** (attempts - 1), settings.STORAGE_GC_RETRY_MAX))
+
+
+def _remove_objects(keys: List[str]) -> dict:
+    """
+    Returns errors of keys which could not be deleted.
+    """
+    if not keys:
+        return {}
+    try:
+        errors = default_storage.client.remove_objects(default_storage.bucket_name, keys)
+        return {error.object_name: '{}: {}'.format(error.error_code, error.error_message) for error in errors}
+    except Exception as e:
+        return {key: repr(e) for key in keys}
+
+
+def collect_batch(batch_size: int, grace: int) -> int:
+    """
+    Deletes objects of one batch of due tombstones and returns the number of processed tombstones.
+    Rows are locked and skipped by concurrent collectors. Tombstones younger than grace seconds wait,
+    so an upload of the same content which is still in its transaction becomes visible to referenced_keys.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        tombstones = list(StorageTombstone.objects.nocache().select_for_update(skip_locked=True)
+                          .filter(next_attempt_at__lte=now, created_at__lte=now - timedelta(seconds=grace))
+                          .order_by('next_attempt_at')[:batch_size])
+        if not tombstones:
+            return 0
+        keys = [tombstone.key for tombstone in tombstones]
+        referenced = referenced_keys(keys)
+        errors = _remove_objects([key for key in keys if key not in referenced])
+
+        done = [tombstone.pk for tombstone in tombstones if tombstone.key not in errors]
+        StorageTombstone.objects.filter(pk__in=done).delete()
+        failed = [tombstone for tombstone in tombstones if tombstone.key in errors]
+        for tombstone in failed:
+            tombstone.attempts += 1
+            tombstone.next_attempt_at = now + retry_delay(tombstone.attempts)
+            tombstone.last_error = errors[tombstone.key][:255]
+        StorageTombstone.objects.bulk_update(failed, ['attempts', 'next_attempt_at', 'last_error'])
+
+    metrics.incr('storage_gc_deleted', len(done) - len(referenced))
+    if failed:
+        metrics.incr('storage_gc_failed', len(failed))
+        logger.warning("%s storage objects not deleted, first error: %s", len(failed), failed[0].last_error)
+    return len(tombstones)
+
+
+def collect(batch_size: int = None, grace: int = None) -> int:
+    batch_size = batch_size or settings.STORAGE_GC_BATCH_SIZE
+    grace = settings.STORAGE_GC_GRACE if grace is None else grace
+    total = 0
+    while True:
+        processed = collect_batch(batch_size, grace)
+        total += processed
+        if processed < batch_size:
+            return total
+
+
+def sweep(min_age: int = None, batch_size: int = None) -> int:
+    """
+    Enqueues objects older than min_age seconds without any row referencing them.
+    """
+    min_age = settings.STORAGE_GC_SWEEP_MIN_AGE if min_age is None else min_age
+    batch_size = batch_size or settings.STORAGE_GC_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    enqueued = 0
+    batch = []
+    objects = default_storage.client.list_objects(default_storage.bucket_name, recursive=True)
+    for obj in objects:
+        if obj.is_dir or obj.last_modified > cutoff:
+            continue
+        batch.append(obj.object_name)
+        if len(batch) >= batch_size:
+            enqueued += _enqueue_orphans(batch)
+            batch = []
+    return enqueued + _enqueue_orphans(batch)
+
+
+def _enqueue_orphans(keys: List[str]) -> int:
+    referenced = referenced_keys(keys)
+    orphans = [key for key in keys if key not in referenced]
+    enqueue_deletion(orphans)
+    return len(orphans)
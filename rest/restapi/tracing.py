@@ -0,0 +1,506 @@
+"""
+Lightweight request tracing with W3C trace context propagation.
+
+TracingMiddleware opens the root span of every sampled request, install() instruments DRF view dispatch,
+serializers, SQL queries, redis (cacheops), minio storage and outbound HTTP made with requests, so every span
+of a request shares one trace id. Finished traces are exported in zipkin v2 json format, either as json lines
+to a file or posted to a collector by a background thread. Traces with a span slower than the configured
+threshold are logged as a whole.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Union
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _random_id(bytes_count: int) -> str:
+    return '{:0{}x}'.format(random.getrandbits(bytes_count * 8), bytes_count * 2)
+
+
+def parse_traceparent(value: str):
+    """
+    Returns (trace_id, parent_span_id, sampled) or None for missing/invalid header.
+    """
+    match = TRACEPARENT_RE.match((value or '').strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def format_traceparent(span: 'Span') -> str:
+    return '00-{}-{}-01'.format(span.trace_id, span.span_id)
+
+
+class Trace:
+    """
+    Spans of one request in this process.
+    """
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans = []
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ('trace', 'trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes',
+                 'error', '_token')
+
+    def __init__(self, trace: Trace, name: str, parent_id: Union[str, None], kind: str, attributes: dict):
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def increment(self, key: str, value: int = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_zipkin(self) -> dict:
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': self.start_ns // 1000,
+            'duration': max(1, (self.end_ns - self.start_ns) // 1000),
+            'localEndpoint': {'serviceName': settings.TRACING_SERVICE_NAME},
+            'tags': {key: str(value) for key, value in self.attributes.items()},
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind in ('client', 'server'):
+            span['kind'] = self.kind.upper()
+        if self.error:
+            span['tags']['error'] = self.error
+        return span
+
+
+def current_span() -> Union[Span, None]:
+    return _current_span.get()
+
+
+def _start(name: str, kind: str, attributes: dict, traceparent: str = None) -> Union[Span, None]:
+    parent = _current_span.get()
+    if parent is not None:
+        trace = parent.trace
+        if len(trace.spans) >= settings.TRACING_MAX_SPANS:
+            trace.dropped += 1
+            return None
+        span = Span(trace, name, parent.span_id, kind, attributes)
+    else:
+        context = parse_traceparent(traceparent)
+        if context is not None:
+            trace_id, parent_id, sampled = context
+        else:
+            trace_id, parent_id = _random_id(16), None
+            sampled = random.random() < settings.TRACING_SAMPLE_RATE
+        if not sampled:
+            return None
+        span = Span(Trace(trace_id), name, parent_id, kind, attributes)
+    span.trace.spans.append(span)
+    span._token = _current_span.set(span)
+    return span
+
+
+def _finish(span: Span, error: BaseException = None):
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = '{}: {}'.format(type(error).__name__, error)
+    _current_span.reset(span._token)
+    if _current_span.get() is None:
+        # local root span finished, the whole trace of this process is complete
+        _trace_finished(span)
+
+
+@contextmanager
+def start_span(name: str, kind: str = 'internal', traceparent: str = None, **attributes):
+    """
+    Opens child span of the current span. Without current span a new trace is started (continuing the
+    incoming `traceparent`). Yields None when the trace is not sampled.
+    """
+    if not settings.TRACING_ENABLED or (traceparent is None and _current_span.get() is None and kind != 'server'):
+        # work outside of a traced request is not traced
+        yield None
+        return
+    span = _start(name, kind, attributes, traceparent)
+    if span is None:
+        yield None
+        return
+    try:
+        yield span
+    except BaseException as e:
+        _finish(span, e)
+        raise
+    _finish(span)
+
+
+def traced(name: str = None, kind: str = 'internal'):
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with start_span(span_name, kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# export
+
+def _trace_finished(root: Span):
+    trace = root.trace
+    if trace.dropped:
+        root.set_attribute('spans.dropped', trace.dropped)
+    slowest = max(trace.spans, key=lambda span: span.duration_ms if span is not root else 0)
+    if root.duration_ms >= settings.TRACING_SLOW_REQUEST_MS or \
+            (slowest is not root and slowest.duration_ms >= settings.TRACING_SLOW_SPAN_MS):
+        logger.warning("slow trace %s: %s took %.1f ms\n%s", trace.trace_id, root.name, root.duration_ms,
+                       format_trace(trace), extra={'trace_id': trace.trace_id, 'duration_ms': root.duration_ms})
+    get_exporter().export([span.to_zipkin() for span in trace.spans])
+
+
+def format_trace(trace: Trace) -> str:
+    children = {}
+    for span in trace.spans:
+        children.setdefault(span.parent_id, []).append(span)
+    ids = {span.span_id for span in trace.spans}
+    lines = []
+
+    def walk(span, depth):
+        attributes = ' '.join('{}={}'.format(key, value) for key, value in span.attributes.items())
+        lines.append('{}{} {:.1f} ms {}{}'.format('  ' * depth, span.name, span.duration_ms, attributes,
+                                                  ' ERROR ' + span.error if span.error else ''))
+        for child in children.get(span.span_id, ()):
+            walk(child, depth + 1)
+
+    for span in trace.spans:
+        if span.parent_id not in ids:
+            walk(span, 0)
+    return '\n'.join(lines)
+
+
+class FileExporter:
+    """
+    Appends one json line per trace (list of zipkin v2 spans).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export_batch(self, traces):
+        with open(self.path, 'a') as f:
+            for spans in traces:
+                f.write(json.dumps(spans) + '\n')
+
+
+class ZipkinExporter:
+    """
+    Posts spans to a zipkin compatible collector (zipkin, jaeger, opentelemetry collector).
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def export_batch(self, traces):
+        import requests
+        spans = [span for trace in traces for span in trace]
+        # the collector call itself must not be traced
+        token = _current_span.set(None)
+        try:
+            requests.post(self.url, data=json.dumps(spans), headers={'Content-Type': 'application/json'}, timeout=5)
+        finally:
+            _current_span.reset(token)
+
+
+class BackgroundExporter:
+    """
+    Exports from a daemon thread, full queue drops the trace.
+    """
+
+    def __init__(self, target, queue_size=1000, batch_size=100):
+        self.target = target
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+                self._pid = pid
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.target.export_batch(batch)
+            except Exception as e:
+                logger.warning("trace export failed: %s", e)
+
+
+_exporter = None
+
+
+def get_exporter() -> BackgroundExporter:
+    global _exporter
+    if _exporter is None:
+        if settings.TRACING_EXPORTER == 'zipkin':
+            target = ZipkinExporter(settings.TRACING_ZIPKIN_URL)
+        else:
+            target = FileExporter(settings.TRACING_FILE)
+        _exporter = BackgroundExporter(target)
+    return _exporter
+
+
+class TraceContextFilter(logging.Filter):
+    """
+    Adds trace_id and span_id of the current span to log records, so graylog can correlate logs of a request.
+    """
+
+    def filter(self, record):
+        span = _current_span.get()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+
+# instrumentation
+
+_patched = []  # (owner, attribute, attribute of the owner itself or None), restored by uninstall()
+
+
+def _patch(owner, name: str, value):
+    _patched.append((owner, name, vars(owner).get(name)))
+    setattr(owner, name, value)
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    if _current_span.get() is None:
+        return execute(sql, params, many, context)
+    with start_span('sql', 'client', **{'db.statement': sql[:settings.TRACING_MAX_STATEMENT_LENGTH],
+                                        'db.alias': context['connection'].alias, 'db.many': many}):
+        return execute(sql, params, many, context)
+
+
+def _install_db():
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    def add_wrapper(connection, **kwargs):
+        if _sql_wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_sql_wrapper)
+
+    connection_created.connect(add_wrapper, weak=False, dispatch_uid='restapi.tracing')
+    for connection in connections.all():
+        add_wrapper(connection)
+
+
+def _install_views():
+    from rest_framework.views import APIView
+
+    dispatch = APIView.dispatch
+
+    @wraps(dispatch)
+    def traced_dispatch(self, request, *args, **kwargs):
+        if _current_span.get() is None:
+            return dispatch(self, request, *args, **kwargs)
+        with start_span('view {}'.format(type(self).__name__)) as span:
+            response = dispatch(self, request, *args, **kwargs)
+            if span is not None:
+                span.set_attribute('http.status_code', response.status_code)
+            return response
+
+    _patch(APIView, 'dispatch', traced_dispatch)
+
+
+def _install_serializers():
+    from rest_framework import serializers
+
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        getter = cls.data.fget
+
+        def make_getter(getter):
+            @wraps(getter)
+            def traced_data(self):
+                if _current_span.get() is None or hasattr(self, '_data'):
+                    return getter(self)
+                name = type(self.child if isinstance(self, serializers.ListSerializer) else self).__name__
+                with start_span('serialize {}'.format(name), many=isinstance(self, serializers.ListSerializer)):
+                    return getter(self)
+
+            return traced_data
+
+        _patch(cls, 'data', property(make_getter(getter)))
+
+
+def _install_redis():
+    import redis
+    from cacheops.signals import cache_read
+
+    execute_command = redis.Redis.execute_command
+
+    @wraps(execute_command)
+    def traced_execute_command(self, *args, **options):
+        if _current_span.get() is None:
+            return execute_command(self, *args, **options)
+        with start_span('redis {}'.format(args[0]), 'client'):
+            return execute_command(self, *args, **options)
+
+    _patch(redis.Redis, 'execute_command', traced_execute_command)
+
+    pipeline_execute = redis.client.Pipeline.execute
+
+    @wraps(pipeline_execute)
+    def traced_pipeline_execute(self, *args, **kwargs):
+        if _current_span.get() is None:
+            return pipeline_execute(self, *args, **kwargs)
+        with start_span('redis pipeline', 'client', commands=len(self.command_stack)):
+            return pipeline_execute(self, *args, **kwargs)
+
+    _patch(redis.client.Pipeline, 'execute', traced_pipeline_execute)
+
+    def on_cache_read(sender, func=None, hit=None, **kwargs):
+        span = _current_span.get()
+        if span is not None:
+            span.increment('cacheops.hits' if hit else 'cacheops.misses')
+
+    cache_read.connect(on_cache_read, weak=False, dispatch_uid='restapi.tracing')
+
+
+def _install_storage():
+    from minio_storage.storage import MinioStorage
+
+    for method_name in ('_save', '_open', 'delete', 'exists', 'size', 'listdir'):
+        method = getattr(MinioStorage, method_name)
+
+        def make_method(method, method_name):
+            @wraps(method)
+            def traced_method(self, name, *args, **kwargs):
+                if _current_span.get() is None:
+                    return method(self, name, *args, **kwargs)
+                with start_span('storage {}'.format(method_name.strip('_')), 'client', object=name,
+                                bucket=self.bucket_name):
+                    return method(self, name, *args, **kwargs)
+
+            return traced_method
+
+        _patch(MinioStorage, method_name, make_method(method, method_name))
+
+
+def _install_http():
+    import requests
+
+    send = requests.Session.send
+
+    @wraps(send)
+    def traced_send(self, request, **kwargs):
+        if _current_span.get() is None:
+            return send(self, request, **kwargs)
+        with start_span('http {}'.format(request.method), 'client', **{'http.url': request.url.split('?')[0]}) as span:
+            if span is not None:
+                request.headers['traceparent'] = format_traceparent(span)
+            response = send(self, request, **kwargs)
+            if span is not None:
+                span.set_attribute('http.status_code', response.status_code)
+            return response
+
+    _patch(requests.Session, 'send', traced_send)
+
+
+_installed = False
+
+
+def install() -> bool:
+    """
+    Instruments the libraries, called once from RestapiConfig.ready() when TRACING_ENABLED.
+    Returns False when they are instrumented already.
+    """
+    global _installed
+    if _installed:
+        return False
+    _installed = True
+    _install_db()
+    _install_views()
+    _install_serializers()
+    _install_redis()
+    _install_storage()
+    _install_http()
+    return True
+
+
+def uninstall():
+    """
+    Restores the libraries instrumented by install(), used by tests.
+    """
+    global _installed
+    from cacheops.signals import cache_read
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    connection_created.disconnect(dispatch_uid='restapi.tracing')
+    cache_read.disconnect(dispatch_uid='restapi.tracing')
+    for connection in connections.all():
+        if _sql_wrapper in connection.execute_wrappers:
+            connection.execute_wrappers.remove(_sql_wrapper)
+    while _patched:
+        owner, name, original = _patched.pop()
+        if original is None:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, original)
+    _installed = False
@@ -0,0 +1,220 @@
+"""
+Image upload validation.
+
+Multipart uploads go through StreamingImageUploadHandler, which checks the image header in the first chunks
+and hashes the file while it is written to a temporary file.
+
+Direct uploads: the client asks for an upload ticket, PUTs the image bytes to the presigned url straight to minio
+and confirms the ticket. Application workers only check the size of the stored object and sniff its header.
+"""
+import hashlib
+import io
+import struct
+import uuid
+from datetime import timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from PIL import Image as PilImage
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from minio import Minio
+from minio import error as merr
+
+UPLOAD_PREFIX = 'uploads/'
+FORM_FIELDS_MAX_BYTES = 64 * 1024  # title, description, public and multipart boundaries
+
+# pillow format -> (content type, extension)
+FORMATS = {
+    'JPEG': ('image/jpeg', '.jpg'),
+    'PNG': ('image/png', '.png'),
+    'GIF': ('image/gif', '.gif'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class UploadMissing(UploadRejected):
+    pass
+
+
+class ImageUploadError(MultiPartParserError):
+    """
+    Raised while the multipart body is parsed, DRF turns it into 400 Bad request.
+    """
+    pass
+
+
+class ImageHeader(NamedTuple):
+    format: str
+    width: int
+    height: int
+
+
+def allowed_content_types():
+    return [FORMATS[image_format][0] for image_format in settings.IMAGE_UPLOAD_ALLOWED_FORMATS]
+
+
+def content_type_format(content_type: str) -> str:
+    for image_format in settings.IMAGE_UPLOAD_ALLOWED_FORMATS:
+        if FORMATS[image_format][0] == content_type:
+            return image_format
+    raise UploadRejected('content type {} is not allowed'.format(content_type))
+
+
+def describe_format(image_format: str) -> Tuple[str, str]:
+    """
+    Content type and file extension of a pillow image format.
+    """
+    if image_format in FORMATS:
+        return FORMATS[image_format]
+    PilImage.init()
+    return PilImage.MIME.get(image_format, 'application/octet-stream'), '.' + image_format.lower()
+
+
+def new_object_name(content_type: str) -> str:
+    return UPLOAD_PREFIX + uuid.uuid4().hex + FORMATS[content_type_format(content_type)][1]
+
+
+@lru_cache(maxsize=None)
+def presign_client() -> Minio:
+    """
+    Presigned urls are signed for the host the client sees, not for minio:9000 inside the docker network.
+    The region is fixed, so signing never asks the public endpoint for bucket location.
+    """
+    return Minio(settings.MINIO_STORAGE_PUBLIC_ENDPOINT,
+                 access_key=settings.MINIO_STORAGE_ACCESS_KEY,
+                 secret_key=settings.MINIO_STORAGE_SECRET_KEY,
+                 secure=settings.MINIO_STORAGE_PUBLIC_USE_HTTPS,
+                 region=settings.MINIO_STORAGE_REGION)
+
+
+def presigned_put_url(object_name: str) -> str:
+    return presign_client().presigned_put_object(default_storage.bucket_name, object_name,
+                                                 expires=timedelta(seconds=settings.IMAGE_UPLOAD_TICKET_TIMEOUT))
+
+
+def _webp_header(head: bytes) -> ImageHeader:
+    # pillow decodes the whole webp file when opening it, the dimensions are in the first chunk
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return ImageHeader('WEBP', width & 0x3fff, height & 0x3fff)
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', head[21:25])[0]
+        return ImageHeader('WEBP', (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+    if chunk == b'VP8X':
+        return ImageHeader('WEBP', int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1)
+    raise SyntaxError('unknown webp chunk')
+
+
+def _pillow_header(head: bytes) -> ImageHeader:
+    with PilImage.open(io.BytesIO(head)) as image:
+        return ImageHeader(image.format, image.width, image.height)
+
+
+def read_header(head: bytes, complete: bool) -> Optional[ImageHeader]:
+    """
+    Parses format and dimensions from the first bytes of an image, pixels are not decoded.
+    Returns None when more bytes are needed, complete means there are no more bytes.
+    Raises UploadRejected for files which are not images, not allowed formats and too many pixels.
+    """
+    try:
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            header = _webp_header(head)
+        else:
+            header = _pillow_header(head)
+    except PilImage.DecompressionBombError:
+        raise UploadRejected('image has more than {} pixels'.format(settings.IMAGE_UPLOAD_MAX_PIXELS))
+    except (IOError, SyntaxError, ValueError, IndexError, struct.error):
+        if complete or len(head) >= settings.IMAGE_UPLOAD_SNIFF_BYTES:
+            raise UploadRejected('file is not an image')
+        return None
+
+    if header.format not in settings.IMAGE_UPLOAD_ALLOWED_FORMATS:
+        raise UploadRejected('image format {} is not allowed'.format(header.format))
+    if header.width * header.height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise UploadRejected('image has more than {} pixels'.format(settings.IMAGE_UPLOAD_MAX_PIXELS))
+    return header
+
+
+class StreamingImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Rejects an upload as soon as its header shows it is not an acceptable image, before the rest is received.
+    The file is hashed while it is written to a temporary file, so memory does not grow with the file size.
+    Completed files carry image_header and sha256 attributes.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.IMAGE_UPLOAD_MAX_BYTES + FORM_FIELDS_MAX_BYTES:
+            raise ImageUploadError('file is larger than {} bytes'.format(settings.IMAGE_UPLOAD_MAX_BYTES))
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.header = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise ImageUploadError('file is larger than {} bytes'.format(settings.IMAGE_UPLOAD_MAX_BYTES))
+        if self.header is None:
+            self.head += raw_data
+            self.header = self._read_header(complete=False)
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.header is None:
+            self.header = self._read_header(complete=True)
+        file = super().file_complete(file_size)
+        file.image_header = self.header
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+    def _read_header(self, complete: bool) -> Optional[ImageHeader]:
+        try:
+            header = read_header(self.head, complete)
+        except UploadRejected as e:
+            raise ImageUploadError(str(e))
+        if header is not None:
+            self.head = b''
+        return header
+
+
+def verify_upload(object_name: str, content_type: str) -> Tuple[int, str, ImageHeader]:
+    """
+    Checks size and type of an uploaded object, returns its size, etag and image header. The object can be
+    replaced until the ticket expires, later reads of it must be pinned to the etag.
+    """
+    storage = default_storage
+    try:
+        stat = storage.client.stat_object(storage.bucket_name, object_name)
+    except merr.MinioError:
+        raise UploadMissing('file was not uploaded')
+    if stat.size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise UploadRejected('file is larger than {} bytes'.format(settings.IMAGE_UPLOAD_MAX_BYTES))
+    if stat.size == 0:
+        raise UploadRejected('file is empty')
+
+    length = min(stat.size, settings.IMAGE_UPLOAD_SNIFF_BYTES)
+    try:
+        response = storage.client.get_partial_object(storage.bucket_name, object_name, 0, length,
+                                                     request_headers={'If-Match': stat.etag})
+    except merr.PreconditionFailed:
+        raise UploadMissing('file was replaced while it was checked')
+    try:
+        head = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+    header = read_header(head, complete=True)
+    if header.format != content_type_format(content_type):
+        raise UploadRejected('file is {} but {} was announced'.format(header.format, content_type))
+    return stat.size, stat.etag, header
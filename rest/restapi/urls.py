@@ -4,6 +4,7 @@ from rest_framework.authtoken.views import obtain_auth_token
 
 from .views.comment import views as comment_views
 from .views.image import views as image_views
+from .views.profiling import views as profiling_views
 from .views.user import views as user_views
 
 app_name = 'restapi'
@@ -11,17 +12,23 @@ obtain_auth_token = swagger_auto_schema(obtain_auth_token, auto_schema=None)
 urlpatterns = [
 
     path('images/', image_views.ImageListView.as_view(), name='images'),
+    path('images/upload', image_views.ImageUploadTicketView.as_view()),
+    path('images/upload/<uuid:pk>', image_views.ImageUploadConfirmView.as_view()),
     path('images/trending', image_views.ImageTrendingListView.as_view()),
+    path('images/tags', image_views.TagListView.as_view()),
     path('images/<int:pk>', image_views.ImageDetailView.as_view()),
     path('images/<int:pk>/comment', comment_views.CommentListView.as_view()),
     path('images/<int:pk>/vote', image_views.ImageVoteView.as_view()),
     path('images/<int:pk>/report', image_views.ImageReportListView.as_view()),
     path('images/<int:pk>/favourite', image_views.ImageFavouriteView.as_view()),
+    path('images/<int:pk>/duplicates', image_views.ImageDuplicateListView.as_view()),
+    path('images/<int:pk>/similar', image_views.ImageSimilarListView.as_view()),
 
     path('me/images', image_views.ImageUserView.as_view()),
     path('me/images/voted', image_views.ImageVoteListView.as_view()),
     path('me/images/favourites', image_views.ImageFavouriteListView.as_view()),
     path('me/images/favourites/download', image_views.UserFavouriteImagesView.as_view()),
+    path('me/feed', image_views.FeedView.as_view()),
     path('me/profile', user_views.ChangeUserDetailView.as_view()),
 
     path('comment/<int:pk>', comment_views.CommentDetailView.as_view()),
@@ -35,4 +42,6 @@ urlpatterns = [
 
     path('login/<str:backend>/', user_views.social_login_view),
 
+    path('profiles/<str:profile_id>', profiling_views.ProfileDetailView.as_view()),
+
 ]
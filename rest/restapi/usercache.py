@@ -0,0 +1,117 @@
+"""
+Per-user cache of the rendered responses of me/images, me/images/voted and me/images/favourites.
+
+Every user has a version counter (me:version:<user>). It is bumped when the user uploads an image, votes or
+changes favourites, when others vote, favourite, comment or report images of the user, which changes the counts of
+their lists, and for everyone listing an image when it is changed or deleted, also by admin actions and by the
+workers writing metadata, duplicate flags and title tags. Responses are stored under
+me:response:<user>:<version>:<digest of the url>, so a bump makes every cached response of the user unreachable and
+they expire after ME_CACHE_TIMEOUT seconds.
+Counts of images of other users in voted and favourite lists may be up to ME_CACHE_TIMEOUT seconds old.
+
+A lookup reads the version and the response in one call of a script, a repeated request costs one redis round
+trip and no SQL.
+"""
+import hashlib
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+from cacheops.redis import redis_client
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+from .models import Favourite, Image, Vote
+
+# KEYS: version of the user; ARGV: user id, digest of the url
+LOOKUP = """
+local version = redis.call('get', KEYS[1]) or '0'
+return {version, redis.call('get', 'me:response:' .. ARGV[1] .. ':' .. version .. ':' .. ARGV[2])}
+"""
+
+
+@lru_cache(maxsize=None)
+def _lookup_script():
+    return redis_client.register_script(LOOKUP)
+
+
+def version_key(user_id: int) -> str:
+    return 'me:version:{}'.format(user_id)
+
+
+def response_key(user_id: int, version: int, digest: str) -> str:
+    return 'me:response:{}:{}:{}'.format(user_id, version, digest)
+
+
+def url_digest(url: str) -> str:
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+def bump(*user_ids: Optional[int]):
+    """
+    Drops the cached responses of the users, None stands for anonymous and is skipped.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    pipeline = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipeline.incr(version_key(user_id))
+    pipeline.execute()
+
+
+def bump_image(image: Image):
+    """
+    Drops the cached responses listing the image: of its owner and of the users who voted or favourited it.
+    """
+    bump(image.user_id,
+         *Vote.objects.filter(image_id=image.pk).values_list('user_id', flat=True),
+         *Favourite.objects.filter(image_id=image.pk).values_list('user_id', flat=True))
+
+
+def bump_images(image_ids: Iterable[int]):
+    """
+    bump_image of many images, for writes which are not requests of a user (admin actions, background workers).
+    """
+    image_ids = list(image_ids)
+    if not image_ids:
+        return
+    bump(*Image.objects.filter(pk__in=image_ids).values_list('user_id', flat=True),
+         *Vote.objects.filter(image_id__in=image_ids).values_list('user_id', flat=True),
+         *Favourite.objects.filter(image_id__in=image_ids).values_list('user_id', flat=True))
+
+
+def lookup(user_id: int, url: str) -> Tuple[int, Optional[bytes]]:
+    """
+    Current version of the user and the response cached for url under it, None when there is none.
+    """
+    version, content = _lookup_script()(keys=[version_key(user_id)], args=[user_id, url_digest(url)])
+    return int(version), content if content else None
+
+
+def store(user_id: int, version: int, url: str, content: bytes):
+    redis_client.set(response_key(user_id, version, url_digest(url)), content, ex=settings.ME_CACHE_TIMEOUT)
+
+
+class UserResponseCacheMixin:
+    """
+    List view of the requesting user answered from the cache when its rendered JSON is there, the rendered
+    response is stored otherwise. Other formats (e.g. the browsable API) are not cached.
+    """
+
+    def list(self, request, *args, **kwargs):
+        self._cache_version = None
+        if settings.ME_CACHE_TIMEOUT and request.accepted_renderer.format == 'json':
+            version, content = lookup(request.user.pk, request.build_absolute_uri())
+            if content is not None:
+                return HttpResponse(content, content_type=request.accepted_renderer.media_type)
+            self._cache_version = version
+        return super().list(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, '_cache_version', None) is not None and isinstance(response, Response) and \
+                response.status_code == 200:
+            response.render()
+            store(request.user.pk, self._cache_version, request.build_absolute_uri(), response.content)
+        return response
@@ -5,6 +5,11 @@ from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
 
 from ..update_api_view import UpdateAPIView
+from ... import listing, usercache
+from ...commentstream import publish
+from ...fieldsets import FIELDS_PARAMETERS
+from ...listing import RowsListMixin
+from ...metrics import metrics
 from ...models import Comment, Image
 from ...pagination import DefaultPagination
 from ...permissions import CommentListViewPermission, CommentDetailViewPermission
@@ -18,9 +23,11 @@ class CommentFilter(django_filters.FilterSet):
         fields = ['created_at', 'comment_text']
 
 
-class CommentListView(generics.ListAPIView, generics.CreateAPIView):
+class CommentListView(RowsListMixin, generics.ListAPIView, generics.CreateAPIView):
     permission_classes = [CommentListViewPermission]
     serializer_class = CommentListSerializer
+    values_of = listing.comment_values
+    rows_of = listing.comment_rows
     filterset_class = CommentFilter
     ordering_fields = ['created_at']
     queryset = Comment.objects.all()
@@ -32,6 +39,7 @@ class CommentListView(generics.ListAPIView, generics.CreateAPIView):
         except Image.DoesNotExist:
             raise NotFound(detail="Image not found")
 
+    @swagger_auto_schema(manual_parameters=FIELDS_PARAMETERS)
     def get(self, request, pk, *args, **kwargs):
         '''
         Get all comments to image with pk=:id.
@@ -39,15 +47,7 @@ class CommentListView(generics.ListAPIView, generics.CreateAPIView):
         '''
         image = self.get_image(pk)
         self.check_permission_on_image(request, image)
-        queryset = self.filter_queryset(self.get_queryset().filter(image=image))
-
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_rows(self.filter_queryset(self.get_queryset().filter(image=image)))
 
     @swagger_auto_schema(
         responses={
@@ -68,6 +68,9 @@ class CommentListView(generics.ListAPIView, generics.CreateAPIView):
         serializer = CommentListSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save(user=self.request.user, image=image)
+            usercache.bump(image.user_id)
+            metrics.incr('comments', action='create')
+            publish(image.pk, 'created', serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -112,6 +115,8 @@ class CommentDetailView(UpdateAPIView, generics.DestroyAPIView):
         serializer = self.get_serializer(comment, data=request.data)
         if serializer.is_valid():
             serializer.save()
+            metrics.incr('comments', action='update')
+            publish(comment.image_id, 'updated', serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -132,5 +137,9 @@ class CommentDetailView(UpdateAPIView, generics.DestroyAPIView):
         '''
         comment: Comment = self.get_object(pk)
         self.check_object_permissions(request, comment)
+        comment_id = comment.pk
         comment.delete()
+        usercache.bump(comment.image.user_id)
+        metrics.incr('comments', action='delete')
+        publish(comment.image_id, 'deleted', {'id': comment_id})
         return Response({"status": "Comment deleted"}, status=status.HTTP_204_NO_CONTENT)
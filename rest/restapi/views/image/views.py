@@ -5,8 +5,10 @@ import zipfile
 from typing import Union
 
 import django_filters
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
+from django.db import transaction
+from django.db.models import Count, FilteredRelation, Q
 from django.http import HttpResponse
 from django.utils import timezone
 from django_filters import rest_framework as filters
@@ -20,12 +22,21 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from ..update_api_view import UpdateAPIView
-from ...models import Image, Vote, Favourite, ReportImage
-from ...pagination import DefaultPagination
+from ... import countstream, duplicates, feed, listing, similarity, tags, usercache, votebuffer
+from ...blobs import ObjectChanged, adopt_object, release_blob, store_blob
+from ...fieldsets import FIELDS_PARAMETERS, SparseFieldsMixin, only_columns
+from ...imagemeta import schedule_extraction
+from ...listing import RowsListMixin
+from ...metrics import metrics
+from ...models import Image, ImageHash, Vote, Favourite, ReportImage, UploadTicket
+from ...pagination import CappedCountPagination, DefaultPagination
 from ...permissions import ImageDetailViewPermission, IsImagePublicOrAdminOrOwnerWithAuthentication, \
     ImageReportListViewPermission
 from ...serializers import ImageDetailSerializer, ImageListSerializer, VoteCreateSerializer, FavouriteCreateSerializer, \
-    ReportImageListSerilizer
+    ReportImageListSerilizer, UploadTicketSerializer
+from ...uploads import ImageHeader, StreamingImageUploadHandler, UploadMissing, UploadRejected, \
+    describe_format, new_object_name, presigned_put_url, verify_upload
+from ...usercache import UserResponseCacheMixin
 
 User = get_user_model()
 
@@ -51,15 +62,18 @@ class ImageUserFilter(django_filters.FilterSet):
             return queryset
 
 
-class ImageUserView(generics.ListAPIView):
+class ImageUserView(UserResponseCacheMixin, RowsListMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Image.objects.all()
     serializer_class = ImageListSerializer
+    values_of = listing.image_values
+    rows_of = listing.image_rows
     pagination_class = DefaultPagination
     filterset_class = ImageUserFilter
     ordering_fields = ['created_at']
 
     @swagger_auto_schema(
+        manual_parameters=FIELDS_PARAMETERS,
         responses={
             # 200 is generated properly with pagination
             401: "Unauthorized",
@@ -70,15 +84,7 @@ class ImageUserView(generics.ListAPIView):
         '''
         Returns all images of authenticated user.
         '''
-        queryset = self.filter_queryset(self.get_queryset())
-
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list(request, *args, **kwargs)
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
@@ -94,21 +100,24 @@ class ImageVotedListFilter(django_filters.FilterSet):
         if value is not None and len(value) > 0 and value.lower() in ('up', 'down'):
             value = value.lower()
             value = True if value == 'up' else False
-            return queryset.filter(vote_to_image__upvote=value)
+            return votebuffer.voted_images(queryset, self.request.user.pk, upvote=value)
         else:
             return queryset
 
 
-class ImageVoteListView(generics.ListAPIView):
+class ImageVoteListView(UserResponseCacheMixin, RowsListMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Image.objects.all()
     serializer_class = ImageListSerializer
+    values_of = listing.image_values
+    rows_of = listing.image_rows
     pagination_class = DefaultPagination
     filterset_class = ImageVotedListFilter
 
     # ordering_fields = ['created_at']
 
     @swagger_auto_schema(
+        manual_parameters=FIELDS_PARAMETERS,
         responses={
             # 200 is generated properly with pagination
             401: "Unauthorized",
@@ -122,17 +131,20 @@ class ImageVoteListView(generics.ListAPIView):
         return super().get(request, args, kwargs)
 
     def get_queryset(self):
-        return self.queryset.filter(vote_to_image__user=self.request.user)
+        return votebuffer.voted_images(self.queryset, self.request.user.pk)
 
 
-class ImageFavouriteListView(generics.ListAPIView):
+class ImageFavouriteListView(UserResponseCacheMixin, RowsListMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Image.objects.all()
     serializer_class = ImageListSerializer
+    values_of = listing.image_values
+    rows_of = listing.image_rows
     pagination_class = DefaultPagination
     ordering_fields = ['created_at']
 
     @swagger_auto_schema(
+        manual_parameters=FIELDS_PARAMETERS,
         responses={
             # 200 is generated properly with pagination
             401: "Unauthorized",
@@ -156,6 +168,10 @@ class ImageFilter(django_filters.FilterSet):
     username = filters.CharFilter(field_name='user', method='filter_user', label="Username")
     user_id = filters.CharFilter(field_name='user', lookup_expr='id', label="Username id")
     user_name = filters.CharFilter(field_name='user', lookup_expr='username__istartswith', label="Username name")
+    possible_duplicate = filters.BooleanFilter(label="Possible duplicate")
+    tags = filters.CharFilter(method='filter_tags', label="Tags, comma separated")
+    tags_mode = filters.ChoiceFilter(choices=(('all', 'all'), ('any', 'any')), method='filter_tags_mode',
+                                     label="Images with all the tags (default) or any of them")
 
     class Meta:
         model = Image
@@ -163,6 +179,18 @@ class ImageFilter(django_filters.FilterSet):
             'created_at': ['date__lte', 'date__gte'],
         }
 
+    def filter_tags(self, queryset, name, value: str):
+        names = tags.parse_query(value)
+        if not names:
+            return queryset
+        # only admin sees private images, others are answered from postings of public images
+        image_ids = tags.tagged_image_ids(names, match_all=self.form.cleaned_data.get('tags_mode') != 'any',
+                                          public_only=not self.request.user.is_staff)
+        return queryset.filter(pk__in=image_ids)
+
+    def filter_tags_mode(self, queryset, name, value: str):
+        return queryset  # used by filter_tags
+
     def filter_user(self, queryset, name, value: str):
         if value is not None and len(value) > 0:
             if value.lower() == 'me' and self.request.user.is_authenticated:
@@ -173,29 +201,30 @@ class ImageFilter(django_filters.FilterSet):
             return queryset
 
 
-class ImageListView(generics.ListAPIView, generics.CreateAPIView):
+class ImageListView(RowsListMixin, generics.ListAPIView, generics.CreateAPIView):
     parser_classes = (MultiPartParser,)
     queryset = Image.objects.all()
     serializer_class = ImageListSerializer
-    pagination_class = DefaultPagination
+    values_of = listing.image_values
+    rows_of = listing.image_rows
+    pagination_class = CappedCountPagination
     filterset_class = ImageFilter
     ordering_fields = ['created_at', 'upvote_count']
     permission_classes = [permissions.AllowAny]
 
+    def initialize_request(self, request, *args, **kwargs):
+        # before anything (e.g. csrf check of session authentication) parses the body
+        if request.method == 'POST':
+            request.upload_handlers = [StreamingImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    @swagger_auto_schema(manual_parameters=FIELDS_PARAMETERS)
     def get(self, request, *args, **kwargs):
         '''
         Get all public images for anonymous or normal user. <br>
         Get all images for admin user - public and private.
         '''
-        queryset = self.filter_queryset(self.get_queryset())
-
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list(request, *args, **kwargs)
 
     @swagger_auto_schema(
         responses={
@@ -208,12 +237,24 @@ class ImageListView(generics.ListAPIView, generics.CreateAPIView):
         Upload an image.
         User can be Anonymous user or normal user.
         Anonymous user can upload only public image.
+        Upload is rejected as soon as its header shows a not allowed format, too many pixels or too many bytes.
         '''
         return super().post(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         user = self.request.user if self.request.user.is_authenticated else None
-        serializer.save(user=user)
+        file = serializer.validated_data['file']
+        header = getattr(file, 'image_header', None)
+        if header is None:
+            header = ImageHeader(file.image.format, file.image.width, file.image.height)
+        content_type, extension = describe_format(header.format)
+        with transaction.atomic():
+            blob = store_blob(file, content_type, extension, sha256=getattr(file, 'sha256', None))
+            image = serializer.save(user=user, file=blob.key, blob=blob, width=header.width, height=header.height,
+                                    byte_size=blob.size, mime_type=content_type)
+            schedule_extraction(image)
+        usercache.bump(image.user_id)
+        metrics.incr('image_uploads', anonymous=user is None, method='multipart')
 
     def get_queryset(self):
         if permissions.IsAdminUser().has_permission(self.request, self):
@@ -222,6 +263,106 @@ class ImageListView(generics.ListAPIView, generics.CreateAPIView):
             return self.queryset.filter(public=True)
 
 
+class ImageUploadTicketView(generics.CreateAPIView):
+    permission_classes = [permissions.AllowAny]
+    serializer_class = UploadTicketSerializer
+    queryset = UploadTicket.objects.all()
+
+    @swagger_auto_schema(
+        responses={
+            201: UploadTicketSerializer,
+            400: "Bad request",
+        },
+    )
+    def post(self, request, *args, **kwargs):
+        '''
+        Request an upload ticket. The image is uploaded with PUT to upload_url straight to the storage,
+        then the ticket is confirmed with POST images/upload/:id.
+        User can be Anonymous user or normal user.
+        Anonymous user can upload only public image.
+        '''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user if request.user.is_authenticated else None
+        content_type = serializer.validated_data['content_type']
+        expires_at = timezone.now() + datetime.timedelta(seconds=settings.IMAGE_UPLOAD_TICKET_TIMEOUT)
+        ticket = serializer.save(user=user, object_name=new_object_name(content_type), expires_at=expires_at)
+
+        data = dict(serializer.data)
+        data.update({
+            'upload_url': presigned_put_url(ticket.object_name),
+            'upload_method': 'PUT',
+            'upload_headers': {'Content-Type': content_type},
+            'max_size': settings.IMAGE_UPLOAD_MAX_BYTES,
+        })
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class ImageUploadConfirmView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get_ticket(self, request, pk) -> UploadTicket:
+        try:
+            ticket = UploadTicket.objects.nocache().get(pk=pk)
+        except UploadTicket.DoesNotExist:
+            raise NotFound(detail="Upload ticket not found")
+        if ticket.user is not None and ticket.user != request.user:
+            raise PermissionDenied()
+        return ticket
+
+    @swagger_auto_schema(
+        responses={
+            201: ImageListSerializer,
+            400: "Bad request",
+            403: "Permission denied",
+            404: "Upload ticket not found",
+        },
+    )
+    def post(self, request, pk, format=None):
+        '''
+        Confirms the upload ticket with id=pk after the image was uploaded and creates the image.
+        Only the user who requested the ticket can confirm it.
+        Tickets of Anonymous user can be confirmed by anyone who knows the id.
+        '''
+        ticket = self.get_ticket(request, pk)
+        if ticket.expires_at <= timezone.now():
+            return Response({'error': 'upload ticket expired'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size, etag, header = verify_upload(ticket.object_name, ticket.content_type)
+        except UploadMissing as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except UploadRejected as e:
+            ticket.delete()  # the object is deleted with the ticket
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # hashed and copied by the storage outside of the transaction, pinned to the verified object
+        try:
+            blob = adopt_object(ticket.object_name, ticket.content_type, size, etag)
+        except ObjectChanged:
+            ticket.delete()
+            return Response({'error': 'file was replaced after it was checked'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                deleted, _ = UploadTicket.objects.filter(pk=ticket.pk).delete()
+                if deleted:
+                    image = Image(title=ticket.title, description=ticket.description, public=ticket.public,
+                                  user=ticket.user, file=blob.key, blob=blob, width=header.width,
+                                  height=header.height, byte_size=size, mime_type=ticket.content_type)
+                    image.save()
+                    tags.set_image_tags(image)
+                    schedule_extraction(image)
+        except BaseException:
+            release_blob(blob.pk)
+            raise
+        if not deleted:
+            release_blob(blob.pk)
+            raise NotFound(detail="Upload ticket not found")  # confirmed by a concurrent request
+        usercache.bump(image.user_id)
+        metrics.incr('image_uploads', anonymous=ticket.user is None, method='presigned')
+        serializer = ImageListSerializer(image, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 # import the logging library
 import logging
 
@@ -229,22 +370,25 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-class ImageDetailView(generics.RetrieveAPIView, UpdateAPIView, generics.DestroyAPIView):
+class ImageDetailView(SparseFieldsMixin, generics.RetrieveAPIView, UpdateAPIView, generics.DestroyAPIView):
     permission_classes = [ImageDetailViewPermission]
     serializer_class = ImageDetailSerializer
     parser_class = (FileUploadParser,)
     queryset = Image.objects.all()
 
-    def get_image(self, pk) -> Union[None, Image]:
+    def get_image(self, pk, fields=None) -> Union[None, Image]:
         try:
-            return Image.objects.get(pk=pk)
+            # owner and visibility are read by the permission
+            return only_columns(Image.objects.all(), fields, 'user', 'public').get(pk=pk)
         except Image.DoesNotExist:
-            logger.error("image not found 2!!!")
+            logger.info("image %s not found", pk)
             raise NotFound(detail="Image not found")
 
     @swagger_auto_schema(
+        manual_parameters=FIELDS_PARAMETERS,
         responses={
             200: ImageDetailSerializer,
+            400: "Bad request",
             401: "Unauthorized",
             403: "Permission denied",
             404: "Image not found",
@@ -256,9 +400,10 @@ class ImageDetailView(generics.RetrieveAPIView, UpdateAPIView, generics.DestroyA
         If image is private, user has to be the owner of the image or admin.
         Otherwise user can be Anonymous user or normal user.
         """
-        image = self.get_image(pk)
+        fields = self.get_selected_fields()
+        image = self.get_image(pk, fields)
         self.check_object_permissions(request, image)
-        serializer = ImageDetailSerializer(image)
+        serializer = ImageDetailSerializer(image, context={'fields': fields})
         return Response(serializer.data)
 
     @swagger_auto_schema(
@@ -281,6 +426,7 @@ class ImageDetailView(generics.RetrieveAPIView, UpdateAPIView, generics.DestroyA
         serializer = ImageDetailSerializer(image, data=request.data)
         if serializer.is_valid():
             serializer.save()
+            usercache.bump_image(image)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -300,8 +446,8 @@ class ImageDetailView(generics.RetrieveAPIView, UpdateAPIView, generics.DestroyA
         """
         image = self.get_image(pk)
         self.check_object_permissions(request, image)
-        image.file.delete(save=True)
-        image.delete()
+        usercache.bump_image(image)
+        image.delete()  # the file is released by signals.release_image_file
         return Response({"status": "Image deleted"}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -336,15 +482,20 @@ class ImageVoteView(UpdateAPIView):
         self.check_object_permissions(request, image)
         user: User = request.user
 
-        user_vote: Vote = image.vote_to_image.filter(user=user).first()
-
         serializer = VoteCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         action = serializer.validated_data['type']
 
+        if settings.VOTE_WRITE_BEHIND:
+            return self.buffer_vote(image, user, action)
+
+        user_vote: Vote = image.vote_to_image.filter(user=user).first()
+
         if action == 'undo' and user_vote is None:
             return Response({'error': 'user has not voted'}, status=status.HTTP_400_BAD_REQUEST)
 
+        metrics.incr('image_votes', type=action)
+
         if action in ('up', 'down'):
             upvote = action == 'up'
             if user_vote is None:
@@ -352,11 +503,31 @@ class ImageVoteView(UpdateAPIView):
             else:
                 user_vote.upvote = upvote
             user_vote.save()
+            countstream.changed(image.pk)
+            usercache.bump(user.pk, image.user_id)
             return Response({'message': 'user voted the image'}, status=status.HTTP_201_CREATED)
         else:
             user_vote.delete()
+            countstream.changed(image.pk)
+            usercache.bump(user.pk, image.user_id)
             return Response({'message': 'user vote removed'}, status=status.HTTP_201_CREATED)
 
+    def buffer_vote(self, image: Image, user: User, action: str) -> Response:
+        """
+        Records the vote for flush_votes, which writes it and publishes the new counts.
+        """
+        pending = votebuffer.pending_vote(image.pk, user.pk)
+        voted = pending != votebuffer.UNDO if pending is not None else image.vote_to_image.filter(user=user).exists()
+        if action == 'undo' and not voted:
+            return Response({'error': 'user has not voted'}, status=status.HTTP_400_BAD_REQUEST)
+
+        metrics.incr('image_votes', type=action)
+        votebuffer.record(image.pk, user.pk, action)
+        usercache.bump(user.pk)  # the owner sees the counts after the flush
+        if action in ('up', 'down'):
+            return Response({'message': 'user voted the image'}, status=status.HTTP_201_CREATED)
+        return Response({'message': 'user vote removed'}, status=status.HTTP_201_CREATED)
+
 
 class UserFavouriteImagesView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -432,16 +603,21 @@ class ImageFavouriteView(UpdateAPIView):
         if action == 'remove' and favourite is None:
             return Response({'error': 'image is not in favourites'}, status=status.HTTP_400_BAD_REQUEST)
 
+        metrics.incr('image_favourites', type=action)
         if action == 'add':
             favourite = Favourite(image=image, user=user)
             favourite.save()
+            countstream.changed(image.pk)
+            usercache.bump(user.pk, image.user_id)
             return Response({'message': 'image is in favourites'}, status=status.HTTP_201_CREATED)
         else:
             favourite.delete()
+            countstream.changed(image.pk)
+            usercache.bump(user.pk, image.user_id)
             return Response({'message': 'image removed from favourites'}, status=status.HTTP_201_CREATED)
 
 
-class ImageReportListView(generics.ListAPIView, generics.CreateAPIView):
+class ImageReportListView(SparseFieldsMixin, generics.ListAPIView, generics.CreateAPIView):
     permission_classes = [ImageReportListViewPermission]
     serializer_class = ReportImageListSerilizer
     queryset = ReportImage.objects.all().order_by('id')
@@ -453,6 +629,7 @@ class ImageReportListView(generics.ListAPIView, generics.CreateAPIView):
         except Image.DoesNotExist:
             raise NotFound(detail="Image not found")
 
+    @swagger_auto_schema(manual_parameters=FIELDS_PARAMETERS)
     def get(self, request, pk, *args, **kwargs):
         '''
         Get all reports to image with pk=:id.
@@ -461,7 +638,8 @@ class ImageReportListView(generics.ListAPIView, generics.CreateAPIView):
         '''
         image = self.get_image(pk)
         self.check_permission_on_image(request, image)
-        queryset = self.filter_queryset(self.get_queryset().filter(image=image))
+        queryset = only_columns(self.get_queryset().filter(image=image), self.get_selected_fields())
+        queryset = self.filter_queryset(queryset)
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -491,6 +669,7 @@ class ImageReportListView(generics.ListAPIView, generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         user = self.request.user if self.request.user.is_authenticated else None
         serializer.save(user=user, image=image)
+        usercache.bump(image.user_id)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def check_permission_on_image(self, request, obj: Image):
@@ -499,38 +678,172 @@ class ImageReportListView(generics.ListAPIView, generics.CreateAPIView):
             raise PermissionDenied()
 
 
-class ImageTrendingListView(generics.ListAPIView):
+class ImageDuplicateListView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('distance', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Maximum number of differing bits of the 64 bit hashes"),
+        ],
+        responses={
+            200: ImageListSerializer(many=True),
+            400: "Bad request",
+            403: "Permission denied",
+            404: "Image not found",
+        },
+    )
+    def get(self, request, pk, format=None):
+        '''
+        Images looking like the image with id=pk, the most similar first. Every image has field distance.
+        Only admin can see duplicates.
+        '''
+        try:
+            distance = int(request.query_params.get('distance', settings.DUPLICATE_MAX_DISTANCE))
+        except ValueError:
+            distance = -1
+        if not 0 <= distance <= settings.DUPLICATE_SEARCH_MAX_DISTANCE:
+            return Response({'error': 'distance has to be 0 - {}'.format(settings.DUPLICATE_SEARCH_MAX_DISTANCE)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image_hash = ImageHash.objects.nocache().get(image_id=pk)
+        except ImageHash.DoesNotExist:
+            if not Image.objects.filter(pk=pk).exists():
+                raise NotFound(detail="Image not found")
+            raise NotFound(detail="Image hash not computed yet")
+
+        found = dict(duplicates.index.search(image_hash.phash, distance, exclude=image_hash.image_id))
+        # the index keeps deleted images until it is reloaded
+        images = sorted(Image.objects.filter(pk__in=found), key=lambda image: (found[image.pk], image.pk))
+        data = ImageListSerializer(images, many=True, context={'request': request}).data
+        for item in data:
+            item['distance'] = found[item['id']]
+        return Response(data)
+
+
+class ImageSimilarListView(APIView):
+    permission_classes = [ImageDetailViewPermission]
+
+    @swagger_auto_schema(
+        responses={
+            200: ImageListSerializer(many=True),
+            403: "Permission denied",
+            404: "Image not found",
+        },
+    )
+    def get(self, request, pk, format=None):
+        '''
+        Public images which look like the image with id=pk, the most similar first. Every image has field similarity.
+        If image is private, user has to be the owner of the image or admin.
+        '''
+        try:
+            image = Image.objects.get(pk=pk)
+        except Image.DoesNotExist:
+            raise NotFound(detail="Image not found")
+        self.check_object_permissions(request, image)
+
+        found = similarity.similar_images(image.pk)
+        if found is None:
+            raise NotFound(detail="Image features not computed yet")
+        scores = dict(found)
+        # cached candidates may have been deleted or made private since
+        images = sorted(Image.objects.filter(pk__in=scores, public=True), key=lambda image: -scores[image.pk])
+        data = ImageListSerializer(images[:settings.SIMILAR_IMAGES_COUNT], many=True, context={'request': request}).data
+        for item in data:
+            item['similarity'] = round(scores[item['id']], 4)
+        return Response(data)
+
+
+class TagListView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('prefix', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Only tags starting with prefix"),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Maximum number of tags"),
+        ],
+        responses={
+            200: "Tags with number of images",
+            400: "Bad request",
+        },
+    )
+    def get(self, request, format=None):
+        '''
+        Tags with number of images having them, the most used first.
+        Counts of admin include private images, others count only public images.
+        '''
+        try:
+            limit = int(request.query_params.get('limit', settings.TAG_FACETS_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= settings.TAG_FACETS_MAX:
+            return Response({'error': 'limit has to be 1 - {}'.format(settings.TAG_FACETS_MAX)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        prefix = tags.normalize(request.query_params.get('prefix', ''))
+        counts = tags.facet_counts(not request.user.is_staff, limit, prefix)
+        return Response([{'name': name, 'count': count} for name, count in counts])
+
+
+def trending(queryset):
+    date_from = timezone.now() - datetime.timedelta(days=1)
+    # the condition is part of the join, so only the vote partitions of the last day are scanned
+    q = queryset.annotate(
+        recent_votes=FilteredRelation('vote_to_image', condition=Q(vote_to_image__created_at__gte=date_from))
+    ).annotate(
+        count=Count('recent_votes__user_id', distinct=True)
+    ).order_by('-count')
+
+    return q
+
+
+class ImageTrendingListView(RowsListMixin, generics.ListAPIView):
     queryset = Image.objects.all()
     serializer_class = ImageListSerializer
-    pagination_class = DefaultPagination
+    values_of = listing.image_values
+    rows_of = listing.image_rows
+    pagination_class = CappedCountPagination
     filterset_class = ImageFilter
     ordering_fields = ['created_at', 'upvote_count']
     permission_classes = [permissions.AllowAny]
 
+    @swagger_auto_schema(manual_parameters=FIELDS_PARAMETERS)
     def get(self, request, *args, **kwargs):
         '''
         Images sorted by number of votes in last 24 hours. All public images are here.
         '''
-        queryset = self.filter_queryset(self.get_queryset())
+        return self.list(request, *args, **kwargs)
 
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+    def get_queryset(self):
+        return trending(self.queryset)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+
+class FeedView(RowsListMixin, generics.ListAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = ImageListSerializer
+    values_of = listing.image_values
+    rows_of = listing.image_rows
+    pagination_class = DefaultPagination
+    # the order is the score of the candidates, which are no queryset to filter
+    filter_backends = []
+
+    @swagger_auto_schema(
+        manual_parameters=FIELDS_PARAMETERS,
+        responses={
+            # 200 is generated properly with pagination
+            401: "Unauthorized",
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        '''
+        Public images liked by users who like the same images as the authenticated user, the best first.
+        Users without upvotes and favourites get trending images.
+        '''
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        # self.request.query_params.get(,None)
-        date_from = timezone.now() - datetime.timedelta(days=1)
-        q = self.queryset \
-            .annotate(
-            count=Count(
-                'vote_to_image__user_id',
-                filter=Q(vote_to_image__created_at__gte=date_from),
-                distinct=True
-            )
-        ).order_by('-count')
-
-        return q
+        candidates = feed.user_candidates(self.request.user.pk)
+        if candidates:
+            return feed.FeedImages(candidates)
+        return trending(Image.objects.filter(public=True))
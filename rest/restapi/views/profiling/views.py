@@ -0,0 +1,28 @@
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import permissions
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ...profiling import load_profile
+
+
+class ProfileDetailView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(
+        responses={
+            200: "Profile with call tree and sql statements",
+            403: "Permission denied",
+            404: "Profile not found",
+        },
+    )
+    def get(self, request, profile_id, format=None):
+        '''
+        Returns profile of a request made with X-Profile header or _profile query parameter.
+        Only admin can profile requests and see profiles.
+        '''
+        profile = load_profile(profile_id)
+        if profile is None:
+            raise NotFound(detail="Profile not found")
+        return Response(profile)
@@ -1,13 +1,22 @@
+from typing import List, Optional
+
 from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate, logout
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, QuerySet, Subquery
+from django.db.models.functions import Coalesce
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics
 from rest_framework import permissions
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 
 from ..update_api_view import UpdateAPIView
+from ...fieldsets import FIELDS_PARAMETERS, SparseFieldsMixin, only_columns
+from ...models import Comment, Favourite, Image, Vote
+from ...pagination import EstimatedCountPagination
 from ...serializers import UserRegisterSerializer, \
     LoginSerializer, AuthenticationUserSerializer, UserUpdateSerializer, UserSerializer, SocialSerializer
 
@@ -132,17 +141,115 @@ class LogoutView(APIView):
                         status=status.HTTP_200_OK)
 
 
-class UserList(generics.ListAPIView):
+# relation of the user and its model by expand name
+EXPANSIONS = {
+    'images': ('images', Image),
+    'comments': ('comment_to_user', Comment),
+    'votes': ('vote_to_user', Vote),
+    'favourites': ('favourite_to_user', Favourite),
+}
+EXPAND_PARAMETER = openapi.Parameter(
+    'expand', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+    description='comma separated relations to nest: {}'.format(', '.join(EXPANSIONS)))
+
+
+def _count(queryset: QuerySet) -> Coalesce:
+    """
+    Number of rows of queryset belonging to the user of the outer row, a correlated subquery does not multiply
+    rows like joins of several relations would.
+    """
+    counts = queryset.filter(user=OuterRef('pk')).order_by().values('user').annotate(count=Count('pk'))
+    return Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0)
+
+
+def with_activity_counts(queryset: QuerySet, fields: Optional[List[str]] = None) -> QuerySet:
+    """
+    Users of queryset with the counts of fields annotated, all counts when fields are not given.
+    """
+    counts = {
+        'image_count': lambda: _count(Image.objects.all()),
+        'comment_count': lambda: _count(Comment.objects.all()),
+        'upvote_count': lambda: _count(Vote.objects.filter(upvote=True)),
+        'downvote_count': lambda: _count(Vote.objects.filter(upvote=False)),
+        'favourite_count': lambda: _count(Favourite.objects.all()),
+    }
+    return queryset.annotate(**{name: count() for name, count in counts.items() if fields is None or name in fields})
+
+
+def newest_prefetch(name: str) -> Prefetch:
+    """
+    Prefetches the USER_EXPAND_LIMIT newest rows of the relation for every user in one query.
+    """
+    relation, model = EXPANSIONS[name]
+    newest = model.objects.filter(user=OuterRef('user')).order_by('-pk').values('pk')[:settings.USER_EXPAND_LIMIT]
+    return Prefetch(relation, queryset=model.objects.nocache().filter(pk__in=Subquery(newest)).order_by('-pk'))
+
+
+class UserExpandMixin:
+    """
+    Users with activity counts, relations given by ?expand= are prefetched and nested. Only the columns, counts
+    and relations of the fields selected by SparseFieldsMixin are read.
+    """
+
+    def get_expand(self) -> List[str]:
+        request = getattr(self, 'request', None)
+        if request is None:
+            return []
+        names = [name for name in request.query_params.get('expand', '').split(',') if name]
+        unknown = [name for name in names if name not in EXPANSIONS]
+        if unknown:
+            raise ValidationError({'expand': 'unknown relations: {}'.format(', '.join(unknown))})
+        return list(dict.fromkeys(names))
+
+    def get_queryset(self):
+        # counts depend on other tables than the cached query would be invalidated by
+        fields = self.get_selected_fields()
+        queryset = with_activity_counts(only_columns(User.objects.nocache().order_by('pk'), fields), fields)
+        return queryset.prefetch_related(*[newest_prefetch(name) for name in self.get_expand()
+                                           if fields is None or name in fields])
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
+
+class UserList(SparseFieldsMixin, UserExpandMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAdminUser]
-    queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = EstimatedCountPagination
+
+    @swagger_auto_schema(
+        manual_parameters=[EXPAND_PARAMETER] + FIELDS_PARAMETERS,
+        responses={
+            400: "Bad request",
+            403: "Permission denied",
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        '''
+        Lists users with counts of their images, comments, votes and favourites. Only for admin.
+        '''
+        return super().get(request, *args, **kwargs)
 
 
-class UserDetail(generics.RetrieveAPIView):
+class UserDetail(SparseFieldsMixin, UserExpandMixin, generics.RetrieveAPIView):
     permission_classes = [permissions.IsAdminUser]
-    queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    @swagger_auto_schema(
+        manual_parameters=[EXPAND_PARAMETER] + FIELDS_PARAMETERS,
+        responses={
+            400: "Bad request",
+            403: "Permission denied",
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        '''
+        Returns a user with counts of their images, comments, votes and favourites. Only for admin.
+        '''
+        return super().get(request, *args, **kwargs)
+
 
 from rest_framework import status
 from rest_framework.response import Response
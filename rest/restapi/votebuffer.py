@@ -0,0 +1,220 @@
+"""
+Write-behind buffer of votes, used when VOTE_WRITE_BEHIND is on.
+
+PUT images/:id/vote records the vote in redis and answers without writing the Vote table. The latest action of a
+user (up, down or undo) is a field of the hash of the image (votes:pending:<image>) and of the hash of the user
+(votes:user:<user>, which reads of the user merge), the image goes into the set votes:dirty. flush_votes writes
+pending votes to the database in batches every --interval-ms milliseconds. Only the final state of a vote is
+written, so writing the same hash twice gives the same rows.
+
+A flush claims an image by renaming its hash to votes:flushing:<image>, applies the claimed votes in one
+transaction and deletes the hash after the commit. When the flusher or the database fails in between, the claimed
+hash stays and the next flush applies it again before newer votes of the image. Votes acknowledged but not flushed
+exist only in redis, they survive a restart of redis as far as its persistence (appendonly) does.
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from cacheops import invalidate_obj
+from cacheops.redis import redis_client
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from . import countstream, usercache
+from .feed import record_like
+from .models import Image, Vote
+
+UP, DOWN, UNDO = 'up', 'down', 'undo'
+DIRTY_KEY = 'votes:dirty'
+CLAIMED_KEY = 'votes:claimed'  # images with a flushing hash
+
+# KEYS: pending of the image, pending of the user, dirty images; ARGV: user id, image id, action
+RECORD = """
+redis.call('hset', KEYS[1], ARGV[1], ARGV[3])
+redis.call('hset', KEYS[2], ARGV[2], ARGV[3])
+redis.call('sadd', KEYS[3], ARGV[2])
+"""
+
+# KEYS: pending of the image, flushing of the image, dirty images, claimed images; ARGV: image id
+CLAIM = """
+if redis.call('exists', KEYS[2]) == 0 then
+    redis.call('srem', KEYS[3], ARGV[1])
+    if redis.call('exists', KEYS[1]) == 0 then
+        redis.call('srem', KEYS[4], ARGV[1])
+        return {}
+    end
+    redis.call('rename', KEYS[1], KEYS[2])
+    redis.call('sadd', KEYS[4], ARGV[1])
+end
+return redis.call('hgetall', KEYS[2])
+"""
+
+# KEYS: flushing of the image, claimed images; ARGV: image id, user id, action, user id, action, ...
+RELEASE = """
+for i = 2, #ARGV, 2 do
+    local key = 'votes:user:' .. ARGV[i]
+    if redis.call('hget', key, ARGV[1]) == ARGV[i + 1] then
+        redis.call('hdel', key, ARGV[1])
+    end
+end
+redis.call('del', KEYS[1])
+redis.call('srem', KEYS[2], ARGV[1])
+"""
+
+
+@lru_cache(maxsize=None)
+def _record_script():
+    return redis_client.register_script(RECORD)
+
+
+@lru_cache(maxsize=None)
+def _claim_script():
+    return redis_client.register_script(CLAIM)
+
+
+@lru_cache(maxsize=None)
+def _release_script():
+    return redis_client.register_script(RELEASE)
+
+
+def pending_key(image_id: int) -> str:
+    return 'votes:pending:{}'.format(image_id)
+
+
+def flushing_key(image_id: int) -> str:
+    return 'votes:flushing:{}'.format(image_id)
+
+
+def user_key(user_id: int) -> str:
+    return 'votes:user:{}'.format(user_id)
+
+
+def record(image_id: int, user_id: int, action: str):
+    _record_script()(keys=[pending_key(image_id), user_key(user_id), DIRTY_KEY], args=[user_id, image_id, action])
+
+
+def user_pending(user_id: int) -> Dict[int, str]:
+    """
+    Actions of the user not written to the database yet by image id.
+    """
+    return {int(image_id): action.decode() for image_id, action in redis_client.hgetall(user_key(user_id)).items()}
+
+
+def pending_vote(image_id: int, user_id: int) -> Optional[str]:
+    action = redis_client.hget(user_key(user_id), image_id)
+    return action.decode() if action is not None else None
+
+
+def voted_images(queryset: QuerySet, user_id: int, upvote: Optional[bool] = None) -> QuerySet:
+    """
+    Images of queryset voted by the user, only up or down votes when upvote is given, pending votes included.
+    """
+    stored = Q(vote_to_image__user_id=user_id)
+    if upvote is not None:
+        stored &= Q(vote_to_image__upvote=upvote)
+    pending = user_pending(user_id) if settings.VOTE_WRITE_BEHIND else {}
+    if not pending:
+        return queryset.filter(stored)
+    matching = [image_id for image_id, action in pending.items()
+                if action != UNDO and (upvote is None or (action == UP) == upvote)]
+    return queryset.filter((stored & ~Q(pk__in=list(pending))) | Q(pk__in=matching)).distinct()
+
+
+def flush(batch_size: int) -> int:
+    """
+    Writes pending votes of up to batch_size images, images a failed flush claimed first. Returns the number of
+    images.
+    """
+    image_ids = [int(image_id) for image_id in redis_client.srandmember(CLAIMED_KEY, batch_size)]
+    if len(image_ids) < batch_size:
+        image_ids += [int(image_id) for image_id in redis_client.srandmember(DIRTY_KEY, batch_size - len(image_ids))
+                      if int(image_id) not in image_ids]
+    claimed = {}
+    for image_id in image_ids:
+        votes = _claim_script()(keys=[pending_key(image_id), flushing_key(image_id), DIRTY_KEY, CLAIMED_KEY],
+                                args=[image_id])
+        votes = dict(zip(votes[::2], votes[1::2]))
+        if votes:
+            claimed[image_id] = {int(user_id): action.decode() for user_id, action in votes.items()}
+    if not claimed:
+        return 0
+
+    saved, deleted = apply(claimed)
+    for vote in saved + deleted:
+        invalidate_obj(vote)
+    for vote in saved:
+        if vote.upvote:
+            record_like(vote.user_id, vote.image_id)
+    for image_id, votes in claimed.items():
+        args = [image_id]
+        for user_id, action in votes.items():
+            args += [user_id, action]
+        _release_script()(keys=[flushing_key(image_id), CLAIMED_KEY], args=args)
+        countstream.changed(image_id)
+    # counts in the lists of the owners and of the voters changed
+    usercache.bump(*Image.objects.filter(pk__in=list(claimed)).values_list('user_id', flat=True),
+                   *{user_id for votes in claimed.values() for user_id in votes})
+    return len(claimed)
+
+
+def insert_missing(votes: List[Vote], batch_size: int = 100):
+    """
+    Inserts the votes whose image and user have no vote yet, a vote written meanwhile without the buffer is kept.
+    ON CONFLICT (bulk_create with ignore_conflicts) does not see the key table of a partitioned Vote table, whose
+    trigger raises the unique violation, so existing votes are skipped by NOT EXISTS. A vote committed between the
+    check and the insert still fails the flush, the next flush reads it and updates it.
+    """
+    fields = [Vote._meta.get_field(name) for name in ('image', 'user', 'upvote', 'created_at')]
+    q = connection.ops.quote_name
+    image, user = q(fields[0].column), q(fields[1].column)
+    now = timezone.now()
+    for start in range(0, len(votes), batch_size):
+        batch = votes[start:start + batch_size]
+        params = []
+        for vote in batch:
+            vote.created_at = vote.created_at or now
+            params += [field.get_db_prep_save(getattr(vote, field.attname), connection) for field in fields]
+        # VALUES names its columns column1, column2, ...
+        sql = ('INSERT INTO {table} ({columns}) SELECT v.column1, v.column2, v.column3, v.column4 '
+               'FROM (VALUES {rows}) v WHERE NOT EXISTS '
+               '(SELECT 1 FROM {table} t WHERE t.{image} = v.column1 AND t.{user} = v.column2)').format(
+            table=q(Vote._meta.db_table), columns=', '.join(q(field.column) for field in fields),
+            rows=', '.join(['(%s, %s, %s, %s)'] * len(batch)), image=image, user=user)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def apply(claimed: Dict[int, Dict[int, str]]) -> Tuple[List[Vote], List[Vote]]:
+    """
+    Makes Vote rows match the final actions by image and user in one transaction, returns the created or changed
+    and the deleted votes. Votes of deleted images or users are dropped.
+    """
+    user_ids = {user_id for votes in claimed.values() for user_id in votes}
+    with transaction.atomic():
+        image_ids = set(Image.objects.nocache().filter(pk__in=list(claimed)).values_list('pk', flat=True))
+        user_ids = set(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        existing = {(vote.image_id, vote.user_id): vote for vote in
+                    Vote.objects.nocache().select_for_update().filter(image_id__in=image_ids, user_id__in=user_ids)}
+        created, changed, deleted = [], [], []
+        for image_id, votes in claimed.items():
+            if image_id not in image_ids:
+                continue
+            for user_id, action in votes.items():
+                if user_id not in user_ids:
+                    continue
+                vote = existing.get((image_id, user_id))
+                if action == UNDO:
+                    if vote is not None:
+                        deleted.append(vote)
+                elif vote is None:
+                    created.append(Vote(image_id=image_id, user_id=user_id, upvote=action == UP))
+                elif vote.upvote != (action == UP):
+                    vote.upvote = action == UP
+                    changed.append(vote)
+        insert_missing(created)
+        Vote.objects.bulk_update(changed, ['upvote'])
+        Vote.objects.filter(pk__in=[vote.pk for vote in deleted]).delete()
+    return created + changed, deleted
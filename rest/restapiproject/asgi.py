@@ -0,0 +1,24 @@
+"""
+ASGI config for restapiproject project.
+
+Serves server sent events (images/:id/comment/stream, images/counts/stream), every other request is passed
+to Django.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'restapiproject.settings')
+
+django_application = get_asgi_application()
+
+# models are loaded by django setup
+from restapi.commentstream import CommentStream  # noqa: E402
+from restapi.countstream import CountStream  # noqa: E402
+from restapi.sse import StreamRouter  # noqa: E402
+
+application = StreamRouter(django_application, [CommentStream(), CountStream()])
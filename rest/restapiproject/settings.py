@@ -56,11 +56,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'restapi.middleware.TracingMiddleware',
+    'restapi.middleware.MetricsMiddleware',
+    'restapi.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'restapi.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
@@ -108,15 +112,32 @@ LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
 
+    'filters': {
+        # adds trace_id and span_id of the current request span
+        'tracecontext': {
+            '()': 'restapi.tracing.TraceContextFilter',
+        },
+        # per logger token bucket, see restapi.log.RateLimitFilter
+        'ratelimit': {
+            '()': 'restapi.log.RateLimitFilter',
+            'rate': int(os.getenv('LOG_RATE_LIMIT', 20)),
+            'burst': int(os.getenv('LOG_RATE_BURST', 100)),
+            'sample_rate': float(os.getenv('LOG_INFO_SAMPLE_RATE', 1.0)),
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
+            'filters': ['ratelimit'],
         },
         'graypy': {
             'level': 'INFO',
-            'class': 'graypy.GELFUDPHandler',
+            'class': 'restapi.log.AsyncGELFHandler',
             'host': 'graylog',
             'port': 12201,
+            'queue_size': 10000,
+            'batch_size': 200,
+            'filters': ['ratelimit', 'tracecontext'],
         },
     },
     'loggers': {
@@ -200,7 +221,7 @@ AUTHENTICATION_BACKENDS = (
 )
 
 # MINIO
-DEFAULT_FILE_STORAGE = "minio_storage.storage.MinioMediaStorage"
+DEFAULT_FILE_STORAGE = "restapi.storage.MediaStorage"
 MINIO_STORAGE_ENDPOINT = 'minio:9000'
 MINIO_STORAGE_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minio")
 MINIO_STORAGE_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minio123")
@@ -208,6 +229,53 @@ MINIO_STORAGE_USE_HTTPS = False
 MINIO_STORAGE_MEDIA_BUCKET_NAME = 'django-media'
 MINIO_STORAGE_AUTO_CREATE_MEDIA_BUCKET = True
 MINIO_STORAGE_MEDIA_URL = '{}/django-media'.format(os.getenv('MINIO_STORAGE_ENDPOINT', 'localhost:9001'))
+MINIO_STORAGE_URL_CACHE_SIZE = 100000
+MINIO_STORAGE_PRESIGNED_URL_MAX_AGE = 60 * 60  # used only with MINIO_STORAGE_MEDIA_USE_PRESIGNED
+# presigned upload urls are signed for the endpoint clients see
+MINIO_STORAGE_PUBLIC_ENDPOINT = os.getenv('MINIO_STORAGE_ENDPOINT', 'localhost:9001')
+MINIO_STORAGE_PUBLIC_USE_HTTPS = os.getenv('MINIO_STORAGE_PUBLIC_USE_HTTPS', 'False') == 'True'
+MINIO_STORAGE_REGION = os.getenv('MINIO_STORAGE_REGION', 'us-east-1')
+
+# UPLOADS
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv('IMAGE_UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+IMAGE_UPLOAD_ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 40 * 1000 * 1000))
+IMAGE_UPLOAD_SNIFF_BYTES = 256 * 1024  # the image header has to be in the first bytes (jpeg exif/icc included)
+IMAGE_UPLOAD_TICKET_TIMEOUT = 60 * 15
+# blob keys are content addressed, their content never changes
+BLOB_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+IMAGE_METADATA_WORKERS = int(os.getenv('IMAGE_METADATA_WORKERS', 2))  # threads of each web worker
+
+DUPLICATE_MAX_DISTANCE = 6  # differing bits of 64 bit hashes flagging an upload as possible duplicate
+DUPLICATE_SEARCH_MAX_DISTANCE = 16
+DUPLICATE_INDEX_REFRESH = 5  # seconds between loads of new hashes
+DUPLICATE_INDEX_RELOAD = 60 * 60  # seconds between full loads dropping deleted images
+
+SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH', os.path.join(BASE_DIR, 'data', 'similarity.index'))
+SIMILAR_IMAGES_COUNT = 20
+SIMILAR_IMAGES_CANDIDATES = 100  # cached per image, private and deleted images are filtered out of them
+SIMILAR_IMAGES_CACHE_TIMEOUT = 60 * 60
+
+FEED_NEIGHBOURS = 50  # best co-liked images kept for every image
+FEED_MAX_LIKES_PER_USER = 200  # newest likes of a user counted, co-occurrence grows with their square
+FEED_CANDIDATES = 500
+FEED_USER_TIMEOUT = 60 * 60 * 6
+
+IMAGE_MAX_TAGS = 20
+IMAGE_TITLE_TAGS = 5
+TAG_FACETS_LIMIT = 50
+TAG_FACETS_MAX = 1000
+TAG_PREFIX_CANDIDATES = 1000  # tags starting with a prefix whose counts are compared
+TAG_QUERY_MAX_CANDIDATES = 10000  # newest images matching a tag query which are filtered further
+
+# STORAGE GC - deleted rows enqueue object keys, collect_storage_garbage deletes them
+STORAGE_GC_BATCH_SIZE = 1000
+STORAGE_GC_GRACE = 60 * 10  # tombstones younger than this are not collected
+STORAGE_GC_RETRY_BASE = 60
+STORAGE_GC_RETRY_MAX = 60 * 60 * 6
+STORAGE_GC_SWEEP_MIN_AGE = 60 * 60 * 24  # younger objects may belong to uploads in progress
+STORAGE_GC_SWEEP_INTERVAL = 60 * 60 * 24
 
 # redis
 CACHEOPS_REDIS = "redis://redis:6379/"
@@ -219,9 +287,74 @@ CACHEOPS = {
     'auth.user': {'ops': 'get', 'timeout': 60 * 15},
     'auth.*': {'ops': ('fetch', 'get')},
     'auth.permission': {'ops': 'all'},
+    'authtoken.token': {'ops': 'get'},  # token authentication of every api request
     'restapi.*': {'ops': 'all'},
 }
 
+# STREAMS - server sent events served by restapiproject.asgi, events go through redis
+STREAM_REDIS = CACHEOPS_REDIS
+STREAM_KEEPALIVE = 15
+STREAM_QUEUE_SIZE = 100  # events waiting for a slow listener before it is disconnected
+STREAM_RETRY = 3000  # milliseconds before EventSource reconnects
+COMMENT_STREAM_BACKLOG = 1000  # events per image for resuming with since
+COMMENT_STREAM_TIMEOUT = 60 * 60 * 24
+COUNT_STREAM_INTERVAL = 1  # seconds, changes of an image in between are sent as one message
+COUNT_STREAM_MAX_IDS = 100
+
+# VOTES - with write-behind votes are acknowledged from redis and written by flush_votes, see restapi/votebuffer.py
+VOTE_WRITE_BEHIND = os.getenv('VOTE_WRITE_BEHIND', 'False') == 'True'
+VOTE_FLUSH_BATCH = 500  # images per transaction
+
+# USERS
+USER_EXPAND_LIMIT = 100  # newest rows of each relation nested by ?expand= of users/
+ME_CACHE_TIMEOUT = 60 * 5  # seconds responses of me/images lists are cached per user, 0 turns it off
+
+# ADMIN
+ADMIN_INLINE_PER_PAGE = 20
+
+# COUNTS - see restapi/counting.py
+ESTIMATED_COUNT_THRESHOLD = 100000  # rows from which planner estimates replace COUNT(*)
+PAGINATION_COUNT_CAP = 10000
+PAGINATION_COUNT_TIMEOUT = 30  # seconds counts which are not exact are cached
+
+# PARTITIONS - monthly partitions of votes and comments by created_at, see restapi/partitions.py
+PARTITION_MONTHS_AHEAD = 3
+VOTE_ARCHIVE_AFTER_MONTHS = int(os.getenv('VOTE_ARCHIVE_AFTER_MONTHS', 0))  # 0 keeps every partition attached
+COMMENT_ARCHIVE_AFTER_MONTHS = int(os.getenv('COMMENT_ARCHIVE_AFTER_MONTHS', 0))
+
+# COMPRESSION - brotli or gzip by Accept-Encoding, see restapi/compression.py
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True') == 'True'
+COMPRESSION_MIN_SIZE = 1024  # bytes, smaller bodies are sent as they are
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_TIMEOUT = 60 * 5  # seconds compressed bodies of cacheable responses are kept
+COMPRESSION_CACHE_MAX_SIZE = 4 * 1024 * 1024
+
+# METRICS - influx line protocol over udp to telegraf socket_listener
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_HOST = os.getenv('METRICS_HOST', 'telegraf')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 8094))
+METRICS_PREFIX = 'restapi_'
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+
+# PROFILING - superuser sends X-Profile header or _profile query parameter
+PROFILE_TIMEOUT = 60 * 60 * 24
+PROFILE_TOP_FUNCTIONS = 50
+PROFILE_TREE_DEPTH = 40
+PROFILE_TREE_MIN_SHARE = 0.01  # hide branches below 1% of the request time
+
+# TRACING - zipkin v2 spans exported to a json lines file or a zipkin compatible collector
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'False') == 'True'
+TRACING_SERVICE_NAME = 'rest'
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', 1.0))
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'file')  # file / zipkin
+TRACING_FILE = os.getenv('TRACING_FILE', os.path.join(BASE_DIR, 'traces.jsonl'))
+TRACING_ZIPKIN_URL = os.getenv('TRACING_ZIPKIN_URL', 'http://collector:9411/api/v2/spans')
+TRACING_SLOW_REQUEST_MS = int(os.getenv('TRACING_SLOW_REQUEST_MS', 1000))
+TRACING_SLOW_SPAN_MS = int(os.getenv('TRACING_SLOW_SPAN_MS', 250))
+TRACING_MAX_SPANS = 2000
+TRACING_MAX_STATEMENT_LENGTH = 2000
+
 # SOCIAL AUTHENTICATION SETTINGS
 
 SOCIAL_AUTH_POSTGRES_JSONFIELD = True
@@ -229,7 +362,8 @@ SOCIAL_AUTH_POSTGRES_JSONFIELD = True
 SOCIAL_AUTH_FACEBOOK_KEY = os.getenv('FACEBOOK_KEY', '3178128918884628')
 SOCIAL_AUTH_FACEBOOK_SECRET = os.getenv('FACEBOOK_SECRET', 'eff1275d9a8a002bd58b76289856f0eb')
 
-SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = os.getenv('GOOGLE_KEY', '148594431939-rvr7vi6m1e5j01aaiipsbrp11bolf1ln.apps.googleusercontent.com')
+SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = os.getenv('GOOGLE_KEY',
+                                          '148594431939-rvr7vi6m1e5j01aaiipsbrp11bolf1ln.apps.googleusercontent.com')
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = os.getenv('GOOGLE_SECRET', 'wpSmPdzbxx08otEvWZmt2Fw8')
 
 SOCIAL_AUTH_LOGIN_REDIRECT_URL = '/images/'
@@ -237,7 +371,8 @@ SOCIAL_AUTH_LOGIN_REDIRECT_URL = '/images/'
 
 
 
-# Define SOCIAL_AUTH_FACEBOOK_SCOPE to get extra permissions from facebook. Email is not sent by default, to get it, you must request the email permission:
+# Define SOCIAL_AUTH_FACEBOOK_SCOPE to get extra permissions from facebook. Email is not sent by default, to get it,
+# you must request the email permission:
 SOCIAL_AUTH_FACEBOOK_SCOPE = ['email']
 SOCIAL_AUTH_FACEBOOK_PROFILE_EXTRA_PARAMS = {
     'fields': 'id, name, email'}